@@ -2,7 +2,9 @@ import os, shutil  # for maniplulating files
 import csv  # for writing files
 import sys  # for exit codes
 import argparse, configparser  # for manipulating inputs
+import re  # for finding channels in the config file
 from datetime import datetime  # for datestamping files
+from concurrent.futures import ThreadPoolExecutor  # for moving files
 
 
 def input_parser():
@@ -53,13 +55,101 @@ def input_parser():
         'C1': config_file['EXPERIMENT INFO']['C1'],
         'C2': config_file['EXPERIMENT INFO']['C2'],
         'C3': config_file['EXPERIMENT INFO']['C3'],
+        'channels': [key.upper() for key in config_file['EXPERIMENT INFO']
+                     if re.fullmatch(r'c\d+', key)],
         'num_groups': int(config_file['EXPERIMENT INFO']['num_groups']),
-        'group_names': [config_file['EXPERIMENT INFO']['group_names']]
+        'group_names': [name.strip() for name in 
+                        config_file['EXPERIMENT INFO']['group_names'].split(',')
+                        if name.strip() != ''],
+        'loc_bkgd_radius': config_file.getint(
+            'COLOCALIZATION PARAMETERS', 'loc_bkgd_radius', fallback=5),
+        'loc_bkgd_method': config_file.get(
+            'COLOCALIZATION PARAMETERS', 'loc_bkgd_method',
+            fallback='dilation').lower(),
+        'overlap_threshold': config_file.getfloat(
+            'COLOCALIZATION PARAMETERS', 'overlap_threshold', fallback=0.9),
+        'num_workers': config_file.getint(
+            'BATCH PARAMETERS', 'num_workers', fallback=1),
+        'cache_directory': config_file.get(
+            'FILE LOCATIONS', 'cache_directory', fallback=None) or None,
+        'cache_max_bytes': int(config_file.getfloat(
+            'BATCH PARAMETERS', 'cache_max_gb', fallback=0) * 1e9) or None,
+        'qc_overlays': config_file.getboolean(
+            'BATCH PARAMETERS', 'qc_overlays', fallback=False),
+        'qc_downsample': config_file.getint(
+            'BATCH PARAMETERS', 'qc_downsample', fallback=4),
+        'num_prefetch': config_file.getint(
+            'BATCH PARAMETERS', 'num_prefetch', fallback=2),
+        'mmap': config_file.getboolean(
+            'BATCH PARAMETERS', 'mmap', fallback=False),
+        'profile': config_file.getboolean(
+            'BATCH PARAMETERS', 'profile', fallback=False),
+        'sort_in_place': config_file.getboolean(
+            'BATCH PARAMETERS', 'sort_in_place', fallback=False),
+        'num_move_threads': config_file.getint(
+            'BATCH PARAMETERS', 'num_move_threads', fallback=8),
+        'results_format': config_file.get(
+            'BATCH PARAMETERS', 'results_format', fallback='csv').lower()
     }
     return inputs
 
 
-def sort_images(directory):
+def index_channels(directory, channels=('C1', 'C2', 'C3'),
+                   file_type='.tif', mask_suffix='_seg.npy'):
+    """
+    PARAMETERS
+    ----------
+    directory: str
+        This is a string that has the full file path to the directory 
+        containing the images.
+    channels: list
+        This list has the filename prefix of each channel.
+    file_type: str
+        This string is the file extension of images to keep.
+    mask_suffix: str
+        This string ends the names of the mask files of the images, e.g. 
+        the Cellpose masks 'C1-x_seg.npy' of 'C1-x.tif'.
+    
+    RETURNS
+    ----------
+    channel_index: dict
+        This dictionary has a list of the image filenames of each channel,
+        found in a single pass over the directory. Folders and hidden files
+        are skipped.
+    removed_files: list
+        This list has the files that are not images or masks of any channel.
+    mask_index: dict
+        This dictionary has a list of the mask filenames of each channel, 
+        which belong in the same folder as the images.
+    """
+    channel_index = {channel: [] for channel in channels}
+    mask_index = {channel: [] for channel in channels}
+    removed_files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            ext = os.path.splitext(entry.name)[-1].lower()
+            # the longest prefix wins, so 'C10' files are not put in 'C1'
+            channel = max((channel for channel in channels
+                           if entry.name.startswith(channel)),
+                          key=len, default=None)
+            if channel is None:
+                removed_files.append(entry.name)
+            elif ext == file_type:
+                channel_index[channel].append(entry.name)
+            elif entry.name.lower().endswith(mask_suffix):
+                mask_index[channel].append(entry.name)
+            else:
+                removed_files.append(entry.name)
+    for channel in channels:
+        channel_index[channel].sort()
+        mask_index[channel].sort()
+    return channel_index, sorted(removed_files), mask_index
+
+
+def sort_images(directory, in_place=False, num_threads=8,
+                channels=('C1', 'C2', 'C3')):
     """
     PARAMETERS
     ----------
@@ -67,136 +157,133 @@ def sort_images(directory):
         This is a string that has the full file path to the directory 
         containing all of the images to be analyzed. Format will change 
         based on operating system.
+    in_place: bool
+        If True, files are left where they are and only sorted in memory.
+        If False, images and their masks (_seg.npy) are moved into a sub 
+        folder for each channel, and other files into a 'removed_files' 
+        folder.
+    num_threads: int
+        This is the number of threads used to move files.
+    channels: list
+        This list has the filename prefix of each channel.
     
     RETURNS
     ----------
     full_paths: list
-        This list contains strings with the complete file paths of the three
-        folders containing images from each seperate channel.
+        This list contains strings with the complete file paths of the
+        folders containing images from each seperate channel. If in_place is
+        True, this is the directory itself for every channel.
+    
+    Running this again on a directory that was already sorted is safe: 
+    existing sub folders are reused and only new files are moved.
     """
-    # check that the directory exists
+    channels = list(channels)
+
+    # check that the directory exists, and sort files in one pass
     try: 
-        os.chdir(directory)
+        channel_index, removed_files, mask_index = index_channels(
+            directory, channels)
     except FileNotFoundError: 
         print(f'The directory given: {directory} could not be found.')
         sys.exit(1)
     
-    # remove non tif files from directory
-    files = [f for f in os.listdir(directory) if not f.startswith('.')]
-    removed_files = []
-    for file in files:
-        ext = os.path.splitext(file)[-1].lower()
-        if ext == '.tif':
-            pass
-        else:
-            removed_files.append(file)
+    if in_place:
+        if len(removed_files) != 0:
+            print(f"Some of the files in this directory are not images of a "
+                  f"channel and will be ignored: \n{removed_files}")
+        return [directory for channel in channels]
+
     if len(removed_files) == 0:
         print(f"No files were removed from this directory: {directory}")
-    elif len(removed_files) != 0:
+    else:
         print(f"Some of the files in this directory were removed because they"
               f" were not the right file type, they can be found in the "
-              f"'removed_files' folder: n/{removed_files}")
-    
-    # sort images by channel
-    C1_images = []
-    C2_images = []
-    C3_images = []
-    for file in files:
-        if file[0:2] == 'C1':
-            C1_images.append(file)
-        elif file[0:2] == 'C2':
-            C2_images.append(file)  
-        elif file[0:2] == 'C3':
-            C3_images.append(file)
-        else:
-            removed_files.append(file)
-
-    # make directories for each type of image
-    sub_dirs = ['C1', 'C2', 'C3', 'removed_files']
-    full_paths = []
-    for folder in sub_dirs:
-        folder = os.path.join(directory, folder)
-        os.mkdir(folder)
-        full_paths.append(folder)
+              f"'removed_files' folder: \n{removed_files}")
+
+    # make directories for each type of image, if they are not there yet
+    sub_dirs = channels + ['removed_files']
+    full_paths = [make_new_subfolder(directory, folder) for folder in sub_dirs]
         
     # move all files to their respective sub folders
-    for file in C1_images:
-        shutil.move(os.path.join(directory, file), 
-                    os.path.join(full_paths[0], file)
-                    )
-    for file in C2_images: 
-        shutil.move(os.path.join(directory, file), 
-                    os.path.join(full_paths[1], file)
-                    )  
-    for file in C3_images: 
-        shutil.move(os.path.join(directory, file), 
-                    os.path.join(full_paths[2], file)
-                    )
-    for file in removed_files: 
-        shutil.move(os.path.join(directory, file), 
-                    os.path.join(full_paths[3], file)
-                    )
+    sources = []
+    destinations = []
+    groups = [channel_index[channel] + mask_index[channel]
+              for channel in channels] + [removed_files]
+    for folder, files in zip(full_paths, groups):
+        for file in files:
+            sources.append(os.path.join(directory, file))
+            destinations.append(os.path.join(folder, file))
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(shutil.move, sources, destinations))
         
-    # get full file paths to return for only C1, C2 and C3
-    del full_paths[3]
+    # get full file paths to return for only the channels
+    del full_paths[-1]
     
     return full_paths
 
-def matching_channels(full_paths): # pipe into csv to output what images were matched? write csv in function?
+def matching_channels(full_paths, channels=None):
     """
     PARAMETERS
     ----------
     full_paths: list 
         This is a list that contains the full paths for folders containing
-        images from each of the three channels. Designed to be the return
-        of sort_images(). 
+        images from each channel, in the same order as channels. Designed to
+        be the return of sort_images(). 
+    channels: list
+        This list has the filename prefix of each channel, e.g. 
+        ['C1', 'C2', 'C3'] (the channels from the config file). By default
+        there is one channel 'C1', 'C2', ... for each folder.
         
     RETURNS
     ----------
     matched_images : list
         This is a list where each item is a list containing the images from 
-        each channel that are being paired.
+        each channel that are being paired, sorted by image ID.
+    match_report : dict
+        This dictionary has the groups that could not be matched, under 
+        'incomplete' (an image is missing in at least one channel) and 
+        'duplicate' (a channel has more than one image with the same ID). 
+        Each maps image ID to a dict of channel to the list of filenames.
+    
+    The image ID is the filename between the channel prefix and the file 
+    extension, so 'C1-x.tif', 'C2-x.TIF' and 'C3-x.tif' all have the ID '-x'.
+    Images are grouped by ID in a dictionary, so matching takes one pass 
+    over each folder.
     """
+    if channels is None:
+        channels = [f"C{number + 1}" for number in range(len(full_paths))]
+    if len(channels) != len(full_paths):
+        raise ValueError(f"There are {len(channels)} channels but "
+                         f"{len(full_paths)} folders.")
     
-    # make lists from directories
-    C1_images = os.listdir(full_paths[0])
-    C2_images = os.listdir(full_paths[1])
-    C3_images = os.listdir(full_paths[2])
+    # group images from every channel by image ID
+    groups = {}
+    for channel, folder in zip(channels, full_paths):
+        channel_index = index_channels(folder, channels)[0]
+        for filename in channel_index[channel]:
+            image_id = os.path.splitext(filename[len(channel):])[0]
+            group = groups.setdefault(image_id, {})
+            group.setdefault(channel, []).append(filename)
     
-    # loop through and find matches
+    # keep groups with exactly one image in every channel
     matched_images = []
-    missing_matches = []
-    for C1_filename in C1_images:
-        matching = [C1_filename]
-        image_id = C1_filename[2:]
-        for C2_filename in C2_images:
-            if C2_filename[2:] == image_id:
-                matching.append(C2_filename)
-            if len(matching) > 2:
-                raise IndexError\
-                (f"More than 1 image in channel 2 matches this image in channel 1, something is wrong: \n {matching}")
-        for C3_filename in C3_images:
-            if C3_filename[2:] == image_id:
-                matching.append(C3_filename)
-        if len(matching) == 3:
-            matched_images.append(matching)
-        elif len(matching) < 3:
-            missing_matches.append(matching)
+    match_report = {'incomplete': {}, 'duplicate': {}}
+    for image_id in sorted(groups):
+        group = groups[image_id]
+        if any(len(files) > 1 for files in group.values()):
+            match_report['duplicate'][image_id] = group
+        elif len(group) < len(channels):
+            match_report['incomplete'][image_id] = group
         else:
-            raise IndexError\
-            (f"There were more than three images with the same name, something"
-             f"might be wrong. \n {matching}")
+            matched_images.append([group[channel][0] 
+                                   for channel in channels])
 
-    return matched_images
+    return matched_images, match_report
     
 
 def make_new_subfolder(parent_directory, folder_name):
     full_path = os.path.join(parent_directory, folder_name)
-    isdir = os.isdir(full_path)
-    if isdir is False: 
-        os.mkdir(full_path)
-    else: 
-        pass
+    os.makedirs(full_path, exist_ok=True)
     return full_path
 
     
@@ -216,32 +303,517 @@ def write_to_csv(data_list, header_list, directory, experiment_name, data_in_fil
         This string is the experiment name given in the config file that will
         be used to generate the filename.
     data_in_file : str
-        This string will be used further specify the data contained in this "
-        f"file for the filename.
+        This string will be used further specify the data contained in this
+        file for the filename.
     
     RETURNS
     ----------
-    matched_images_csv : str
-        This string is the full file path of the matched_images_csv. 
+    filename : str
+        This string is the full file path of the csv file.
     """
     
-    os.chdir(directory)
-    today = date.now().strftime(%Y%m%d)
-    print(today)
-    filename = (f"{today}_{experiment_name}_{data_in_file}.csv")
-    with open(filename, 'wb') as file:
+    filename = csv_filename(directory, experiment_name, data_in_file)
+    with open(filename, 'w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(header)
+        writer.writerow(header_list)
         writer.writerows(data_list)
-    
-    
-    
-    
-    
-    
-# testing
-paths = ['/home/jovyan/SEFS/Project/SG_enrichment/TestImages/C1',
-         '/home/jovyan/SEFS/Project/SG_enrichment/TestImages/C2',
-         '/home/jovyan/SEFS/Project/SG_enrichment/TestImages/C3'
-        ]
-matching_channels(paths)
\ No newline at end of file
+
+    return filename
+
+
+def csv_filename(directory, experiment_name, data_in_file, dated=True):
+    """
+    PARAMETERS
+    ----------
+    directory : str
+        This string is the full path to the directory where the csv file will
+        be saved.
+    experiment_name : str
+        This string is the experiment name given in the config file that will
+        be used to generate the filename.
+    data_in_file : str
+        This string will be used further specify the data contained in this
+        file for the filename.
+    dated : bool
+        If True, the filename starts with today's date. Files that a later
+        run has to find again (e.g. results that are resumed) should not be
+        dated. The default is True.
+
+    RETURNS
+    ----------
+    filename : str
+        This string is the full file path of the csv file, named
+        '<date>_<experiment_name>_<data_in_file>.csv' with today's date, or
+        '<experiment_name>_<data_in_file>.csv' if dated is False.
+    """
+
+    name = f"{experiment_name}_{data_in_file}.csv"
+    if dated:
+        name = f"{datetime.now().strftime('%Y%m%d')}_{name}"
+    filename = os.path.join(directory, name)
+    return filename
+
+
+class ResultsWriter:
+    """
+    Streams results to a csv file one field at a time, so results do not
+    have to be held in memory until the end of a run and a crash only loses
+    the fields that were not flushed yet.
+
+    Every row starts with the field ID. Finished fields are also listed in a
+    '.done' file next to the csv, together with where their rows end in the
+    csv. If the csv already exists the run is resumed: rows after the last
+    finished field are cut off, and done_fields lists the fields to skip.
+    If the '.done' file is missing, the finished fields are found from the
+    rows of the csv instead, and only the rows of the last field in it are
+    cut off, as it may not have been finished.
+
+    PARAMETERS
+    ----------
+    filename : str
+        This string is the full file path of the csv file.
+    header_list : list
+        This list has the header entries for each row, not including the
+        'field_id' column that is added in front.
+    flush_every : int
+        This is how many fields are written between flushes to disk.
+
+    Use as a context manager, or call close() when done.
+    """
+
+    def __init__(self, filename, header_list, flush_every=1):
+        self.filename = filename
+        self.done_filename = filename + '.done'
+        self.flush_every = flush_every
+        self.done_fields = set()
+        self._pending = []
+
+        header = ['field_id'] + list(header_list)
+        end = self._read_done()
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            # resume, dropping rows of fields that were not finished
+            with open(filename, newline='') as file:
+                old_header = next(csv.reader(file), [])
+            if old_header != header:
+                raise ValueError(f"The existing results file {filename} has "
+                                 f"the header {old_header}, not {header}.")
+            if not os.path.exists(self.done_filename):
+                end = self._rebuild_done()
+            self._file = open(filename, 'r+', newline='')
+            if end is None:
+                self._file.readline()
+                end = self._file.tell()
+            self._file.seek(end)
+            self._file.truncate()
+        else:
+            self.done_fields = set()
+            self._file = open(filename, 'w', newline='')
+            csv.writer(self._file).writerow(header)
+            self._file.flush()
+            open(self.done_filename, 'w').close()
+        self._header = header
+        self._writer = csv.writer(self._file)
+        self._done_file = open(self.done_filename, 'a')
+
+    def _read_done(self):
+        """
+        RETURNS
+        ----------
+        end : int or None
+            This is where the rows of the last finished field end in the csv
+            file, or None if no field was finished.
+        """
+        end = None
+        if not os.path.exists(self.done_filename):
+            return end
+        with open(self.done_filename) as done_file:
+            for line in done_file:
+                # skip a last line that was only partly written
+                if not line.endswith('\n'):
+                    break
+                field, offset = line.rstrip('\n').rsplit('\t', 1)
+                self.done_fields.add(field)
+                end = int(offset)
+        return end
+
+    def _rebuild_done(self):
+        """
+        Writes the '.done' file again from the rows of the csv file. The
+        rows of each field are together, so a field is finished once the
+        rows of the next field start.
+
+        RETURNS
+        ----------
+        end : int or None
+            This is where the rows of the last finished field end in the csv
+            file, or None if no field was finished.
+        """
+        end = None
+        lines = []
+        with open(self.filename, 'rb') as file:
+            file.readline()
+            field, offset = None, file.tell()
+            for line in file:
+                # skip a last line that was only partly written
+                if not line.endswith(b'\n'):
+                    break
+                row_field = next(csv.reader([line.decode()]))[0]
+                if field is not None and row_field != field:
+                    lines.append(f"{field}\t{offset}\n")
+                    self.done_fields.add(field)
+                    end = offset
+                field, offset = row_field, offset + len(line)
+        with open(self.done_filename, 'w') as done_file:
+            done_file.writelines(lines)
+        return end
+
+    def write_field(self, field_id, rows):
+        """
+        PARAMETERS
+        ----------
+        field_id : str
+            This string is the ID of the field the rows belong to.
+        rows : list
+            This is a list where each item is a list of row values, not
+            including the field ID.
+        """
+        self._writer.writerows([field_id] + list(row) for row in rows)
+        self._pending.append(f"{field_id}\t{self._file.tell()}\n")
+        self.done_fields.add(field_id)
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def restart(self):
+        """
+        Removes every row written so far, e.g. when the results of an 
+        earlier run are out of date, so that all fields are written again.
+        """
+        self._pending = []
+        self.done_fields = set()
+        self._file.seek(0)
+        self._file.truncate()
+        self._writer.writerow(self._header)
+        self._file.flush()
+        self._done_file.seek(0)
+        self._done_file.truncate()
+        self._done_file.flush()
+
+    def flush(self):
+        # the rows must be on disk before the fields are marked as done
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._done_file.writelines(self._pending)
+        self._done_file.flush()
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+        self._done_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def field_group(field_id, group_names):
+    """
+    PARAMETERS
+    ----------
+    field_id : str
+        This string is the ID of a field, e.g. '210903_GFP-G3BP1_6xA_004'.
+    group_names : list
+        This list has the group names from the config file.
+
+    RETURNS
+    ----------
+    group : str
+        This string is the longest group name found in field_id, so that
+        '6xSyn' wins over '6x', or 'ungrouped' if none is found.
+    """
+    found = [name for name in group_names if name in field_id]
+    group = max(found, key=len, default='ungrouped')
+    return group
+
+
+def _import_pyarrow():
+    """
+    RETURNS
+    ----------
+    pyarrow : module
+        The pyarrow module, imported only when columnar files are used so 
+        that the csv output works without it.
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Writing Parquet or Arrow files needs pyarrow "
+                          "(pip install pyarrow). Set results_format to csv "
+                          "in the config file to write csv files instead.")
+    return pyarrow
+
+
+class ColumnarWriter:
+    """
+    Streams results to typed Parquet (or Arrow IPC) files one field at a 
+    time, as a dataset partitioned by experiment and group:
+    '<directory>/experiment_name=<experiment>/group=<group>/part-*.parquet'.
+    Each field is one row group, with a 'field_id' column added in front.
+
+    Files are closed and a new one started every fields_per_file fields, so
+    a crash only loses the fields of the open files. If the dataset already 
+    has files for this experiment the run is resumed: files that were not 
+    closed are removed, and done_fields lists the fields to skip.
+
+    PARAMETERS
+    ----------
+    directory : str
+        This string is the full path of the dataset folder.
+    experiment_name : str
+        This string is the experiment name given in the config file.
+    group_names : list
+        This list has the group names from the config file, see field_group.
+    file_format : str
+        This string is 'parquet' or 'arrow' (Arrow IPC files).
+    fields_per_file : int
+        This is how many fields are written to a file before it is closed.
+    column_types : dict
+        This dictionary has the type name of each column (not including the
+        field ID), e.g. {'granule': 'int64', 'object_median': 'float64'}, 
+        so every file has the same
+        schema even if the first field of a group has no rows. If None, the
+        types of the first field written to each group are used.
+
+    Use as a context manager, or call close() when done. Needs pyarrow.
+    """
+
+    extensions = {'parquet': '.parquet', 'arrow': '.arrow'}
+
+    def __init__(self, directory, experiment_name, group_names=(),
+                 file_format='parquet', fields_per_file=100,
+                 column_types=None):
+        if file_format not in self.extensions:
+            raise ValueError(f"The results format {file_format} is not one "
+                             f"of {sorted(self.extensions)}.")
+        self.pyarrow = _import_pyarrow()
+        self.directory = directory
+        self.experiment_name = experiment_name
+        self.group_names = list(group_names)
+        self.file_format = file_format
+        self.fields_per_file = fields_per_file
+        self.schema = None
+        if column_types is not None:
+            pyarrow = self.pyarrow
+            self.schema = pyarrow.schema(
+                [('field_id', pyarrow.string())]
+                + [(name, pyarrow.type_for_alias(type_name))
+                   for name, type_name in column_types.items()])
+        self.done_fields = set()
+        self._writers = {}
+        self._counter = 0
+        self._run = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+        self._experiment_dir = os.path.join(
+            directory, f"experiment_name={_partition(experiment_name)}")
+        for filename in self._part_files():
+            try:
+                fields = self._read_fields(filename)
+            except (OSError, self.pyarrow.ArrowInvalid):
+                # a file that was not closed, e.g. after a crash
+                os.remove(filename)
+                continue
+            self.done_fields.update(fields)
+
+    def _part_files(self):
+        """
+        RETURNS
+        ----------
+        filenames : list
+            This list has the full paths of the files of this experiment.
+        """
+        filenames = []
+        if not os.path.isdir(self._experiment_dir):
+            return filenames
+        extension = self.extensions[self.file_format]
+        for root, dirs, files in os.walk(self._experiment_dir):
+            filenames += [os.path.join(root, file) for file in files
+                          if file.endswith(extension)]
+        return sorted(filenames)
+
+    def _read_fields(self, filename):
+        """
+        RETURNS
+        ----------
+        fields : set
+            This set has the IDs of the fields in a closed file.
+        """
+        if self.file_format == 'parquet':
+            table = self.pyarrow.parquet.read_table(filename,
+                                                    columns=['field_id'])
+        else:
+            with self.pyarrow.memory_map(filename) as source:
+                table = self.pyarrow.ipc.open_file(source).read_all()
+        return set(table.column('field_id').to_pylist())
+
+    def write_field(self, field_id, columns):
+        """
+        PARAMETERS
+        ----------
+        field_id : str
+            This string is the ID of the field the rows belong to.
+        columns : dict
+            This dictionary has the column name and NumPy array (or list) of
+            values of each column, not including the field ID.
+        """
+        pyarrow = self.pyarrow
+        group = field_group(field_id, self.group_names)
+        num_rows = len(next(iter(columns.values()), []))
+        arrays = {'field_id': pyarrow.array([field_id] * num_rows,
+                                            pyarrow.string())}
+        if self.schema is None:
+            arrays.update({name: pyarrow.array(values)
+                           for name, values in columns.items()})
+            schema = None
+        else:
+            schema = self.schema
+            arrays.update({name: pyarrow.array(columns[name],
+                                               schema.field(name).type)
+                           for name in schema.names[1:]})
+        table = pyarrow.table(arrays, schema=schema)
+
+        if group not in self._writers:
+            self._writers[group] = self._open(group, table.schema)
+        writer, schema, count = self._writers[group]
+        writer.write_table(table.cast(schema))
+        self.done_fields.add(field_id)
+
+        # close files every fields_per_file fields, so they can be read
+        if count + 1 >= self.fields_per_file:
+            writer.close()
+            del self._writers[group]
+        else:
+            self._writers[group] = (writer, schema, count + 1)
+
+    def _open(self, group, schema):
+        """
+        RETURNS
+        ----------
+        writer : tuple
+            This tuple has a new file writer for the group, the schema of 
+            the file and the number of fields written to it (0).
+        """
+        folder = os.path.join(self._experiment_dir,
+                              f"group={_partition(group)}")
+        os.makedirs(folder, exist_ok=True)
+        self._counter += 1
+        filename = os.path.join(folder, f"part-{self._run}-{self._counter}"
+                                        f"{self.extensions[self.file_format]}")
+        if self.file_format == 'parquet':
+            writer = self.pyarrow.parquet.ParquetWriter(filename, schema)
+        else:
+            writer = self.pyarrow.ipc.new_file(filename, schema)
+        return writer, schema, 0
+
+    def restart(self):
+        """
+        Removes every file of this experiment, e.g. when the results of an 
+        earlier run are out of date, so that all fields are written again.
+        """
+        self.close()
+        for filename in self._part_files():
+            os.remove(filename)
+        self.done_fields = set()
+
+    def close(self):
+        for writer, schema, count in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _partition(value):
+    """
+    RETURNS
+    ----------
+    value : str
+        The value made safe to use as a partition folder name.
+    """
+    return re.sub(r'[\\/:=]', '_', str(value))
+
+
+def read_results(directory, file_format=None):
+    """
+    PARAMETERS
+    ----------
+    directory : str
+        This string is the full path of a dataset folder written by 
+        ColumnarWriter.
+    file_format : str
+        This string is 'parquet' or 'arrow', the file_format the dataset was
+        written with. If None, it is found from the file extensions.
+
+    RETURNS
+    ----------
+    table : pyarrow.Table
+        This table has the rows of every file, with 'experiment_name' and
+        'group' columns from the partition folders.
+    """
+    pyarrow = _import_pyarrow()
+    import pyarrow.dataset
+    formats = {'parquet': 'parquet', 'arrow': 'ipc'}
+    filenames = {file_format: [] for file_format in formats}
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            for name, extension in ColumnarWriter.extensions.items():
+                if file.endswith(extension):
+                    filenames[name].append(os.path.join(root, file))
+    if file_format is None:
+        file_format = max(filenames, key=lambda name: len(filenames[name]))
+    if file_format not in formats:
+        raise ValueError(f"The results format {file_format} is not one "
+                         f"of {sorted(formats)}.")
+    table = pyarrow.dataset.dataset(
+        sorted(filenames[file_format]), format=formats[file_format],
+        partitioning='hive', partition_base_dir=directory).to_table()
+    return table
+
+
+def export_csv(directory, filename, file_format=None):
+    """
+    PARAMETERS
+    ----------
+    directory : str
+        This string is the full path of a dataset folder written by 
+        ColumnarWriter.
+    filename : str
+        This string is the full path of the csv file to write.
+    file_format : str
+        This string is 'parquet' or 'arrow', see read_results.
+
+    RETURNS
+    ----------
+    filename : str
+        This string is the full file path of the csv file.
+    """
+    pyarrow = _import_pyarrow()
+    import pyarrow.csv
+    pyarrow.csv.write_csv(read_results(directory, file_format), filename)
+    return filename
+
+
+if __name__ == "__main__":
+    # testing
+    paths = ['/home/jovyan/SEFS/Project/SG_enrichment/TestImages/C1',
+             '/home/jovyan/SEFS/Project/SG_enrichment/TestImages/C2',
+             '/home/jovyan/SEFS/Project/SG_enrichment/TestImages/C3'
+            ]
+    matching_channels(paths, ['C1', 'C2', 'C3'])
@@ -0,0 +1,334 @@
+import os
+import csv
+import glob
+import tempfile
+import unittest
+import importlib.util
+import FileFunctions
+
+has_pyarrow = importlib.util.find_spec('pyarrow') is not None
+
+
+def read_rows(filename):
+    with open(filename, newline='') as file:
+        return list(csv.reader(file))
+
+
+def make_files(directory, names):
+    for name in names:
+        open(os.path.join(directory, name), 'w').close()
+
+
+class SortImagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+        make_files(self.directory, ['C1-a.tif', 'C2-a.tif', 'C3-a.tif',
+                                    'C1-b.tif', 'notes.txt', 'other.tif',
+                                    '.hidden'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_si_movesFiles(self):
+        full_paths = FileFunctions.sort_images(self.directory)
+        res = [sorted(os.listdir(folder)) for folder in full_paths]
+        exp = [['C1-a.tif', 'C1-b.tif'], ['C2-a.tif'], ['C3-a.tif']]
+        self.assertEqual(res, exp)
+        res = sorted(os.listdir(os.path.join(self.directory,
+                                             'removed_files')))
+        self.assertEqual(res, ['notes.txt', 'other.tif'])
+
+    def test_si_masksMoveWithImages(self):
+        make_files(self.directory, ['C1-a_seg.npy', 'C3-a_seg.npy',
+                                    'other_seg.npy'])
+        full_paths = FileFunctions.sort_images(self.directory)
+        res = [sorted(os.listdir(folder)) for folder in full_paths]
+        exp = [['C1-a.tif', 'C1-a_seg.npy', 'C1-b.tif'], ['C2-a.tif'],
+               ['C3-a.tif', 'C3-a_seg.npy']]
+        self.assertEqual(res, exp)
+        self.assertIn('other_seg.npy', os.listdir(
+            os.path.join(self.directory, 'removed_files')))
+        res, report = FileFunctions.matching_channels(full_paths)
+        self.assertEqual(res, [['C1-a.tif', 'C2-a.tif', 'C3-a.tif']])
+
+    def test_si_rerunIsSafe(self):
+        cwd = os.getcwd()
+        FileFunctions.sort_images(self.directory)
+        make_files(self.directory, ['C2-b.tif'])
+        full_paths = FileFunctions.sort_images(self.directory)
+        self.assertEqual(sorted(os.listdir(full_paths[1])),
+                         ['C2-a.tif', 'C2-b.tif'])
+        self.assertEqual(os.getcwd(), cwd)
+
+    def test_si_inPlace(self):
+        full_paths = FileFunctions.sort_images(self.directory, in_place=True)
+        self.assertEqual(full_paths, [self.directory] * 3)
+        self.assertIn('notes.txt', os.listdir(self.directory))
+        res, report = FileFunctions.matching_channels(full_paths)
+        exp = [['C1-a.tif', 'C2-a.tif', 'C3-a.tif']]
+        self.assertEqual(res, exp)
+
+
+class MatchingChannelsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_mc_reportsProblems(self):
+        make_files(self.directory, ['C1-a.tif', 'C2-a.tif', 'C3-a.tif',
+                                    'C1-b.tif', 'C3-b.tif'])
+        full_paths = [self.directory] * 3
+        res, report = FileFunctions.matching_channels(full_paths)
+        self.assertEqual(res, [['C1-a.tif', 'C2-a.tif', 'C3-a.tif']])
+        exp = {'-b': {'C1': ['C1-b.tif'], 'C3': ['C3-b.tif']}}
+        self.assertEqual(report['incomplete'], exp)
+        self.assertEqual(report['duplicate'], {})
+
+    def test_mc_duplicates(self):
+        make_files(self.directory, ['C1-a.tif', 'C1-a.TIF', 'C2-a.tif',
+                                    'C3-a.tif'])
+        full_paths = [self.directory] * 3
+        res, report = FileFunctions.matching_channels(full_paths)
+        self.assertEqual(res, [])
+        self.assertEqual(report['incomplete'], {})
+        self.assertEqual(sorted(report['duplicate']['-a']['C1']),
+                         ['C1-a.TIF', 'C1-a.tif'])
+
+    def test_mc_anyNumberOfChannels(self):
+        make_files(self.directory, ['C1-a.tif', 'C2-a.tif', 'C3-a.tif',
+                                    'C4-a.tif', 'C10-a.tif'])
+        channels = ['C1', 'C2', 'C3', 'C4', 'C10']
+        res, report = FileFunctions.matching_channels(
+            [self.directory] * 5, channels)
+        exp = [['C1-a.tif', 'C2-a.tif', 'C3-a.tif', 'C4-a.tif', 'C10-a.tif']]
+        self.assertEqual(res, exp)
+
+
+class WriteToCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_wtc_writesRows(self):
+        filename = FileFunctions.write_to_csv(
+            [[1, 2], [3, 4]], ['a', 'b'], self.tmp.name, 'exp', 'data')
+        self.assertTrue(filename.endswith('_exp_data.csv'))
+        res = read_rows(filename)
+        exp = [['a', 'b'], ['1', '2'], ['3', '4']]
+        self.assertEqual(res, exp)
+
+    def test_wtc_undatedFilename(self):
+        res = FileFunctions.csv_filename(self.tmp.name, 'exp', 'granules',
+                                         dated=False)
+        self.assertEqual(res, os.path.join(self.tmp.name,
+                                           'exp_granules.csv'))
+        res = FileFunctions.csv_filename(self.tmp.name, 'exp', 'granules')
+        self.assertRegex(os.path.basename(res), r'^\d{8}_exp_granules\.csv$')
+
+
+class ResultsWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'results.csv')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_rw_streamsFields(self):
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            writer.write_field('f1', [[1], [2]])
+            writer.write_field('f2', [])
+        res = read_rows(self.filename)
+        exp = [['field_id', 'a'], ['f1', '1'], ['f1', '2']]
+        self.assertEqual(res, exp)
+
+    def test_rw_resumeSkipsDoneFields(self):
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            writer.write_field('f1', [[1]])
+            writer.write_field('f2', [])
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            self.assertEqual(writer.done_fields, {'f1', 'f2'})
+            writer.write_field('f3', [[3]])
+        res = read_rows(self.filename)
+        exp = [['field_id', 'a'], ['f1', '1'], ['f3', '3']]
+        self.assertEqual(res, exp)
+
+    def test_rw_resumeDropsUnfinishedRows(self):
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            writer.write_field('f1', [[1]])
+        # rows of a field that crashed before it was marked as done
+        with open(self.filename, 'a') as file:
+            file.write('f2,2\nf2,')
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            self.assertEqual(writer.done_fields, {'f1'})
+            writer.write_field('f2', [[2]])
+        res = read_rows(self.filename)
+        exp = [['field_id', 'a'], ['f1', '1'], ['f2', '2']]
+        self.assertEqual(res, exp)
+
+    def test_rw_resumeWithoutDoneFile(self):
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            writer.write_field('f1', [[1], [2]])
+            writer.write_field('f2', [[3]])
+            writer.write_field('f3', [[4]])
+        os.remove(self.filename + '.done')
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            # the last field may not have been finished, so it is run again
+            self.assertEqual(writer.done_fields, {'f1', 'f2'})
+            writer.write_field('f3', [[5]])
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            self.assertEqual(writer.done_fields, {'f1', 'f2', 'f3'})
+        res = read_rows(self.filename)
+        exp = [['field_id', 'a'], ['f1', '1'], ['f1', '2'], ['f2', '3'],
+               ['f3', '5']]
+        self.assertEqual(res, exp)
+
+    def test_rw_restart(self):
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            writer.write_field('f1', [[1]])
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            writer.restart()
+            self.assertEqual(writer.done_fields, set())
+            writer.write_field('f2', [[2]])
+        with FileFunctions.ResultsWriter(self.filename, ['a']) as writer:
+            self.assertEqual(writer.done_fields, {'f2'})
+        res = read_rows(self.filename)
+        exp = [['field_id', 'a'], ['f2', '2']]
+        self.assertEqual(res, exp)
+
+    def test_rw_wrongHeader(self):
+        with FileFunctions.ResultsWriter(self.filename, ['a']):
+            pass
+        with self.assertRaises(ValueError):
+            FileFunctions.ResultsWriter(self.filename, ['b'])
+
+
+class FieldGroupTest(unittest.TestCase):
+
+    def test_fg_longestName(self):
+        groups = ['6x', '6xSyn']
+        self.assertEqual(FileFunctions.field_group('210903_6xA_004', groups),
+                         '6x')
+        self.assertEqual(FileFunctions.field_group('210903_6xSyn_004',
+                                                   groups), '6xSyn')
+        self.assertEqual(FileFunctions.field_group('210903_ctrl', groups),
+                         'ungrouped')
+
+
+@unittest.skipUnless(has_pyarrow, "pyarrow is not installed")
+class ColumnarWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp.name, 'granules')
+        self.groups = ['6x', '6xSyn']
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def columns(self, n):
+        return {'granule': list(range(1, n + 1)),
+                'object_median': [float(i) for i in range(n)]}
+
+    def writer(self, **kwargs):
+        return FileFunctions.ColumnarWriter(self.directory, 'exp1',
+                                            self.groups, **kwargs)
+
+    def test_cw_partitionedAndTyped(self):
+        with self.writer() as writer:
+            writer.write_field('a_6x_001', self.columns(2))
+            writer.write_field('a_6xSyn_001', self.columns(3))
+            writer.write_field('a_6x_002', self.columns(0))
+        table = FileFunctions.read_results(self.directory).to_pydict()
+        self.assertEqual(sorted(zip(table['field_id'], table['group'])),
+                         [('a_6xSyn_001', '6xSyn')] * 3 + 
+                         [('a_6x_001', '6x')] * 2)
+        self.assertEqual(set(table['experiment_name']), {'exp1'})
+        schema = FileFunctions.read_results(self.directory).schema
+        self.assertEqual(str(schema.field('granule').type), 'int64')
+        self.assertEqual(str(schema.field('object_median').type), 'double')
+
+    def test_cw_emptyFirstField(self):
+        types = {'granule': 'int64', 'object_median': 'float64'}
+        with self.writer(column_types=types) as writer:
+            writer.write_field('a_6x_1', {'granule': [], 'object_median': []})
+            writer.write_field('a_6x_2', self.columns(2))
+        schema = FileFunctions.read_results(self.directory).schema
+        self.assertEqual(str(schema.field('granule').type), 'int64')
+        self.assertEqual(str(schema.field('object_median').type), 'double')
+
+    def test_cw_oneRowGroupPerField(self):
+        import pyarrow.parquet
+        with self.writer() as writer:
+            for i in range(3):
+                writer.write_field(f"a_6x_{i}", self.columns(2))
+        (filename,) = glob.glob(os.path.join(self.directory, '**',
+                                             '*.parquet'), recursive=True)
+        self.assertEqual(
+            pyarrow.parquet.ParquetFile(filename).num_row_groups, 3)
+
+    def test_cw_resumeDropsOpenFiles(self):
+        with self.writer() as writer:
+            for i in range(2):
+                writer.write_field(f"a_6x_{i}", self.columns(1))
+        # a file that a crash left without its footer
+        open_file = os.path.join(self.directory, 'experiment_name=exp1',
+                                 'group=6x', 'part-crashed.parquet')
+        with open(open_file, 'wb') as file:
+            file.write(b'PAR1' + bytes(100))
+        with self.writer() as writer:
+            self.assertEqual(writer.done_fields, {'a_6x_0', 'a_6x_1'})
+            self.assertFalse(os.path.exists(open_file))
+            writer.write_field('a_6x_2', self.columns(1))
+        table = FileFunctions.read_results(self.directory)
+        self.assertEqual(sorted(table.column('field_id').to_pylist()),
+                         ['a_6x_0', 'a_6x_1', 'a_6x_2'])
+
+    def test_cw_newFileEveryFewFields(self):
+        with self.writer(fields_per_file=2) as writer:
+            for i in range(5):
+                writer.write_field(f"a_6x_{i}", self.columns(1))
+        files = glob.glob(os.path.join(self.directory, '**', '*.parquet'),
+                          recursive=True)
+        self.assertEqual(len(files), 3)
+
+    def test_cw_arrowAndRestart(self):
+        with self.writer(file_format='arrow') as writer:
+            writer.write_field('a_6x_1', self.columns(2))
+        with self.writer(file_format='arrow') as writer:
+            self.assertEqual(writer.done_fields, {'a_6x_1'})
+            writer.restart()
+            self.assertEqual(writer.done_fields, set())
+        with self.writer(file_format='arrow') as writer:
+            self.assertEqual(writer.done_fields, set())
+            writer.write_field('a_6x_2', self.columns(2))
+        table = FileFunctions.read_results(self.directory)
+        self.assertEqual(table.column('field_id').to_pylist(),
+                         ['a_6x_2', 'a_6x_2'])
+        filename = os.path.join(self.tmp.name, 'granules.csv')
+        FileFunctions.export_csv(self.directory, filename,
+                                 file_format='arrow')
+        self.assertEqual(len(read_rows(filename)), 3)
+
+    def test_cw_exportCsv(self):
+        with self.writer() as writer:
+            writer.write_field('a_6x_1', self.columns(2))
+        filename = os.path.join(self.tmp.name, 'granules.csv')
+        FileFunctions.export_csv(self.directory, filename)
+        rows = read_rows(filename)
+        self.assertEqual(len(rows), 3)
+        self.assertIn('"field_id"', open(filename).readline())
+
+
+if __name__ == "__main__":
+    unittest.main()
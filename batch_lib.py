@@ -0,0 +1,816 @@
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from itertools import islice
+import traceback
+import numpy
+import cache_lib
+import im_lib
+import manifest_lib
+import profile_lib
+import stats_lib
+
+"""
+This library runs the image analysis in im_lib over many fields at once.
+Each field is one set of matched channel images from
+FileFunctions.matching_channels, and fields are spread across processes.
+"""
+
+
+def field_id(filename, channel=None):
+    """
+    To find the ID of a field from the filename of one of its images.
+
+    Parameters
+    ----------
+    filename = name of an image file, starting with the channel (e.g. 'C1')
+
+    channel = optional str of the channel prefix the file was matched by
+    (see FileFunctions.index_channels), e.g. 'C1' or 'C10'. By default the
+    letters and digits at the start of the filename are taken as the channel.
+
+    Returns
+    -------
+    field = str of the filename after the channel and without the extension
+    """
+
+    if channel is None:
+        channel = re.match('[A-Za-z]*[0-9]*', filename).group()
+    field = os.path.splitext(filename[len(channel):])[0].lstrip('-_')
+
+    return field
+
+
+def seg_filename(filename):
+    """
+    To find the Cellpose mask file (_seg.npy) that belongs to an image file.
+
+    Parameters
+    ----------
+    filename = full path of an image file
+
+    Returns
+    -------
+    seg_file = full path of the matching _seg.npy file
+    """
+
+    seg_file = os.path.splitext(filename)[0] + '_seg.npy'
+
+    return seg_file
+
+
+# The functions each stage of run_field calls, so a stage is run again when
+# any of them changes. Every im_lib and stats_lib function a stage calls,
+# directly or not, must be listed (batch_lib_test checks this).
+_SHARED_FUNCTIONS = [im_lib.object_slices, im_lib.label_dtype,
+                     im_lib._label_out, im_lib._union_slice,
+                     im_lib._pad_slice, im_lib._as_labels]
+# The stages read their images and masks with these (see STAGE_INPUTS).
+_MASK_READERS = im_lib.MASK_READ_FUNCTIONS + [im_lib._decoded_kind]
+_IMAGE_READERS = im_lib.IMAGE_READ_FUNCTIONS
+STAGE_FUNCTIONS = {
+    'loc_bkgd': _SHARED_FUNCTIONS + _MASK_READERS + [
+        im_lib.mask_loc_bkgd, im_lib._local_bkgd,
+        im_lib._check_loc_bkgd_method, im_lib._disk_dilation, im_lib._disk,
+        im_lib._nearest_object],
+    'find_object': _SHARED_FUNCTIONS + _MASK_READERS + _IMAGE_READERS + [
+        im_lib.find_object, im_lib._label_stats, stats_lib.grouped_stats,
+        stats_lib.grouped_medians, stats_lib.pooled_t_test,
+        im_lib._significant_objects],
+    'find_overlap': _SHARED_FUNCTIONS + _MASK_READERS + [
+        im_lib.find_overlap, im_lib.overlap_table, im_lib._overlap_keep]
+}
+
+
+def field_stages(paths, radius=5, overlap_threshold=0.9,
+                 bkgd_method='dilation'):
+    """
+    To describe the stages of run_field for one field, for the run manifest
+    (see manifest_lib).
+
+    Parameters
+    ----------
+    paths = list of the full paths of the C1, C2 and C3 images of the field
+
+    radius = int for pixel radius of the local background
+    The default value is 5 pixels.
+
+    overlap_threshold = float for overlap needed between C2 and C3 cells
+    The default value is 0.9 or 90%.
+
+    bkgd_method = str of how to make the local background, 'dilation' or
+    'edt' (see im_lib.mask_loc_bkgd). The default value is 'dilation'.
+
+    Returns
+    -------
+    stages = dict of stage name ('loc_bkgd', 'find_object', 'find_overlap')
+    to the record of the stage from manifest_lib.stage_record
+    """
+
+    segs = [seg_filename(path) for path in paths]
+
+    stages = dict()
+    stages['loc_bkgd'] = manifest_lib.stage_record(
+        [segs[0]], {'radius': radius, 'method': bkgd_method},
+        STAGE_FUNCTIONS['loc_bkgd'])
+    stages['find_object'] = manifest_lib.stage_record(
+        [paths[1], segs[0]], {}, STAGE_FUNCTIONS['find_object'],
+        upstream=[stages['loc_bkgd']])
+    stages['find_overlap'] = manifest_lib.stage_record(
+        [segs[1], segs[2]], {'overlap_threshold': overlap_threshold},
+        STAGE_FUNCTIONS['find_overlap'])
+
+    return stages
+
+
+def run_field(files, directories, radius=5, overlap_threshold=0.9,
+              cache_dir=None, cache_max_bytes=None, mmap=False, inputs=None,
+              bkgd_method='dilation', channel=None):
+    """
+    To run the full analysis on one field: read the images and masks, make
+    the local background of the C1 granules, find granules in C2, and find
+    cells that overlap in C2 and C3.
+
+    Parameters
+    ----------
+    files = list of the C1, C2 and C3 image filenames of the field
+
+    directories = list of the C1, C2 and C3 folders the files are in
+
+    radius = int for pixel radius of the local background
+    The default value is 5 pixels.
+
+    overlap_threshold = float for overlap needed between C2 and C3 cells
+    The default value is 0.9 or 90%.
+
+    cache_dir = optional full path of a cache folder for decoded images and
+    masks (see cache_lib). The results of each stage are kept there too, by
+    the key of the stage (see field_stages), so a stage whose inputs,
+    parameters and code did not change is not run again.
+
+    cache_max_bytes = optional int for the largest size of the cache in bytes
+
+    mmap = bool, if True images and masks are read as memory maps
+    The default value is False.
+
+    inputs = optional list of the C1, C2 and C3 dicts from load_inputs, with
+    images and masks that were already read. Anything missing is read here.
+
+    bkgd_method = str of how to make the local background, 'dilation' or
+    'edt' (see im_lib.mask_loc_bkgd). The default value is 'dilation'.
+
+    channel = optional str of the prefix of the C1 channel, to find the field
+    ID with (see field_id)
+
+    Returns
+    -------
+    result = dict with the field ID, files, granule medians from
+    im_lib.find_object, cell overlap table from im_lib.find_overlap, the
+    records of each stage from field_stages ('stages') and the names of the
+    stages that were actually run ('computed')
+    """
+
+    paths = [os.path.join(folder, file)
+             for (folder, file) in zip(directories, files)]
+    stages = field_stages(paths, radius=radius,
+                          overlap_threshold=overlap_threshold,
+                          bkgd_method=bkgd_method)
+
+    # Read images and masks only when a stage needs them.
+    cache = {
+        'cache_dir': cache_dir,
+        'cache_max_bytes': cache_max_bytes,
+        'mmap': mmap
+    }
+    if inputs is None:
+        inputs = [dict() for path in paths]
+    computed = list()
+
+    def image(channel):
+        if 'image' in inputs[channel]:
+            return inputs[channel]['image']
+        return im_lib.read_image(paths[channel], **cache)
+
+    def mask(channel):
+        if 'mask' in inputs[channel]:
+            return inputs[channel]['mask']
+        return im_lib.mask_object(seg_filename(paths[channel]), **cache)
+
+    def stage(name, compute):
+        def run():
+            computed.append(name)
+            return compute()
+        if cache_dir is None:
+            return run()
+        return cache_lib.load_keyed(stages[name]['key'], run, cache_dir,
+                                    max_bytes=cache_max_bytes)
+
+    # Find granules in C2 that are brighter than their local background.
+    def granules():
+        img_C2 = image(1)
+        mask_C1 = mask(0)
+        slices_C1 = im_lib.object_slices(mask_C1)
+        bkgd_C1 = stage('loc_bkgd', lambda: im_lib.mask_loc_bkgd(
+            mask_C1, radius=radius, slices=slices_C1, method=bkgd_method))
+        (granules_C2, medians) = im_lib.find_object(img_C2, mask_C1, bkgd_C1,
+                                                    slices=slices_C1)
+        return numpy.array(medians, dtype=float).reshape(-1, 3)
+
+    medians = [(int(mask), object_median, bkgd_median)
+               for (mask, object_median, bkgd_median)
+               in stage('find_object', granules).tolist()]
+
+    # Find cells that are in both C2 and C3.
+    def overlap():
+        mask_C2 = mask(1)
+        mask_C3 = mask(2)
+        (overlap_cells, table) = im_lib.find_overlap(
+            mask_C2, mask_C3, overlap_threshold=overlap_threshold,
+            return_table=True)
+        return table
+
+    table = stage('find_overlap', overlap)
+
+    result = {
+        'field_id': field_id(files[0], channel),
+        'files': list(files),
+        'medians': medians,
+        'overlap_table': table,
+        'stages': stages,
+        'computed': computed,
+        'error': None
+    }
+
+    return result
+
+
+# The images ('image') and masks ('mask') of each channel that each stage of
+# run_field reads.
+STAGE_INPUTS = {
+    'loc_bkgd': [(0, 'mask')],
+    'find_object': [(0, 'mask'), (1, 'image')],
+    'find_overlap': [(1, 'mask'), (2, 'mask')]
+}
+
+
+def load_inputs(paths, radius=5, overlap_threshold=0.9, cache_dir=None,
+                cache_max_bytes=None, mmap=False, bkgd_method='dilation'):
+    """
+    To read the images and masks of a field that run_field will need, i.e.
+    those of the stages that are not in the cache yet.
+
+    Parameters
+    ----------
+    paths = list of the full paths of the C1, C2 and C3 images of the field
+
+    radius, overlap_threshold, cache_dir, cache_max_bytes, mmap,
+    bkgd_method = the same as for run_field
+
+    Returns
+    -------
+    inputs = list of a dict for each channel, with the 'image' and 'mask'
+    arrays that were read. If reading fails the dicts are empty, so that
+    run_field reads the files again and reports the error.
+    """
+
+    cache = {
+        'cache_dir': cache_dir,
+        'cache_max_bytes': cache_max_bytes,
+        'mmap': mmap
+    }
+    readers = {
+        'image': lambda path: im_lib.read_image(path, **cache),
+        'mask': lambda path: im_lib.mask_object(seg_filename(path), **cache)
+    }
+
+    inputs = [dict() for path in paths]
+    try:
+        stages = field_stages(paths, radius=radius,
+                              overlap_threshold=overlap_threshold,
+                              bkgd_method=bkgd_method)
+        for (name, record) in stages.items():
+            if (cache_dir is not None
+                    and cache_lib.is_cached(record['key'], cache_dir)):
+                continue
+            for (channel, kind) in STAGE_INPUTS[name]:
+                if kind not in inputs[channel]:
+                    inputs[channel][kind] = readers[kind](paths[channel])
+    except Exception:
+        inputs = [dict() for path in paths]
+
+    return inputs
+
+
+def read_images(paths):
+    """
+    To read the image of each channel of a field, the default loader of
+    prefetch_fields.
+    """
+
+    images = [im_lib.read_image(path) for path in paths]
+
+    return images
+
+
+def prefetch_fields(matched_images, directories, load=read_images,
+                    num_prefetch=2, channel=None):
+    """
+    To read fields on background threads ahead of the field being analysed,
+    so that waiting for files (e.g. on network storage) overlaps with the
+    analysis.
+
+    Parameters
+    ----------
+    matched_images = list of [C1, C2, C3] filenames from
+    FileFunctions.matching_channels
+
+    directories = list of the C1, C2 and C3 folders the files are in
+
+    load = function that reads the list of full paths of a field and returns
+    one item for each channel. The default is read_images.
+
+    num_prefetch = int for the number of fields read ahead, each on its own
+    thread. At most this many fields wait in memory besides the one being
+    analysed. The default value is 2.
+
+    channel = optional str of the prefix of the C1 channel (see field_id)
+
+    Returns
+    -------
+    Generator of tuples (field_id, C1, C2, C3) from load, in the same order
+    as matched_images. An error in load is raised when its field is reached.
+    """
+
+    def paths(files):
+        return [os.path.join(folder, file)
+                for (folder, file) in zip(directories, files)]
+
+    executor = ThreadPoolExecutor(max_workers=max(num_prefetch, 1))
+    pending = deque()
+    try:
+        fields = iter(matched_images)
+        for files in islice(fields, max(num_prefetch, 1)):
+            pending.append((files, executor.submit(load, paths(files))))
+
+        while len(pending) > 0:
+            (files, future) = pending.popleft()
+            data = future.result()
+
+            # Start reading the next field before handing back this one.
+            files_next = next(fields, None)
+            if files_next is not None:
+                pending.append((files_next,
+                                executor.submit(load, paths(files_next))))
+
+            yield (field_id(files[0], channel),) + tuple(data)
+    finally:
+        # Do not wait for fields that will not be used.
+        for (files, future) in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def manifest_filename(directory, experiment_name):
+    """
+    To find the run manifest (see manifest_lib) of an experiment. Like the
+    granules results it has no date, so a later run finds it.
+
+    Parameters
+    ----------
+    directory = full path of the output folder
+
+    experiment_name = str of the experiment name from the config file
+
+    Returns
+    -------
+    filename = full path of '<experiment_name>_manifest.jsonl'
+    """
+
+    filename = os.path.join(directory, f"{experiment_name}_manifest.jsonl")
+
+    return filename
+
+
+def is_current(files, directories, old_stages, radius=5,
+               overlap_threshold=0.9, bkgd_method='dilation'):
+    """
+    To check if the results of a field from an earlier run are still up to
+    date, i.e. no stage of the field would be run again.
+
+    Parameters
+    ----------
+    files = list of the C1, C2 and C3 image filenames of the field
+
+    directories = list of the C1, C2 and C3 folders the files are in
+
+    old_stages = dict of stage records of the field from the run manifest,
+    or None if it is not in the manifest
+
+    radius, overlap_threshold, bkgd_method = parameters of this run (see
+    run_field)
+
+    Returns
+    -------
+    current = bool, True if every stage has the same key as in old_stages
+    """
+
+    paths = [os.path.join(folder, file)
+             for (folder, file) in zip(directories, files)]
+    try:
+        stages = field_stages(paths, radius=radius,
+                              overlap_threshold=overlap_threshold,
+                              bkgd_method=bkgd_method)
+    except FileNotFoundError:
+        return False
+
+    current = len(manifest_lib.changed_stages(old_stages, stages)) == 0
+
+    return current
+
+
+# The type of each column of median_columns, e.g. for the schema of
+# FileFunctions.ColumnarWriter.
+MEDIAN_COLUMN_TYPES = {
+    'granule': 'int64',
+    'object_median': 'float64',
+    'bkgd_median': 'float64'
+}
+
+
+def median_columns(medians):
+    """
+    To turn the granule medians of a field into typed columns, e.g. for
+    FileFunctions.ColumnarWriter.
+
+    Parameters
+    ----------
+    medians = list of tuples (mask, object_median, bkgd_median) from
+    run_field
+
+    Returns
+    -------
+    columns = dict of 'granule', 'object_median' and 'bkgd_median' to NumPy
+    arrays
+    """
+
+    rows = numpy.array(medians, dtype=float).reshape(-1, 3)
+    columns = {name: rows[:, index].astype(type_name)
+               for (index, (name, type_name))
+               in enumerate(MEDIAN_COLUMN_TYPES.items())}
+
+    return columns
+
+
+def _run_field_safely(files, directories, profile=False, **parameters):
+    """
+    To run one field and turn any error into an error result, so that one
+    bad field does not stop the rest of the batch. If profile is True, the
+    profile_lib records of the field are added to the result as 'profile'.
+    """
+
+    if not profile:
+        try:
+            return run_field(files, directories, **parameters)
+        except Exception:
+            return _error_result(files, traceback.format_exc(),
+                                 parameters.get('channel'))
+
+    with profile_lib.recording(field_id(files[0], parameters.get('channel'))
+                               ) as records:
+        result = _run_field_safely(files, directories, **parameters)
+    result['profile'] = records
+
+    return result
+
+
+def _error_result(files, error, channel=None):
+    """
+    To make the result of a field that could not be analysed.
+    """
+
+    result = {
+        'field_id': field_id(files[0], channel),
+        'files': list(files),
+        'medians': None,
+        'overlap_table': None,
+        'stages': None,
+        'computed': list(),
+        'error': error
+    }
+
+    return result
+
+
+def iter_batch(matched_images, directories, radius=5, overlap_threshold=0.9,
+               num_workers=1, cache_dir=None, cache_max_bytes=None,
+               mmap=False, profile=False, num_prefetch=2,
+               bkgd_method='dilation', channel=None):
+    """
+    To run the analysis on every field, yielding each result in the same
+    order as matched_images as soon as it (and every field before it) is
+    done.
+
+    Parameters
+    ----------
+    matched_images = list of [C1, C2, C3] filenames from
+    FileFunctions.matching_channels
+
+    directories = list of the C1, C2 and C3 folders from
+    FileFunctions.sort_images
+
+    radius = int for pixel radius of the local background
+    The default value is 5 pixels.
+
+    overlap_threshold = float for overlap needed between C2 and C3 cells
+    The default value is 0.9 or 90%.
+
+    num_workers = int for number of processes to use, 1 = no extra processes
+    The default value is 1.
+
+    cache_dir = optional full path of a cache folder for decoded images and
+    masks (see cache_lib)
+
+    cache_max_bytes = optional int for the largest size of the cache in bytes
+
+    mmap = bool, if True images and masks are read as memory maps, so
+    workers share pages instead of each holding a copy
+    The default value is False.
+
+    profile = bool, if True each result gets a 'profile' list of
+    profile_lib records of the im_lib calls for that field
+    The default value is False.
+
+    num_prefetch = int for the number of fields read ahead on background
+    threads when num_workers is 1 (see prefetch_fields), 0 = no reading
+    ahead. Fields are not read ahead while profiling, so that reading is
+    recorded under the right field. The default value is 2.
+
+    bkgd_method = str of how to make the local background, 'dilation' or
+    'edt' (see im_lib.mask_loc_bkgd). The default value is 'dilation'.
+
+    channel = optional str of the prefix of the C1 channel, to find the field
+    IDs with (see field_id)
+
+    Returns
+    -------
+    Generator of result dicts from run_field. A field that fails gives a
+    result with its traceback in 'error' instead. If a worker process dies,
+    the fields that were stopped with it are run again in a new pool, so
+    only the field that killed its worker fails.
+    """
+
+    parameters = {
+        'radius': radius,
+        'overlap_threshold': overlap_threshold,
+        'cache_dir': cache_dir,
+        'cache_max_bytes': cache_max_bytes,
+        'mmap': mmap,
+        'profile': profile,
+        'bkgd_method': bkgd_method,
+        'channel': channel
+    }
+
+    # Run in this process if only one worker is asked for, reading the next
+    # fields while this one is analysed.
+    if num_workers <= 1:
+        if num_prefetch <= 0 or profile:
+            for files in matched_images:
+                yield _run_field_safely(files, directories, **parameters)
+            return
+
+        load = partial(load_inputs, radius=radius,
+                       overlap_threshold=overlap_threshold,
+                       cache_dir=cache_dir, cache_max_bytes=cache_max_bytes,
+                       mmap=mmap, bkgd_method=bkgd_method)
+        fields = prefetch_fields(matched_images, directories, load=load,
+                                 num_prefetch=num_prefetch, channel=channel)
+        for (files, (field, *inputs)) in zip(matched_images, fields):
+            yield _run_field_safely(files, directories, inputs=inputs,
+                                    **parameters)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=num_workers)
+    pending = deque()
+
+    def submit(files):
+        try:
+            future = executor.submit(_run_field_safely, files, directories,
+                                     **parameters)
+        except BrokenProcessPool:
+            future = None
+        return files, future
+
+    def new_pool():
+        nonlocal executor
+        _shutdown(executor, pending)
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+
+    def run_alone(files):
+        # Run one field in a new pool with nothing else in it, so if its
+        # worker dies only this field fails.
+        new_pool()
+        (files, future) = submit(files)
+        try:
+            return future.result()
+        except Exception:
+            new_pool()
+            return _error_result(files, traceback.format_exc(), channel)
+
+    try:
+        # Keep a few fields queued per worker, so workers stay busy without
+        # holding results for the whole batch.
+        fields = iter(matched_images)
+        for files in islice(fields, 2 * num_workers):
+            pending.append(submit(files))
+
+        while len(pending) > 0:
+            (files, future) = pending.popleft()
+            try:
+                if future is None:
+                    raise BrokenProcessPool('The pool was already broken.')
+                result = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. it was killed for using too much
+                # memory), which stops every field in the pool. Run this
+                # field again on its own, then queue the fields that did not
+                # finish again.
+                result = run_alone(files)
+                pending = deque(
+                    (files, future) if _finished(future) else submit(files)
+                    for (files, future) in pending)
+            except Exception:
+                result = _error_result(files, traceback.format_exc(), channel)
+
+            # Queue the next field before handing back this result.
+            files = next(fields, None)
+            if files is not None:
+                pending.append(submit(files))
+
+            yield result
+    finally:
+        _shutdown(executor, pending)
+
+
+def _shutdown(executor, pending):
+    """
+    To stop a pool of iter_batch once its running fields are done, without
+    starting the fields still queued. This does the same as
+    shutdown(cancel_futures=True), which needs Python 3.9.
+    """
+
+    for (files, future) in pending:
+        if future is not None:
+            future.cancel()
+    executor.shutdown(wait=True)
+
+
+def _finished(future):
+    """
+    To check if a field of iter_batch has a result, i.e. it was not stopped
+    by a broken pool.
+    """
+
+    finished = (future is not None and future.done()
+                and not future.cancelled() and future.exception() is None)
+
+    return finished
+
+
+def run_batch(matched_images, directories, radius=5, overlap_threshold=0.9,
+              num_workers=1, cache_dir=None, cache_max_bytes=None,
+              mmap=False, profile=False, num_prefetch=2,
+              bkgd_method='dilation', channel=None):
+    """
+    To run the analysis on every field and collect the results in order.
+    See iter_batch for parameters.
+
+    Returns
+    -------
+    results = list of result dicts from run_field, in the same order as
+    matched_images
+    """
+
+    results = list(iter_batch(matched_images, directories, radius=radius,
+                              overlap_threshold=overlap_threshold,
+                              num_workers=num_workers, cache_dir=cache_dir,
+                              cache_max_bytes=cache_max_bytes, mmap=mmap,
+                              profile=profile, num_prefetch=num_prefetch,
+                              bkgd_method=bkgd_method, channel=channel))
+
+    return results
+
+
+def main():
+    import FileFunctions
+
+    inputs = FileFunctions.input_parser()
+    directories = FileFunctions.sort_images(
+        inputs['image_directory'], in_place=inputs['sort_in_place'],
+        num_threads=inputs['num_move_threads'], channels=inputs['channels'])
+    (matched_images, match_report) = FileFunctions.matching_channels(
+        directories, inputs['channels'])
+
+    for (problem, groups) in match_report.items():
+        if len(groups) > 0:
+            print(f"{len(groups)} fields were skipped because they are "
+                  f"{problem}: {sorted(groups)}")
+
+    # Field IDs are the C1 filenames without the C1 channel prefix.
+    channel = inputs['channels'][0]
+
+    # Write granules to a csv file, or to a Parquet or Arrow dataset
+    # partitioned by experiment and group.
+    header_list = ['granule', 'object_median', 'bkgd_median']
+    if inputs['results_format'] == 'csv':
+        # No date in the name, so a run resumed on a later day finds it.
+        filename = FileFunctions.csv_filename(inputs['out_put_location'],
+                                              inputs['experiment_name'],
+                                              'granules', dated=False)
+        results_writer = FileFunctions.ResultsWriter(filename, header_list)
+        field_results = list
+    else:
+        filename = os.path.join(inputs['out_put_location'], 'granules')
+        results_writer = FileFunctions.ColumnarWriter(
+            filename, inputs['experiment_name'], inputs['group_names'],
+            file_format=inputs['results_format'],
+            column_types=MEDIAN_COLUMN_TYPES)
+        field_results = median_columns
+
+    profile_records = list()
+
+    # The manifest tells which fields of an earlier run are still up to date
+    # and, through the cache, lets unchanged stages be reused.
+    manifest_file = manifest_filename(inputs['out_put_location'],
+                                      inputs['experiment_name'])
+    manifest = manifest_lib.load_manifest(manifest_file)
+    manifest_lib.write_manifest(manifest, manifest_file)
+
+    # Write each field as soon as it is done, skipping fields that an
+    # earlier, unfinished run already wrote with the same inputs,
+    # parameters and code.
+    with results_writer as writer:
+        stale = [files for files in matched_images
+                 if field_id(files[0], channel) in writer.done_fields
+                 and not is_current(files, directories,
+                                    manifest.get(field_id(files[0],
+                                                          channel)),
+                                    radius=inputs['loc_bkgd_radius'],
+                                    overlap_threshold=inputs[
+                                        'overlap_threshold'],
+                                    bkgd_method=inputs['loc_bkgd_method'])]
+        if len(stale) > 0:
+            print(f"{len(stale)} fields changed since they were written to "
+                  f"{filename}, so every field is written again.")
+            writer.restart()
+
+        to_run = [files for files in matched_images
+                  if field_id(files[0], channel) not in writer.done_fields]
+
+        for result in iter_batch(to_run, directories,
+                                 radius=inputs['loc_bkgd_radius'],
+                                 overlap_threshold=inputs['overlap_threshold'],
+                                 num_workers=inputs['num_workers'],
+                                 cache_dir=inputs['cache_directory'],
+                                 cache_max_bytes=inputs['cache_max_bytes'],
+                                 mmap=inputs['mmap'],
+                                 profile=inputs['profile'],
+                                 num_prefetch=inputs['num_prefetch'],
+                                 bkgd_method=inputs['loc_bkgd_method'],
+                                 channel=channel):
+            profile_records.extend(result.get('profile', []))
+            if result['error'] is not None:
+                print(f"Field {result['field_id']} failed:\n"
+                      f"{result['error']}")
+            else:
+                # Record the field before its rows, so a field in the
+                # results file is always in the manifest.
+                manifest_lib.add_field(manifest_file, result['field_id'],
+                                       result['stages'])
+                writer.write_field(result['field_id'],
+                                   field_results(result['medians']))
+
+    # Save QC overlays of every field, and a contact sheet of the plate.
+    if inputs['qc_overlays']:
+        import qc_lib  # qc_lib imports batch_lib
+        qc_dir = os.path.join(inputs['out_put_location'], 'qc')
+        qc_lib.render_plate(matched_images, directories, qc_dir,
+                            name=inputs['experiment_name'],
+                            downsample=inputs['qc_downsample'],
+                            num_workers=inputs['num_workers'],
+                            channel=channel)
+
+    # Save every call, and a summary of the time taken by each stage.
+    if inputs['profile']:
+        for (data_in_file, rows) in [
+                ('profile_calls', profile_records),
+                ('profile_stages', profile_lib.profile_table(profile_records))]:
+            profile_lib.write_profile(rows, FileFunctions.csv_filename(
+                inputs['out_put_location'], inputs['experiment_name'],
+                data_in_file))
+
+
+if __name__ == "__main__":
+    main()
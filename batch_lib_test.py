@@ -0,0 +1,331 @@
+import os
+import types
+import inspect
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+import tifffile
+import batch_lib
+from im_lib_benchmark import make_disc_mask, make_noisy_image
+
+
+def write_field(directories, name, seed=0):
+    """
+    To write the C1, C2 and C3 images and _seg.npy masks of one synthetic
+    field, and return the matched filenames.
+    """
+    granules = make_disc_mask(num_labels=20, radius=3, seed=seed)
+    cells = make_disc_mask(num_labels=3, radius=30, seed=seed)
+    masks = [granules, cells, cells]
+    files = list()
+    for (channel, folder, mask) in zip(['C1', 'C2', 'C3'], directories,
+                                       masks):
+        file = f"{channel}-{name}.tif"
+        path = os.path.join(folder, file)
+        tifffile.imwrite(path, make_noisy_image(granules, seed=seed))
+        numpy.save(batch_lib.seg_filename(path), {'masks': mask})
+        files.append(file)
+    return files
+
+
+def called_functions(function, modules=('im_lib', 'stats_lib')):
+    """
+    To find the functions of modules that a function calls, by the names
+    used in its code (and in the code of its nested functions).
+    """
+    function = inspect.unwrap(function)
+    codes = [function.__code__]
+    names = set()
+    while len(codes) > 0:
+        code = codes.pop()
+        names.update(code.co_names)
+        codes.extend(const for const in code.co_consts
+                     if isinstance(const, types.CodeType))
+    scopes = [function.__globals__] + [
+        vars(value) for value in function.__globals__.values()
+        if isinstance(value, types.ModuleType) and value.__name__ in modules]
+    called = set()
+    for name in names:
+        for scope in scopes:
+            value = scope.get(name)
+            if inspect.isfunction(value) and value.__module__ in modules:
+                called.add(inspect.unwrap(value))
+    return called
+
+
+class ExitOnLoad:
+    """
+    A mask file that ends the process that reads it, like a worker that is
+    killed for using too much memory.
+    """
+    def __reduce__(self):
+        return (os._exit, (1,))
+
+
+class Python38Executor(ProcessPoolExecutor):
+    """
+    A pool with the shutdown of Python 3.8, which has no cancel_futures.
+    """
+    def shutdown(self, wait=True):
+        super().shutdown(wait=wait)
+
+
+class RunBatchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning RunBatch class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning RunBatch class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directories = list()
+        for channel in ['C1', 'C2', 'C3']:
+            folder = os.path.join(self.tmp.name, channel)
+            os.mkdir(folder)
+            self.directories.append(folder)
+        self.matched = [write_field(self.directories, f"field_{i:03d}", i)
+                        for i in range(4)]
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def test_rb_fieldId(self):
+        res = batch_lib.field_id('C1-210903_GFP-G3BP1_6xA_004.tif')
+        exp = '210903_GFP-G3BP1_6xA_004'
+        self.assertEqual(res, exp)
+
+    def test_rb_fieldIdLongChannel(self):
+        # 'C10' and 'C1' fields must not share IDs, and a channel prefix
+        # that was matched is stripped whatever its length.
+        self.assertEqual(batch_lib.field_id('C10-x_004.tif'), 'x_004')
+        self.assertEqual(batch_lib.field_id('C10-x_004.tif', 'C10'), 'x_004')
+        self.assertEqual(batch_lib.field_id('DAPI2_x_004.tif', 'DAPI2'),
+                         'x_004')
+        self.assertEqual(batch_lib.field_id('G3BP1-x.tif', 'G'), '3BP1-x')
+
+    def test_rb_sameAsSerial(self):
+        serial = batch_lib.run_batch(self.matched, self.directories)
+        res = batch_lib.run_batch(self.matched, self.directories,
+                                  num_workers=2)
+        self.assertEqual([r['field_id'] for r in res],
+                         [f"field_{i:03d}" for i in range(4)])
+        for (a, b) in zip(serial, res):
+            self.assertIsNone(b['error'])
+            self.assertEqual(a['medians'], b['medians'])
+            numpy.testing.assert_array_equal(a['overlap_table'],
+                                             b['overlap_table'])
+
+    def test_rb_errorIsolated(self):
+        os.remove(os.path.join(self.directories[1], self.matched[1][1]))
+        res = batch_lib.run_batch(self.matched, self.directories,
+                                  num_workers=2)
+        self.assertEqual(len(res), 4)
+        self.assertIn('FileNotFoundError', res[1]['error'])
+        self.assertIsNone(res[2]['error'])
+
+    def test_rb_deadWorkerIsolated(self):
+        path = os.path.join(self.directories[0], self.matched[1][0])
+        numpy.save(batch_lib.seg_filename(path),
+                   numpy.array(ExitOnLoad(), dtype=object))
+        res = list(batch_lib.iter_batch(self.matched, self.directories,
+                                        num_workers=2))
+        self.assertEqual([r['field_id'] for r in res],
+                         [f"field_{i:03d}" for i in range(4)])
+        self.assertIn('BrokenProcessPool', res[1]['error'])
+        for index in [0, 2, 3]:
+            self.assertIsNone(res[index]['error'])
+
+    def test_rb_python38Shutdown(self):
+        path = os.path.join(self.directories[0], self.matched[1][0])
+        numpy.save(batch_lib.seg_filename(path),
+                   numpy.array(ExitOnLoad(), dtype=object))
+        with mock.patch.object(batch_lib, 'ProcessPoolExecutor',
+                               Python38Executor):
+            res = list(batch_lib.iter_batch(self.matched, self.directories,
+                                            num_workers=2))
+            # Stopping early cancels the fields still queued.
+            batch = batch_lib.iter_batch(self.matched * 2, self.directories,
+                                         num_workers=2)
+            next(batch)
+            batch.close()
+        self.assertEqual(len(res), 4)
+        self.assertIn('BrokenProcessPool', res[1]['error'])
+        self.assertIsNone(res[3]['error'])
+
+
+class PrefetchTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning Prefetch class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning Prefetch class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directories = list()
+        for channel in ['C1', 'C2', 'C3']:
+            folder = os.path.join(self.tmp.name, channel)
+            os.mkdir(folder)
+            self.directories.append(folder)
+        self.matched = [write_field(self.directories, f"field_{i:03d}", i)
+                        for i in range(4)]
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def test_pf_inOrder(self):
+        res = list(batch_lib.prefetch_fields(self.matched, self.directories))
+        self.assertEqual([r[0] for r in res],
+                         [f"field_{i:03d}" for i in range(4)])
+        self.assertEqual(len(res[0]), 4)
+        path = os.path.join(self.directories[1], self.matched[2][1])
+        numpy.testing.assert_array_equal(res[2][2],
+                                         batch_lib.im_lib.read_image(path))
+
+    def test_pf_bounded(self):
+        loaded = list()
+        lock = threading.Lock()
+
+        def load(paths):
+            with lock:
+                loaded.append(paths[0])
+            return paths
+
+        fields = batch_lib.prefetch_fields(self.matched, self.directories,
+                                           load=load, num_prefetch=2)
+        next(fields)
+        # the first field and the two after it
+        self.assertEqual(len(loaded), 3)
+        fields.close()
+
+    def test_pf_errorAtItsField(self):
+        def load(paths):
+            if 'field_001' in paths[0]:
+                raise FileNotFoundError(paths[0])
+            return paths
+
+        fields = batch_lib.prefetch_fields(self.matched, self.directories,
+                                           load=load)
+        self.assertEqual(next(fields)[0], 'field_000')
+        with self.assertRaises(FileNotFoundError):
+            next(fields)
+
+    def test_pf_batchErrorIsolated(self):
+        os.remove(os.path.join(self.directories[1], self.matched[1][1]))
+        res = batch_lib.run_batch(self.matched, self.directories,
+                                  num_prefetch=2)
+        self.assertEqual(len(res), 4)
+        self.assertIn('FileNotFoundError', res[1]['error'])
+        self.assertIsNone(res[2]['error'])
+
+    def test_pf_sameAsNoPrefetch(self):
+        res = batch_lib.run_batch(self.matched, self.directories,
+                                  num_prefetch=2)
+        exp = batch_lib.run_batch(self.matched, self.directories,
+                                  num_prefetch=0)
+        for (a, b) in zip(exp, res):
+            self.assertEqual(a['medians'], b['medians'])
+
+
+class StageCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning StageCache class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning StageCache class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.directories = list()
+        for channel in ['C1', 'C2', 'C3']:
+            folder = os.path.join(self.tmp.name, channel)
+            os.mkdir(folder)
+            self.directories.append(folder)
+        self.files = write_field(self.directories, 'field_000')
+        self.first = batch_lib.run_field(self.files, self.directories,
+                                         cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def test_sc_unchangedIsReused(self):
+        res = batch_lib.run_field(self.files, self.directories,
+                                  cache_dir=self.cache_dir)
+        self.assertEqual(set(self.first['computed']),
+                         {'loc_bkgd', 'find_object', 'find_overlap'})
+        self.assertEqual(res['computed'], [])
+        self.assertEqual(res['medians'], self.first['medians'])
+        numpy.testing.assert_array_equal(res['overlap_table'],
+                                         self.first['overlap_table'])
+
+    def test_sc_onlyChangedStagesRun(self):
+        res = batch_lib.run_field(self.files, self.directories,
+                                  overlap_threshold=0.5,
+                                  cache_dir=self.cache_dir)
+        self.assertEqual(res['computed'], ['find_overlap'])
+        res = batch_lib.run_field(self.files, self.directories, radius=3,
+                                  cache_dir=self.cache_dir)
+        self.assertEqual(set(res['computed']), {'loc_bkgd', 'find_object'})
+        res = batch_lib.run_field(self.files, self.directories, radius=3,
+                                  bkgd_method='edt', cache_dir=self.cache_dir)
+        self.assertEqual(set(res['computed']), {'loc_bkgd', 'find_object'})
+
+    def test_sc_changedInputRuns(self):
+        path = os.path.join(self.directories[1], self.files[1])
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        res = batch_lib.run_field(self.files, self.directories,
+                                  cache_dir=self.cache_dir)
+        self.assertEqual(res['computed'], ['find_object'])
+
+    def test_sc_loadOnlyUncached(self):
+        paths = [os.path.join(folder, file)
+                 for (folder, file) in zip(self.directories, self.files)]
+        res = batch_lib.load_inputs(paths, cache_dir=self.cache_dir)
+        self.assertEqual(res, [dict(), dict(), dict()])
+        res = batch_lib.load_inputs(paths, overlap_threshold=0.5,
+                                    cache_dir=self.cache_dir)
+        self.assertEqual([sorted(channel) for channel in res],
+                         [[], ['mask'], ['mask']])
+
+    def test_sc_everyCalledFunctionListed(self):
+        for (name, functions) in batch_lib.STAGE_FUNCTIONS.items():
+            listed = {inspect.unwrap(function) for function in functions}
+            missing = set()
+            for function in listed:
+                missing |= called_functions(function) - listed
+            self.assertEqual(sorted(f.__name__ for f in missing), [],
+                             f"not in STAGE_FUNCTIONS['{name}']")
+
+    def test_sc_isCurrent(self):
+        old_stages = self.first['stages']
+        self.assertTrue(batch_lib.is_current(self.files, self.directories,
+                                             old_stages))
+        self.assertFalse(batch_lib.is_current(self.files, self.directories,
+                                              old_stages, radius=3))
+        self.assertFalse(batch_lib.is_current(self.files, self.directories,
+                                              None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,278 @@
+import os
+import hashlib
+import tempfile
+import numpy
+
+"""
+This library keeps decoded images and masks on disk as plain NumPy files,
+so they do not have to be decoded again on the next run. Cached files are
+keyed by the path, modification time and size of the source file, and the
+least recently used ones are removed when the cache gets too big.
+
+Plain NumPy files can also be memory-mapped, so processes reading the same
+file share its pages through the operating system instead of each holding
+a copy.
+"""
+
+
+def cache_key(filename, kind=''):
+    """
+    To make the cache key of a source file.
+
+    Parameters
+    ----------
+    filename = full path of the source file
+
+    kind = str to tell apart different arrays read from the same file
+    The default value is '' (nothing).
+
+    Returns
+    -------
+    key = str of a hash of the path, modification time, size and kind
+    """
+
+    info = os.stat(filename)
+    source = f"{os.path.abspath(filename)}|{info.st_mtime_ns}|{info.st_size}"
+    key = hashlib.sha1(f"{source}|{kind}".encode()).hexdigest()
+
+    return key
+
+
+def load_cached(filename, loader, cache_dir, kind='', max_bytes=None,
+                mmap_mode=None):
+    """
+    To load an array from the cache, or from the source file if it is not in
+    the cache yet (and then add it to the cache).
+
+    Parameters
+    ----------
+    filename = full path of the source file
+
+    loader = function that reads filename into a NumPy array
+
+    cache_dir = full path of the cache folder, made if it does not exist
+
+    kind = str to tell apart different arrays read from the same file
+    The default value is '' (nothing).
+
+    max_bytes = int for the largest size of the cache in bytes, or None for
+    no limit. The default value is None.
+
+    mmap_mode = optional str passed to numpy.load, e.g. 'r' to return a
+    read-only memory map of the cached file. The default value is None.
+
+    Returns
+    -------
+    array = NumPy array read by loader
+    """
+
+    array = load_keyed(cache_key(filename, kind), lambda: loader(filename),
+                       cache_dir, max_bytes=max_bytes, mmap_mode=mmap_mode)
+
+    return array
+
+
+def load_keyed(key, compute, cache_dir, max_bytes=None, mmap_mode=None):
+    """
+    To load an array from the cache by its key, or compute it if it is not
+    in the cache yet (and then add it to the cache). This is for arrays that
+    are made from more than one file, such as the results of a stage of the
+    analysis, where the key has to be made by the caller.
+
+    Parameters
+    ----------
+    key = str that names the array in the cache, e.g. a hash of everything
+    the array depends on
+
+    compute = function without arguments that makes the NumPy array
+
+    cache_dir = full path of the cache folder, made if it does not exist
+
+    max_bytes = int for the largest size of the cache in bytes, or None for
+    no limit. The default value is None.
+
+    mmap_mode = optional str passed to numpy.load, e.g. 'r' to return a
+    read-only memory map of the cached file. The default value is None.
+
+    Returns
+    -------
+    array = NumPy array from the cache or from compute
+    """
+
+    cached_file = os.path.join(cache_dir, key + '.npy')
+
+    try:
+        array = numpy.load(cached_file, mmap_mode=mmap_mode)
+        # Mark as recently used.
+        os.utime(cached_file)
+        return array
+    except (FileNotFoundError, ValueError, OSError):
+        # Not cached yet, removed by another process, or only partly written.
+        pass
+
+    array = compute()
+    save_cached(array, cached_file)
+
+    # Map the file before trimming the cache. If another process already
+    # removed it, the array in memory is returned.
+    if mmap_mode is not None:
+        try:
+            array = numpy.load(cached_file, mmap_mode=mmap_mode)
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+
+    if max_bytes is not None:
+        evict(cache_dir, max_bytes, keep=[cached_file])
+
+    return array
+
+
+def is_cached(key, cache_dir):
+    """
+    To check if an array is in the cache, without loading it.
+
+    Parameters
+    ----------
+    key = str that names the array in the cache (see load_keyed)
+
+    cache_dir = full path of the cache folder
+
+    Returns
+    -------
+    cached = bool, True if the array is in the cache
+    """
+
+    cached = os.path.exists(os.path.join(cache_dir, key + '.npy'))
+
+    return cached
+
+
+def sidecar_filename(filename, kind=''):
+    """
+    To find the sidecar file that holds the decoded array of a source file.
+    The sidecar is a hidden file in the same folder as the source file.
+
+    Parameters
+    ----------
+    filename = full path of the source file
+
+    kind = str to tell apart different arrays read from the same file
+    The default value is '' (nothing).
+
+    Returns
+    -------
+    sidecar = full path of the sidecar NumPy file (.npy)
+    """
+
+    (folder, name) = os.path.split(filename)
+    sidecar = os.path.join(folder, f".{name}.{kind}.npy")
+
+    return sidecar
+
+
+def load_sidecar(filename, loader, kind='', mmap_mode='r'):
+    """
+    To load an array from the sidecar file of a source file, making the
+    sidecar the first time (or again if the source file is newer).
+
+    Parameters
+    ----------
+    filename = full path of the source file
+
+    loader = function that reads filename into a NumPy array
+
+    kind = str to tell apart different arrays read from the same file
+    The default value is '' (nothing).
+
+    mmap_mode = str passed to numpy.load. The default value is 'r', which
+    returns a read-only memory map of the sidecar.
+
+    Returns
+    -------
+    array = NumPy array (or memory map) of the decoded source file
+    """
+
+    sidecar = sidecar_filename(filename, kind)
+
+    try:
+        if os.stat(sidecar).st_mtime_ns >= os.stat(filename).st_mtime_ns:
+            return numpy.load(sidecar, mmap_mode=mmap_mode)
+    except (FileNotFoundError, ValueError, OSError):
+        # No sidecar yet, or only partly written.
+        pass
+
+    save_cached(loader(filename), sidecar)
+
+    return numpy.load(sidecar, mmap_mode=mmap_mode)
+
+
+def save_cached(array, cached_file):
+    """
+    To save an array to the cache. The array is written to a temporary file
+    first and then renamed, so other processes never see a partial file.
+    """
+
+    cache_dir = os.path.dirname(cached_file)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    (handle, tmp_file) = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            numpy.save(file, numpy.asarray(array))
+        os.replace(tmp_file, cached_file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
+def evict(cache_dir, max_bytes, keep=()):
+    """
+    To remove the least recently used files from the cache until it is no
+    bigger than max_bytes.
+
+    Parameters
+    ----------
+    cache_dir = full path of the cache folder
+
+    max_bytes = int for the largest size of the cache in bytes
+
+    keep = list of full paths of files that are never removed, e.g. the
+    file that was just written. The default value is () (none).
+
+    Returns
+    -------
+    removed = list of the full paths of the removed files
+    """
+
+    keep = {os.path.abspath(path) for path in keep}
+    entries = list()
+    for entry in os.scandir(cache_dir):
+        if (entry.name.endswith('.npy')
+                and os.path.abspath(entry.path) not in keep):
+            try:
+                info = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((info.st_mtime_ns, info.st_size, entry.path))
+
+    # Files that are kept still count towards the size of the cache.
+    total = sum(size for (used, size, path) in entries)
+    for path in keep:
+        try:
+            total += os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+    removed = list()
+
+    # Oldest use first.
+    for (used, size, path) in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed.append(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return removed
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+import numpy
+import cache_lib
+
+
+class LoadCachedTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning LoadCached class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning LoadCached class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.source = os.path.join(self.tmp.name, 'source.npy')
+        numpy.save(self.source, numpy.arange(10))
+        self.calls = 0
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def loader(self, filename):
+        self.calls += 1
+        return numpy.load(filename)
+
+    def test_lc_loadsOnce(self):
+        first = cache_lib.load_cached(self.source, self.loader,
+                                      self.cache_dir)
+        second = cache_lib.load_cached(self.source, self.loader,
+                                       self.cache_dir)
+        numpy.testing.assert_array_equal(first, second)
+        self.assertEqual(self.calls, 1)
+
+    def test_lc_changedSourceReloads(self):
+        cache_lib.load_cached(self.source, self.loader, self.cache_dir)
+        numpy.save(self.source, numpy.arange(12))
+        res = cache_lib.load_cached(self.source, self.loader, self.cache_dir)
+        self.assertEqual(len(res), 12)
+        self.assertEqual(self.calls, 2)
+
+    def test_lc_kindsAreSeparate(self):
+        cache_lib.load_cached(self.source, self.loader, self.cache_dir,
+                              kind='a')
+        cache_lib.load_cached(self.source, self.loader, self.cache_dir,
+                              kind='b')
+        self.assertEqual(self.calls, 2)
+
+    def test_lc_evictsLeastRecentlyUsed(self):
+        os.makedirs(self.cache_dir)
+        for (name, used) in [('new', 300), ('old', 100), ('mid', 200)]:
+            path = os.path.join(self.cache_dir, name + '.npy')
+            numpy.save(path, numpy.zeros(100, dtype=numpy.uint8))
+            os.utime(path, (used, used))
+        size = os.path.getsize(path)
+        removed = cache_lib.evict(self.cache_dir, 2 * size)
+        res = [os.path.basename(path) for path in removed]
+        self.assertEqual(res, ['old.npy'])
+
+    def test_lc_biggerThanCache(self):
+        for mmap_mode in [None, 'r']:
+            key = f"big-{mmap_mode}"
+            res = cache_lib.load_keyed(key, lambda: numpy.zeros(1000),
+                                       self.cache_dir, max_bytes=100,
+                                       mmap_mode=mmap_mode)
+            numpy.testing.assert_array_equal(res, numpy.zeros(1000))
+            self.assertTrue(cache_lib.is_cached(key, self.cache_dir))
+            del res
+
+
+class LoadSidecarTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning LoadSidecar class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning LoadSidecar class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'C1-field_seg.npy')
+        numpy.save(self.source, {'masks': numpy.eye(4, dtype=numpy.uint16)})
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def loader(self, filename):
+        return numpy.load(filename, allow_pickle=True).item()['masks']
+
+    def test_ls_returnsMemoryMap(self):
+        res = cache_lib.load_sidecar(self.source, self.loader, kind='masks')
+        self.assertIsInstance(res, numpy.memmap)
+        numpy.testing.assert_array_equal(res, numpy.eye(4))
+        sidecar = cache_lib.sidecar_filename(self.source, 'masks')
+        self.assertTrue(os.path.basename(sidecar).startswith('.'))
+        self.assertTrue(os.path.exists(sidecar))
+
+    def test_ls_newerSourceRemakesSidecar(self):
+        cache_lib.load_sidecar(self.source, self.loader, kind='masks')
+        numpy.save(self.source, {'masks': numpy.ones((2, 2))})
+        sidecar = cache_lib.sidecar_filename(self.source, 'masks')
+        os.utime(sidecar, (0, 0))
+        res = cache_lib.load_sidecar(self.source, self.loader, kind='masks')
+        self.assertEqual(res.shape, (2, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
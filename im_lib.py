@@ -1,13 +1,21 @@
 from typing import Tuple, Any
+import struct, zlib  # for writing PNG files
 import numpy
-from matplotlib import pyplot
-from skimage.morphology import dilation, disk
-from statistics import median
-from scipy.stats import ttest_ind
+from scipy.ndimage import (distance_transform_edt, find_objects, label,
+                           maximum_filter1d)
+import cache_lib
+import manifest_lib
+import profile_lib
+import stats_lib
 
 """
 This library includes functions for image manipulation, including reading
 images, masking images, finding objects that overlap, and displaying images.
+
+Only NumPy and scipy.ndimage are imported with the library. Plotting
+(matplotlib), statistics (scipy.special) and file readers (tifffile) are
+imported the first time they are used, so scripts and worker processes that
+do not need them start faster.
 """
 
 
@@ -32,26 +40,154 @@ def show_moi(img1, img2, img3):
 
     Returns
     -------
-    None, just shows an image
+    None, just shows an image. See save_moi to save it to a file instead.
     """
 
     # Create 3D image in order ((r, g, b)).
     overlay = numpy.dstack((img1, img2, img3))
 
     # Display image.
+    from matplotlib import pyplot
     pyplot.imshow(overlay)
     pyplot.show()
 
     return None
 
 
-def mask_object(filename):
+def make_overlay(img1, img2, img3, downsample=1):
+    """
+    To make an RGB image of three "images" overlaid on top of each other,
+    the same as show_moi shows. img1 will be red, img2 will be green, img3
+    will be blue. Values are clipped to 0-1, as pyplot.imshow does.
+
+    Parameters
+    ----------
+    img1, img2, img3 = NumPy arrays of the same shape, see show_moi
+
+    downsample = int for the factor to shrink the image by, averaging each
+    block of downsample x downsample pixels. The default value is 1 (none).
+
+    Returns
+    -------
+    overlay = NumPy array of uint8 of shape (rows, columns, 3)
+    """
+
+    channels = [_downsample(numpy.asarray(img, dtype=numpy.float32),
+                            downsample) for img in (img1, img2, img3)]
+    overlay = numpy.empty(channels[0].shape + (3,), dtype=numpy.uint8)
+    for (index, channel) in enumerate(channels):
+        numpy.clip(channel, 0, 1, out=channel)
+        overlay[:, :, index] = channel * 255 + 0.5
+
+    return overlay
+
+
+def _downsample(img, factor):
+    """
+    To shrink an image by an int factor, averaging each block of factor x
+    factor pixels. Rows and columns that do not fill a block are dropped.
+    """
+
+    if factor <= 1:
+        return img
+
+    rows = img.shape[0] // factor * factor
+    columns = img.shape[1] // factor * factor
+
+    # Adding the factor x factor strided views of the image is much faster
+    # than a mean over a reshaped array.
+    total = numpy.zeros(((rows // factor), (columns // factor))
+                        + img.shape[2:], dtype=numpy.float32)
+    for row in range(factor):
+        for column in range(factor):
+            total += img[row:rows:factor, column:columns:factor]
+    total /= factor * factor
+
+    return total
+
+
+def save_moi(filename, img1, img2, img3, downsample=1):
+    """
+    To save three "images" overlaid on top of each other to a PNG file,
+    without a display or a figure. See show_moi for the colours and for
+    examples of scaling the images.
+
+    Parameters
+    ----------
+    filename = full path of the PNG file to write
+
+    img1, img2, img3 = NumPy arrays of the same shape
+
+    downsample = int for the factor to shrink the image by
+    The default value is 1 (none).
+
+    Returns
+    -------
+    overlay = NumPy array of uint8 of the RGB image that was saved
+    """
+
+    overlay = make_overlay(img1, img2, img3, downsample=downsample)
+    write_png(filename, overlay)
+
+    return overlay
+
+
+def write_png(filename, img, compress_level=1):
+    """
+    To write an 8-bit grayscale or RGB image to a PNG file, encoded directly
+    with zlib.
+
+    Parameters
+    ----------
+    filename = full path of the PNG file to write
+
+    img = NumPy array of uint8, of shape (rows, columns) for grayscale or
+    (rows, columns, 3) for RGB
+
+    compress_level = int from 0 to 9 for the zlib compression level. The
+    default value is 1, which is fast and still shrinks masks a lot.
+    """
+
+    img = numpy.ascontiguousarray(img, dtype=numpy.uint8)
+    (rows, columns) = img.shape[:2]
+    color_type = 2 if img.ndim == 3 else 0
+
+    # Every row starts with filter type 0 (none).
+    raw = numpy.zeros((rows, 1 + img[0].size), dtype=numpy.uint8)
+    raw[:, 1:] = img.reshape(rows, -1)
+
+    def chunk(kind, data):
+        body = kind + data
+        return (struct.pack('>I', len(data)) + body
+                + struct.pack('>I', zlib.crc32(body)))
+
+    header = struct.pack('>IIBBBBB', columns, rows, 8, color_type, 0, 0, 0)
+    with open(filename, 'wb') as file:
+        file.write(b'\x89PNG\r\n\x1a\n')
+        file.write(chunk(b'IHDR', header))
+        file.write(chunk(b'IDAT', zlib.compress(raw.tobytes(),
+                                                compress_level)))
+        file.write(chunk(b'IEND', b''))
+
+
+@profile_lib.instrument
+def mask_object(filename, cache_dir=None, cache_max_bytes=None,
+                mmap=False):
     """
     To read a masked image file into a NumPy array.
     
     Parameters
     ----------
     filename = full path of the NumPy file (.npy)
+
+    cache_dir = optional full path of a cache folder, so the mask is only
+    unpickled the first time it is read (see cache_lib)
+
+    cache_max_bytes = optional int for the largest size of the cache in bytes
+
+    mmap = bool, if True return a read-only memory map of a plain .npy copy
+    of the decoded array. The copy is kept in cache_dir if given, and in a
+    hidden sidecar file next to filename if not. The default is False.
     
     Returns
     -------
@@ -84,6 +220,27 @@ def mask_object(filename):
     # From command line for C1 for granules:
     # python -m cellpose --dir ~/images/ --pretrained_model cyto --diameter 15
 
+    mmap_mode = 'r' if mmap else None
+
+    kind = _decoded_kind('masks', MASK_READ_FUNCTIONS)
+
+    if cache_dir is not None:
+        return cache_lib.load_cached(filename, _read_seg_masks, cache_dir,
+                                     kind=kind, max_bytes=cache_max_bytes,
+                                     mmap_mode=mmap_mode)
+
+    if mmap:
+        return cache_lib.load_sidecar(filename, _read_seg_masks, kind=kind,
+                                      mmap_mode=mmap_mode)
+
+    return _read_seg_masks(filename)
+
+
+def _read_seg_masks(filename):
+    """
+    To read the masks out of a Cellpose _seg.npy file.
+    """
+
     # Load whole file.
     data = numpy.load(filename, allow_pickle=True).item()
 
@@ -94,25 +251,334 @@ def mask_object(filename):
     return object_mask
 
 
-def read_image(filename):
+@profile_lib.instrument
+def read_image(filename, cache_dir=None, cache_max_bytes=None,
+               mmap=False, page=None, channel=None, z=None):
     """
     To read an image file into a NumPy array.
+
+    TIFF files are read with tifffile, which keeps the bit depth of the file
+    (e.g. 16-bit) and decodes only the page that is asked for. Other files
+    are read with pyplot.imread.
     
     Parameters
     ----------
     filename = full path of an image file
+
+    cache_dir = optional full path of a cache folder, so the image is only
+    decoded the first time it is read (see cache_lib)
+
+    cache_max_bytes = optional int for the largest size of the cache in bytes
+
+    mmap = bool, if True return a read-only memory map of a plain .npy copy
+    of the decoded array. The copy is kept in cache_dir if given, and in a
+    hidden sidecar file next to filename if not. The default is False.
+
+    page = optional int for the page of a TIFF file to read
+    The default is the first page, or the page of channel and z.
+
+    channel = optional int for the channel of a multi-channel TIFF file
+
+    z = optional int for the z-slice of a z-stack TIFF file
     
     Returns
     -------
     img = NumPy array of the image
     """
 
-    img = pyplot.imread(filename)
+    mmap_mode = 'r' if mmap else None
+
+    if _is_tiff(filename):
+        loader = lambda name: _read_tiff(name, page=page, channel=channel, z=z)
+    else:
+        loader = _read_other
+
+    # Each page, channel and z-slice is cached on its own.
+    kind = 'image'
+    if (page, channel, z) != (None, None, None):
+        kind = f"image-page{page}-channel{channel}-z{z}"
+    kind = _decoded_kind(kind, IMAGE_READ_FUNCTIONS)
+
+    if cache_dir is not None:
+        return cache_lib.load_cached(filename, loader, cache_dir,
+                                     kind=kind, max_bytes=cache_max_bytes,
+                                     mmap_mode=mmap_mode)
+
+    if mmap:
+        return cache_lib.load_sidecar(filename, loader, kind=kind,
+                                      mmap_mode=mmap_mode)
+
+    img = loader(filename)
 
     return img
 
 
-def mask_loc_bkgd(object_mask, radius=5):
+def _read_other(filename):
+    """
+    To read an image file that is not a TIFF file with pyplot.imread.
+    """
+
+    from matplotlib import pyplot
+
+    return pyplot.imread(filename)
+
+
+def _is_tiff(filename):
+    """
+    To check if a file is a TIFF file from its extension.
+    """
+
+    return filename.lower().endswith(('.tif', '.tiff'))
+
+
+def _read_tiff(filename, page=None, channel=None, z=None):
+    """
+    To read one plane of a TIFF file, decoding only the page it is in.
+
+    Parameters
+    ----------
+    filename = full path of a TIFF file
+
+    page = optional int for the page to read. If given, channel and z are
+    only used to pick from a page that holds more than one channel.
+
+    channel = optional int for the channel, from a channel axis ('C') of the
+    pages or from the samples of a page (e.g. RGB)
+
+    z = optional int for the z-slice, from a z axis ('Z') of the pages
+
+    Returns
+    -------
+    img = NumPy array of the plane, of the same type as the file
+    """
+
+    import tifffile
+
+    with tifffile.TiffFile(filename) as tif:
+        series = tif.series[0]
+        plane_axes = series.keyframe.axes
+        page_axes = series.axes[:len(series.axes) - len(plane_axes)]
+        page_shape = series.shape[:len(page_axes)]
+
+        # Find the page of channel and z, and 0 for any other axis.
+        if page is None:
+            index = [0] * len(page_axes)
+            for (axis, value) in [('C', channel), ('Z', z)]:
+                if value is None:
+                    continue
+                in_page = axis == 'C' and ('C' in plane_axes
+                                           or 'S' in plane_axes)
+                if axis in page_axes:
+                    index[page_axes.index(axis)] = value
+                elif value != 0 and not in_page:
+                    raise ValueError(f"{filename} has no '{axis}' axis, "
+                                     f"only '{series.axes}'.")
+            page = int(numpy.ravel_multi_index(index, page_shape))
+
+        img = tif.asarray(key=page, series=0)
+
+    # Pick the channel out of a page with more than one.
+    if channel is not None and 'C' not in page_axes:
+        for axis in ['C', 'S']:
+            if axis in plane_axes:
+                img = img.take(channel, axis=plane_axes.index(axis))
+                break
+
+    return img
+
+
+# The functions that decode images and masks. A hash of their code is part
+# of the cache key, so arrays decoded by older code are decoded again.
+IMAGE_READ_FUNCTIONS = [read_image, _is_tiff, _read_tiff, _read_other]
+MASK_READ_FUNCTIONS = [mask_object, _read_seg_masks]
+
+
+def _decoded_kind(kind, functions):
+    """
+    To add the version of the code that decodes an array to its cache kind.
+    """
+
+    return f"{kind}-{manifest_lib.code_version(functions)[:12]}"
+
+
+def object_slices(object_mask, pad=0):
+    """
+    To find the bounding box of each object in a mask, so that work on one
+    object only has to look at the pixels in its box. Build this once per
+    mask and pass it to any function that measures objects one at a time.
+
+    Parameters
+    ----------
+    object_mask = NumPy array where int = object, 0 = background
+
+    pad = int for number of pixels to grow each box by on every side
+    Boxes are clipped to the edges of the mask. The default value is 0.
+
+    Returns
+    -------
+    slices = list where slices[mask - 1] is a tuple of slices (rows, columns)
+    for that mask, or None if that mask has no pixels
+    """
+
+    # find_objects needs integer masks.
+    labels = _as_labels(object_mask)
+
+    slices = find_objects(labels)
+
+    if pad > 0:
+        matrix_size = numpy.shape(labels)
+        slices = [_pad_slice(box, pad, matrix_size) for box in slices]
+
+    return slices
+
+
+def _pad_slice(box, pad, matrix_size):
+    """
+    To grow a bounding box by pad pixels on every side, clipped to the
+    edges of an array of size matrix_size. None stays None.
+    """
+
+    if box is None:
+        return None
+
+    return tuple(slice(max(side.start - pad, 0), min(side.stop + pad, size))
+                 for side, size in zip(box, matrix_size))
+
+
+def _union_slice(slices):
+    """
+    To find one bounding box that holds every box in a list of boxes.
+    Returns None if there are no boxes.
+    """
+
+    boxes = [box for box in slices if box is not None]
+    if len(boxes) == 0:
+        return None
+
+    return tuple(slice(min(box[axis].start for box in boxes),
+                       max(box[axis].stop for box in boxes))
+                 for axis in range(len(boxes[0])))
+
+
+def label_dtype(max_label):
+    """
+    To find the smallest unsigned integer type that holds every mask up to
+    max_label. Label masks made by im_lib use this type, so they take 1, 2
+    or 4 bytes per pixel instead of 8.
+
+    Parameters
+    ----------
+    max_label = int of the highest mask
+
+    Returns
+    -------
+    dtype = NumPy type (uint8, uint16, uint32 or uint64)
+    """
+
+    for dtype in [numpy.uint8, numpy.uint16, numpy.uint32]:
+        if max_label <= numpy.iinfo(dtype).max:
+            return dtype
+
+    return numpy.uint64
+
+
+def _label_out(out, matrix_size, max_label):
+    """
+    To make an empty label mask for results, or clear and reuse out.
+    out must have the right size and an integer type that holds max_label.
+    """
+
+    if out is None:
+        return numpy.zeros(matrix_size, dtype=label_dtype(max_label))
+
+    if numpy.shape(out) != tuple(matrix_size):
+        raise ValueError(f"out has size {numpy.shape(out)}, but the result "
+                         f"has size {tuple(matrix_size)}.")
+    if (not numpy.issubdtype(out.dtype, numpy.integer)
+            or max_label > numpy.iinfo(out.dtype).max):
+        raise ValueError(f"out has type {out.dtype}, which cannot hold "
+                         f"mask {max_label}.")
+    out[...] = 0
+
+    return out
+
+
+def _as_labels(mask):
+    """
+    To make a mask usable as an index into per-mask arrays. Integer masks
+    are used as they are; other masks are turned into integers.
+    """
+
+    mask = numpy.asarray(mask)
+    if numpy.issubdtype(mask.dtype, numpy.integer):
+        return mask
+
+    return mask.astype(numpy.intp)
+
+
+def _disk(radius):
+    """
+    To make a disk of a given radius in pixels, the same as
+    skimage.morphology.disk(radius) without importing skimage.
+
+    Returns
+    -------
+    struct = NumPy array of uint8 where 1 = in the disk, of size
+    (2 * radius + 1) x (2 * radius + 1)
+    """
+
+    offsets = numpy.arange(-radius, (radius + 1))
+    distance = offsets[:, None] ** 2 + offsets[None, :] ** 2
+    struct = (distance <= radius ** 2).astype(numpy.uint8)
+
+    return struct
+
+
+def _disk_dilation(object_mask, radius):
+    """
+    To dilate a mask by a disk of a given radius. This gives the same result
+    as skimage.morphology.dilation(object_mask, disk(radius)), but splits the
+    disk into rows so each row is a fast 1D maximum filter along the image
+    rows, and the rows are combined with shifted maximums.
+
+    Parameters
+    ----------
+    object_mask = NumPy array where int = object, 0 = background
+
+    radius = int for pixel radius of the disk
+
+    Returns
+    -------
+    dilated_mask = NumPy array where int = dilated object, 0 = background
+    """
+
+    # Find half width of the disk for each row of the disk.
+    struct = _disk(radius)  # Make disk of given radius in pixels.
+    half_widths = numpy.count_nonzero(struct, axis=1) // 2
+
+    # Dilate along image rows once for each different half width.
+    row_max = dict()
+    for width in numpy.unique(half_widths):
+        row_max[width] = maximum_filter1d(object_mask, size=(2 * width + 1),
+                                          axis=1)
+
+    # Start from the middle row of the disk, then add the rows above and
+    # below it by shifting the row dilations up and down the image.
+    dilated_mask = row_max[half_widths[radius]].copy()
+    for shift in range(1, (radius + 1)):
+        shifted = row_max[half_widths[radius + shift]]
+        numpy.maximum(dilated_mask[shift:], shifted[:-shift],
+                      out=dilated_mask[shift:])
+        shifted = row_max[half_widths[radius - shift]]
+        numpy.maximum(dilated_mask[:-shift], shifted[shift:],
+                      out=dilated_mask[:-shift])
+
+    return dilated_mask
+
+
+@profile_lib.instrument
+def mask_loc_bkgd(object_mask, radius=5, slices=None, out=None,
+                  method='dilation'):
     """
     To create a mask of the local background (the area around) the masked
     objects. The size of the local background is changed with radius.
@@ -124,47 +590,330 @@ def mask_loc_bkgd(object_mask, radius=5):
     radius = int for pixel radius to create loc_bkgd_mask
     The default value is 5 pixels.
 
+    slices = optional list from object_slices(object_mask), to reuse an
+    object index that was already built for this mask
+
+    out = optional integer array to write the result into, e.g. to reuse
+    one array for many fields
+
+    method = str of how to make the local background, one of
+    LOC_BKGD_METHODS:
+        'dilation' = dilate the mask by a disk of radius. Where the
+        backgrounds of objects meet, the pixel goes to the higher mask.
+        'edt' = take the pixels within radius of an object from a Euclidean
+        distance transform. Each pixel goes to the nearest object, and the
+        time taken does not grow with radius.
+    Both give the same pixels, only which object a pixel goes to can
+    differ. The default value is 'dilation'.
+
     Returns
     -------
-    loc_bkgd_mask = NumPy array where 1 = object, 0 = background
+    loc_bkgd_mask = NumPy array where int = local background of objects,
+    0 = background, of the smallest type that holds every mask (see
+    label_dtype)
     """
 
-    # Find size of mask.
-    matrix_size = numpy.shape(object_mask)
+    if slices is None:
+        slices = object_slices(object_mask)
 
     # Make dummy matrix for local background mask.
-    loc_bkgd_mask = numpy.zeros(matrix_size)
+    loc_bkgd_mask = _label_out(out, numpy.shape(object_mask), len(slices))
+
+    # Only the box around all objects, padded by radius, can be background.
+    box = _union_slice(slices)
+    if box is None:
+        return loc_bkgd_mask
+    box = _pad_slice(box, radius, numpy.shape(object_mask))
+    loc_bkgd_mask[box] = _local_bkgd(object_mask[box], radius, method)
+
+    return loc_bkgd_mask
+
+
+# The ways of making the local background, see mask_loc_bkgd.
+LOC_BKGD_METHODS = ('dilation', 'edt')
 
-    # Count number of masks in object_mask matrix.
-    num_masks = int(numpy.amax(object_mask))
+
+def _check_loc_bkgd_method(method):
+    """
+    To raise a ValueError if method is not one of LOC_BKGD_METHODS.
+    """
+
+    if method not in LOC_BKGD_METHODS:
+        raise ValueError(f"method must be one of {LOC_BKGD_METHODS}, "
+                         f"not {method!r}.")
+
+
+def _local_bkgd(object_mask, radius, method='dilation'):
+    """
+    To make the local background (donut) mask of every object in a mask.
+    Every object within radius of a pixel of object_mask must be inside
+    object_mask for the donut to be complete at that pixel. See
+    mask_loc_bkgd for the methods.
+    """
+
+    _check_loc_bkgd_method(method)
+    if method == 'edt':
+        (sq_distance, owner) = _nearest_object(object_mask)
+        return numpy.where(sq_distance <= radius ** 2, owner, 0)
 
     # Dilate masks in object mask. Keep mask indexing from object mask.
-    struct = disk(radius)  # Make disk of given radius in pixels.
-    dilated_mask = dilation(object_mask, selem=struct)
-
-    # For each mask in object mask, create a mask of the local background.
-    for mask in range(1, (num_masks + 1)):
-        # Find index/position of masked pixels in exp_mask.
-        mask_index = numpy.where(dilated_mask == mask)
-        mask_xy = list(zip(mask_index[0], mask_index[1]))
-        # Makes a list of tuples with each tuple being an xy position.
-
-        for xy in mask_xy:
-            # If object mask is true, make loc_bkgd_mask = 0.
-            # This carves out object from dilated mask, making a donut mask.
-            if object_mask[xy[0], xy[1]] >= 1:
-                loc_bkgd_mask[xy[0], xy[1]] = 0
-
-            # If object mask is false, make loc_bkgd_mask = dilated_mask.
-            # This retains the indexing in the original object mask.
-            # This also works if dilated_mask = 0 (for the rest of the img).
-            if object_mask[xy[0], xy[1]] == 0:
-                loc_bkgd_mask[xy[0], xy[1]] = dilated_mask[xy[0], xy[1]]
+    dilated_mask = _disk_dilation(object_mask, radius)
+
+    # Carve objects out of the dilated mask in one step, making a donut mask.
+    # Where object mask is false, loc_bkgd_mask = dilated_mask, which retains
+    # the indexing in the original object mask (and is 0 for the rest of the
+    # image). Where object mask is true, loc_bkgd_mask = 0.
+    loc_bkgd_mask = numpy.where(object_mask == 0, dilated_mask, 0)
 
     return loc_bkgd_mask
 
 
-def find_object(img, exp_mask, loc_bkgd_mask):
+def _nearest_object(object_mask):
+    """
+    To find the nearest object pixel to every background pixel, with one
+    Euclidean distance transform. Its feature transform gives the position
+    of the nearest object pixel, so the time taken does not depend on how
+    far away objects are.
+
+    Parameters
+    ----------
+    object_mask = NumPy array where int = object, 0 = background
+
+    Returns
+    -------
+    sq_distance = NumPy array of int of the squared distance in pixels to
+    the nearest object pixel, e.g. within radius if <= radius ** 2 (0 if
+    there are no objects)
+
+    owner = NumPy array of the mask of the nearest object pixel, 0 for
+    pixels of objects and for every pixel if there are no objects
+    """
+
+    background = object_mask == 0
+    if numpy.all(background):
+        return (numpy.zeros(numpy.shape(object_mask), dtype=numpy.int64),
+                numpy.zeros_like(object_mask))
+
+    indices = distance_transform_edt(background, return_distances=False,
+                                     return_indices=True)
+    owner = numpy.where(background, object_mask[tuple(indices)], 0)
+
+    # Squared distances from the positions of the nearest object pixels, so
+    # they are exact integers.
+    sq_distance = numpy.zeros(numpy.shape(object_mask), dtype=numpy.int64)
+    for (axis, nearest) in enumerate(indices):
+        position = numpy.arange(object_mask.shape[axis]).reshape(
+            [-1 if other == axis else 1 for other in range(object_mask.ndim)])
+        sq_distance += (nearest - position) ** 2
+
+    return sq_distance, owner
+
+
+def _local_bkgd_sweep(object_mask, radii, method='dilation'):
+    """
+    To make the local background mask of every object for several radii,
+    from one growing dilation (see _disk_dilation_sweep) or one distance
+    transform (see _nearest_object).
+
+    Yields
+    ------
+    (radius, loc_bkgd_mask) for each radius from the smallest up
+    """
+
+    _check_loc_bkgd_method(method)
+    radii = sorted(set(radii))
+
+    if method == 'edt':
+        (sq_distance, owner) = _nearest_object(object_mask)
+        for radius in radii:
+            yield radius, numpy.where(sq_distance <= radius ** 2, owner, 0)
+        return
+
+    background = object_mask == 0
+    for (radius, dilated_mask) in _disk_dilation_sweep(object_mask, radii):
+        yield radius, numpy.where(background, dilated_mask, 0)
+
+
+def _max_shifted(out, src, shift):
+    """
+    To take the maximum of out and src moved down by shift rows (up if shift
+    is negative), in place in out.
+    """
+
+    if shift > 0:
+        numpy.maximum(out[shift:], src[:-shift], out=out[shift:])
+    elif shift < 0:
+        numpy.maximum(out[:shift], src[-shift:], out=out[:shift])
+    else:
+        numpy.maximum(out, src, out=out)
+
+
+def _disk_dilation_sweep(object_mask, radii):
+    """
+    To dilate a mask by disks of several radii, growing one dilation from the
+    smallest radius to the largest. Each result is the same as
+    _disk_dilation(object_mask, radius).
+
+    A disk holds every smaller disk, so the dilation by the next radius is
+    the dilation by the last one plus only the disk rows that got wider. The
+    1D row dilations of each half width are made once and shared by all
+    radii.
+
+    Parameters
+    ----------
+    object_mask = NumPy array where int = object, 0 = background
+
+    radii = list of int for pixel radius of each disk
+
+    Yields
+    ------
+    (radius, dilated_mask) for each radius from the smallest up, where
+    dilated_mask is changed in place for the next radius, so it must be
+    used (or copied) before the next one is asked for
+    """
+
+    row_max = {0: object_mask}
+    dilated_mask = numpy.array(object_mask, copy=True)
+
+    # Half width already added for each row of the disk, by row offset.
+    done = {0: 0}
+    for radius in sorted(set(radii)):
+        half_widths = numpy.count_nonzero(_disk(radius), axis=1) // 2
+        for shift in range(-radius, (radius + 1)):
+            width = half_widths[radius + shift]
+            if width <= done.get(shift, -1):
+                continue
+            if width not in row_max:
+                row_max[width] = maximum_filter1d(
+                    object_mask, size=(2 * width + 1), axis=1)
+            _max_shifted(dilated_mask, row_max[width], shift)
+            done[shift] = width
+
+        yield radius, dilated_mask
+
+
+@profile_lib.instrument
+def mask_loc_bkgd_sweep(object_mask, radii=(3, 5, 8, 12), slices=None,
+                        method='dilation'):
+    """
+    To create the local background masks of several radii at once, e.g. to
+    choose a radius. Gives the same masks as mask_loc_bkgd for each radius,
+    from one growing dilation (see _disk_dilation_sweep) or one distance
+    transform.
+
+    Parameters
+    ----------
+    object_mask = NumPy array where int = object, 0 = background
+
+    radii = list of int for pixel radius of each loc_bkgd_mask
+    The default value is (3, 5, 8, 12) pixels.
+
+    slices = optional list from object_slices(object_mask), to reuse an
+    object index that was already built for this mask
+
+    method = str of how to make the local background, 'dilation' or 'edt'
+    (see mask_loc_bkgd). The default value is 'dilation'.
+
+    Returns
+    -------
+    loc_bkgd_masks = dict of radius to loc_bkgd_mask, as from mask_loc_bkgd
+    """
+
+    if slices is None:
+        slices = object_slices(object_mask)
+    radii = sorted(set(radii))
+
+    loc_bkgd_masks = {radius: _label_out(None, numpy.shape(object_mask),
+                                         len(slices))
+                      for radius in radii}
+
+    # Only the box around all objects, padded by the largest radius, can be
+    # background.
+    box = _union_slice(slices)
+    if box is None:
+        return loc_bkgd_masks
+    box = _pad_slice(box, max(radii, default=0), numpy.shape(object_mask))
+    for (radius, loc_bkgd_mask) in _local_bkgd_sweep(object_mask[box], radii,
+                                                     method):
+        loc_bkgd_masks[radius][box] = loc_bkgd_mask
+
+    return loc_bkgd_masks
+
+
+def _label_stats(img, label_mask, num_labels):
+    """
+    To find the pixel count, mean, variance and median of an image under each
+    mask in a label mask, using a single sort of the masked pixels.
+
+    Pixels are sorted by mask and then by value, so each mask's pixels form
+    one sorted run. Counts and sums come from bincount, and medians are read
+    from the middle of each run.
+
+    Parameters
+    ----------
+    img = NumPy array of a one-channel image
+
+    label_mask = NumPy array where int = object, 0 = background
+
+    num_labels = int of the highest mask to report
+
+    Returns
+    -------
+    stats = dict of NumPy arrays 'count', 'mean', 'var' and 'median', each of
+    length num_labels + 1 and indexed by mask (index 0 is unused)
+    Variance uses ddof = 1. Masks without pixels give NaN.
+    """
+
+    # Pull out the pixels that are under a mask.
+    labels = numpy.ravel(label_mask)
+    in_mask = labels > 0
+    stats = stats_lib.grouped_stats(labels[in_mask],
+                                    numpy.ravel(img)[in_mask], num_labels)
+
+    return stats
+
+
+def _significant_objects(exp_stats, bkgd_stats):
+    """
+    To test which expected objects are brighter than their local background
+    from the statistics of both, and list their medians.
+
+    Parameters
+    ----------
+    exp_stats = dict of statistics of the expected objects from _label_stats
+
+    bkgd_stats = dict of statistics of the local background from _label_stats
+
+    Returns
+    -------
+    significant = NumPy array of bool for each mask (index 0 is unused)
+
+    medians = list of tuples (mask, object_median, bkgd_median) for each
+    significant mask
+    """
+
+    # See if exp_vals is significantly higher than bkgd_vals by one-tailed
+    # two-sample t-test, for all masks at once.
+    (t, p) = stats_lib.pooled_t_test(
+        exp_stats['mean'], exp_stats['var'], exp_stats['count'],
+        bkgd_stats['mean'], bkgd_stats['var'], bkgd_stats['count'],
+        alternative='greater')
+
+    # Index 0 is the background, which is never kept.
+    significant = p < 0.05
+    significant[0] = False
+
+    # Save median values of the object and of the local background.
+    masks = numpy.flatnonzero(significant)
+    medians = list(zip(masks.tolist(),
+                       exp_stats['median'][masks].tolist(),
+                       bkgd_stats['median'][masks].tolist()))
+
+    return significant, medians
+
+
+@profile_lib.instrument
+def find_object(img, exp_mask, loc_bkgd_mask, slices=None, out=None):
     """
     To find objects in an image by comparing the local background mask,
     and the expected mask.
@@ -185,69 +934,207 @@ def find_object(img, exp_mask, loc_bkgd_mask):
     loc_bkgd_mask = NumPy array where int = local background of expected
     objects, 0 = background
 
+    slices = optional list from object_slices(exp_mask), to reuse an object
+    index that was already built for this mask
+
+    out = optional integer array to write res_mask into, e.g. to reuse one
+    array for many fields
+
     Returns
     -------
-    res_mask = NumPy array where int = resulting objects, 0 = background
-
-    object_median = int of the median value found in img under res_mask
+    res_mask = NumPy array where int = resulting objects, 0 = background,
+    of the smallest type that holds every mask (see label_dtype)
 
-    bkgd_median = int of the median value found in img under local_bkgd_mask
+    medians = list of tuples (mask, object_median, bkgd_median) for each
+    object in res_mask, where object_median is the median value found in img
+    under res_mask and bkgd_median is the median value found in img under
+    loc_bkgd_mask
     """
 
-    # Find size of image.
-    matrix_size = numpy.shape(img)
+    if slices is None:
+        slices = object_slices(exp_mask)
 
     # Make dummy matrix for resulting mask.
-    res_mask = numpy.zeros(matrix_size)
+    res_mask = _label_out(out, numpy.shape(img), len(slices))
 
-    # Make dummy list for median values.
-    medians = list()
+    # Only look inside the box around all expected objects and their local
+    # background.
+    box = _union_slice(list(slices) + object_slices(loc_bkgd_mask))
+    if box is None:
+        return res_mask, list()
+    img = img[box]
+    exp_mask = exp_mask[box]
+    loc_bkgd_mask = loc_bkgd_mask[box]
 
     # Count number of masks in expected mask.
-    num_exp_masks = int(numpy.amax(exp_mask))
+    num_exp_masks = len(slices)
+
+    # Collect count, mean, variance and median of img for every mask in one
+    # pass over the expected mask and one pass over the local background.
+    exp_stats = _label_stats(img, exp_mask, num_exp_masks)
+    bkgd_stats = _label_stats(img, loc_bkgd_mask, num_exp_masks)
 
-    for mask in range(1, (num_exp_masks + 1)):
-        # Make dummy list for intensity values in image.
-        exp_vals = list()
+    # Test every mask against its local background at once.
+    (significant, medians) = _significant_objects(exp_stats, bkgd_stats)
 
-        # Find index/position of masked pixels in exp_mask.
-        exp_index = numpy.where(exp_mask == mask)
-        exp_xy = list(zip(exp_index[0], exp_index[1]))
-        # Makes a list of tuples with each tuple being an xy position.
+    # If it is significant, make res_mask = exp_mask for that mask.
+    exp_labels = _as_labels(exp_mask)
+    res_mask[box] = numpy.where(significant[exp_labels], exp_labels, 0)
 
-        # For each xy position in exp_mask pull the pixel value from img.
-        for exy in exp_xy:
-            exp_vals.append(int(img[exy[0], exy[1]]))
+    return res_mask, medians
 
-        # Make dummy list for intensity values in image.
-        bkgd_vals = list()
 
-        # Find index/position of masked pixels in loc_bkgd_mask.
-        bkgd_index = numpy.where(loc_bkgd_mask == mask)
-        bkgd_xy = list(zip(bkgd_index[0], bkgd_index[1]))
-        # Makes a list of tuples with each tuple being an xy position.
+@profile_lib.instrument
+def find_object_sweep(img, exp_mask, radii=(3, 5, 8, 12), slices=None,
+                      method='dilation'):
+    """
+    To find objects in an image as find_object does, for local backgrounds
+    of several radii at once, e.g. to choose a radius. The statistics of the
+    expected objects are found once, and the local background of each
+    radius comes from one growing dilation (see _disk_dilation_sweep) or
+    one distance transform, so this is much faster than find_object and
+    mask_loc_bkgd for each radius.
 
-        # For each xy position in loc_bkdg_mask pull the pixel value from img.
-        for bxy in bkgd_xy:
-            bkgd_vals.append(int(img[bxy[0], bxy[1]]))
+    Parameters
+    ----------
+    img = NumPy array of a one-channel image
 
-        # See if exp_vals is significantly higher than bkgd_vals by one-tailed
-        # two-sample t-test.
-        (t, p) = ttest_ind(a=exp_vals, b=bkgd_vals, equal_var=True)
+    exp_mask = NumPy array where int = expected objects, 0 = background
 
-        # If it is significant...
-        if p < 0.05:
-            # Make res_mask = exp_mask for that mask.
-            for xy in exp_xy:
-                res_mask[xy[0], xy[1]] = int(exp_mask[xy[0], xy[1]])
+    radii = list of int for pixel radius of each local background
+    The default value is (3, 5, 8, 12) pixels.
 
-            # Save median values of the object and of the local background.
-            medians.append((mask, median(exp_vals), median(bkgd_vals)))
+    slices = optional list from object_slices(exp_mask), to reuse an object
+    index that was already built for this mask
 
-    return res_mask, medians
+    method = str of how to make the local background, 'dilation' or 'edt'
+    (see mask_loc_bkgd). The default value is 'dilation'.
 
+    Returns
+    -------
+    exp_stats = dict of statistics of the expected objects from _label_stats
+
+    sweep = dict of radius to a dict of:
+        'bkgd_stats' = statistics of the local background from _label_stats
+        'significant' = NumPy array of bool for each mask (index 0 is
+        unused), True if the mask is kept in res_mask of find_object
+        'medians' = list of tuples (mask, object_median, bkgd_median) as
+        from find_object
+    """
+
+    if slices is None:
+        slices = object_slices(exp_mask)
+    radii = sorted(set(radii))
 
-def find_overlap(ch1_mask, ch2_mask, overlap_threshold=0.9):
+    # Count number of masks in expected mask.
+    num_exp_masks = len(slices)
+
+    # Only look inside the box around all expected objects, padded by the
+    # largest radius.
+    box = _union_slice(slices)
+    if box is None:
+        no_pixels = numpy.zeros(0, dtype=numpy.intp)
+        exp_stats = stats_lib.grouped_stats(no_pixels, no_pixels, 0)
+        sweep = {radius: {'bkgd_stats': exp_stats,
+                          'significant': numpy.zeros(1, dtype=bool),
+                          'medians': list()}
+                 for radius in radii}
+        return exp_stats, sweep
+    box = _pad_slice(box, max(radii, default=0), numpy.shape(exp_mask))
+    img = img[box]
+    exp_mask = exp_mask[box]
+
+    exp_stats = _label_stats(img, exp_mask, num_exp_masks)
+
+    sweep = dict()
+    for (radius, loc_bkgd_mask) in _local_bkgd_sweep(exp_mask, radii,
+                                                     method):
+        bkgd_stats = _label_stats(img, loc_bkgd_mask, num_exp_masks)
+        (significant, medians) = _significant_objects(exp_stats, bkgd_stats)
+        sweep[radius] = {
+            'bkgd_stats': bkgd_stats,
+            'significant': significant,
+            'medians': medians
+        }
+
+    return exp_stats, sweep
+
+
+def overlap_table(ch1_mask, ch2_mask):
+    """
+    To count the pixels shared by each pair of objects in two channels, in
+    a single pass over the two masks.
+
+    Parameters
+    ----------
+    ch1_mask = NumPy array where int = object in channel 1
+
+    ch2_mask = NumPy array where int = object in channel 2
+
+    Returns
+    -------
+    table = NumPy array with one row (ch1 mask, ch2 mask, pixel count) for
+    each pair of masks that share at least one pixel, sorted by ch1 mask and
+    then by ch2 mask
+
+    ch1_area = NumPy array of the pixel area of each mask in channel 1,
+    indexed by mask (index 0 is unused)
+    """
+
+    # Only pixels inside a channel 1 mask can overlap.
+    ch1 = numpy.ravel(ch1_mask).astype(numpy.int64)
+    in_mask = ch1 > 0
+    ch1 = ch1[in_mask]
+    ch2 = numpy.ravel(ch2_mask)[in_mask].astype(numpy.int64)
+    ch1_num_masks = int(ch1.max()) if len(ch1) > 0 else 0
+    ch2_num_masks = int(ch2.max()) if len(ch2) > 0 else 0
+
+    # Give each pair of masks one number, and count pixels for each pair.
+    # Use bincount when the table of all pairs is small, or unique if not.
+    pair = ch1 * (ch2_num_masks + 1) + ch2
+    num_pairs = (ch1_num_masks + 1) * (ch2_num_masks + 1)
+    if num_pairs <= max(len(pair), 1024):
+        counts = numpy.bincount(pair, minlength=num_pairs)
+        pair = numpy.flatnonzero(counts)
+        counts = counts[pair]
+    else:
+        (pair, counts) = numpy.unique(pair, return_counts=True)
+
+    (pair_ch1, pair_ch2) = numpy.divmod(pair, (ch2_num_masks + 1))
+
+    # Pairs with ch2 mask 0 are the part of a ch1 mask outside channel 2.
+    ch1_area = numpy.bincount(pair_ch1, weights=counts,
+                              minlength=(ch1_num_masks + 1)).astype(numpy.int64)
+    shared = pair_ch2 > 0
+    table = numpy.column_stack((pair_ch1[shared], pair_ch2[shared],
+                                counts[shared]))
+
+    return table, ch1_area
+
+
+def _overlap_keep(table, ch1_area, overlap_threshold):
+    """
+    To find which masks in channel 1 overlap channel 2 by at least
+    overlap_threshold of their area, from the tables of overlap_table.
+    Returns a NumPy array of bool for each mask (index 0 is unused).
+    """
+
+    # Find percent of area overlap of each mask in channel 1 with any mask
+    # in channel 2.
+    overlap_area = numpy.bincount(table[:, 0], weights=table[:, 2],
+                                  minlength=len(ch1_area))
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        overlap_percent = overlap_area / ch1_area
+
+    keep = overlap_percent >= overlap_threshold
+    keep[0] = False
+
+    return keep
+
+
+@profile_lib.instrument
+def find_overlap(ch1_mask, ch2_mask, overlap_threshold=0.9, slices=None,
+                 return_table=False, out=None):
     """
     To find objects that occur in two channels and exceed a given percent area
     overlap.
@@ -264,83 +1151,488 @@ def find_overlap(ch1_mask, ch2_mask, overlap_threshold=0.9):
     and ch2_mask by pixel area, 1 = 100% overlap
     Default overlap is 0.9 or 90%.
 
+    slices = optional list from object_slices(ch1_mask), to reuse an object
+    index that was already built for this mask
+
+    return_table = bool, if True also return the overlap table from
+    overlap_table(ch1_mask, ch2_mask) for colocalization reporting
+    The default value is False.
+
+    out = optional integer array to write overlap_mask into, e.g. to reuse
+    one array for many fields
+
+    Returns
+    -------
+    overlap_mask = NumPy array where int = object in both channels,
+    0 = background, of the smallest type that holds every mask (see
+    label_dtype)
+
+    table = NumPy array with one row (ch1 mask, ch2 mask, pixel count) for
+    each pair of overlapping masks, only if return_table is True
+    """
+
+    if slices is None:
+        slices = object_slices(ch1_mask)
+
+    # Make a dummy overlap mask.
+    overlap_mask = _label_out(out, numpy.shape(ch1_mask), len(slices))
+
+    # Only look inside the box around all masks in channel 1.
+    box = _union_slice(slices)
+    if box is None:
+        table = numpy.zeros((0, 3), dtype=numpy.int64)
+        return (overlap_mask, table) if return_table else overlap_mask
+    ch1_crop = ch1_mask[box]
+    ch2_crop = ch2_mask[box]
+
+    # Count pixels shared by each pair of masks in one pass.
+    (table, ch1_area) = overlap_table(ch1_crop, ch2_crop)
+
+    # If percent overlap is at least the threshold, keep the mask where
+    # ch2_mask is true. This retains the indexing in the original object mask.
+    keep = _overlap_keep(table, ch1_area, overlap_threshold)
+    ch1_labels = _as_labels(ch1_crop)
+    overlap_mask[box] = numpy.where(keep[ch1_labels] & (ch2_crop > 0),
+                                    ch1_labels, 0)
+
+    if return_table:
+        return overlap_mask, table
+
+    return overlap_mask
+
+
+def iter_tiles(matrix_size, tile_size=1024, halo=0):
+    """
+    To split an image into square tiles, each with a border (halo) of the
+    pixels around it, so large images can be worked on one tile at a time.
+
+    Parameters
+    ----------
+    matrix_size = tuple of (rows, columns) of the image
+
+    tile_size = int for the side length of each tile in pixels
+    The default value is 1024 pixels.
+
+    halo = int for the width of the border around each tile in pixels,
+    clipped to the edges of the image. The default value is 0.
+
+    Returns
+    -------
+    Generator of tuples (tile, padded, inner), where tile is the tuple of
+    slices of the tile in the image, padded is the tile with its halo in the
+    image, and inner is the tile inside the padded tile.
+    """
+
+    for row in range(0, matrix_size[0], tile_size):
+        for col in range(0, matrix_size[1], tile_size):
+            tile = (slice(row, min(row + tile_size, matrix_size[0])),
+                    slice(col, min(col + tile_size, matrix_size[1])))
+            padded = _pad_slice(tile, halo, matrix_size)
+            inner = tuple(slice(side.start - pad.start, side.stop - pad.start)
+                          for (side, pad) in zip(tile, padded))
+            yield tile, padded, inner
+
+
+def mask_loc_bkgd_tiled(object_mask, radius=5, tile_size=1024, out=None,
+                        method='dilation'):
+    """
+    To create the same local background mask as mask_loc_bkgd, one tile at a
+    time, so only one tile (and its halo of radius pixels) is worked on at
+    once.
+
+    Parameters
+    ----------
+    object_mask = NumPy array (or memory map) where int = object,
+    0 = background
+
+    radius = int for pixel radius to create loc_bkgd_mask
+    The default value is 5 pixels.
+
+    tile_size = int for the side length of each tile in pixels
+    The default value is 1024 pixels.
+
+    out = optional integer array (e.g. a memory map) to write the result
+    into. If not given, one is made as in mask_loc_bkgd.
+
+    method = str of how to make the local background, 'dilation' or 'edt'
+    (see mask_loc_bkgd). The default value is 'dilation'.
+
     Returns
     -------
-    overlap_mask = NumPy array where 1 = object in both channels,
+    loc_bkgd_mask = NumPy array where int = local background of objects,
     0 = background
     """
 
-    # Count number of masks in channel 1.
-    ch1_num_masks = int(numpy.amax(ch1_mask))
+    # Find the highest mask to choose the type of the result.
+    max_label = 0
+    for (tile, padded, inner) in iter_tiles(numpy.shape(object_mask),
+                                            tile_size):
+        max_label = max(max_label, int(numpy.amax(object_mask[tile])))
+    out = _label_out(out, numpy.shape(object_mask), max_label)
+
+    # The halo holds every object that can reach into the tile.
+    for (tile, padded, inner) in iter_tiles(numpy.shape(object_mask),
+                                            tile_size, radius):
+        object_tile = numpy.asarray(object_mask[padded])
+        out[tile] = _local_bkgd(object_tile, radius, method)[inner]
+
+    return out
+
+
+@profile_lib.instrument
+def find_object_tiled(img, exp_mask, radius=5, tile_size=1024, out=None,
+                      method='dilation'):
+    """
+    To find objects in an image as find_object does, making the local
+    background of radius pixels on the way, one tile at a time. Objects
+    that cross tile edges are handled by adding up their pixels from every
+    tile before testing them.
+
+    Memory use depends on the tile size and the number of pixels in objects
+    and their local background, not on the size of the whole image, so img
+    and exp_mask can be memory maps of very large images.
+
+    Parameters
+    ----------
+    img = NumPy array (or memory map) of a one-channel image
+
+    exp_mask = NumPy array (or memory map) where int = expected objects,
+    0 = background
+
+    radius = int for pixel radius of the local background
+    The default value is 5 pixels.
+
+    tile_size = int for the side length of each tile in pixels
+    The default value is 1024 pixels.
+
+    out = optional integer array (e.g. a memory map) to write res_mask
+    into. If not given, one is made as in find_object.
 
-    # Turn ch2_mask into a simple logical mask for channel 2.
-    ch2_log = numpy.where(ch2_mask > 0, True, False)
+    method = str of how to make the local background, 'dilation' or 'edt'
+    (see mask_loc_bkgd). The default value is 'dilation'.
+
+    Returns
+    -------
+    res_mask = NumPy array where int = resulting objects, 0 = background
+
+    medians = list of tuples (mask, object_median, bkgd_median) as for
+    find_object
+    """
+
+    matrix_size = numpy.shape(exp_mask)
+
+    # Gather the masked pixels of every tile. Each pixel is in exactly one
+    # tile, and the halo makes the local background exact inside the tile.
+    exp_parts = list()
+    bkgd_parts = list()
+    for (tile, padded, inner) in iter_tiles(matrix_size, tile_size, radius):
+        img_tile = numpy.asarray(img[tile])
+        exp_tile = numpy.asarray(exp_mask[padded])
+        bkgd_tile = _local_bkgd(exp_tile, radius, method)[inner]
+        exp_tile = exp_tile[inner]
+        for (parts, labels) in [(exp_parts, exp_tile),
+                                (bkgd_parts, bkgd_tile)]:
+            in_mask = labels > 0
+            parts.append((labels[in_mask], img_tile[in_mask]))
+
+    # Collect statistics of every mask from all tiles.
+    stats = list()
+    for parts in [exp_parts, bkgd_parts]:
+        labels = numpy.concatenate([part[0] for part in parts])
+        values = numpy.concatenate([part[1] for part in parts])
+        stats.append((labels, values))
+    num_exp_masks = int(stats[0][0].max()) if len(stats[0][0]) > 0 else 0
+    exp_stats = stats_lib.grouped_stats(*stats[0], num_exp_masks)
+    bkgd_stats = stats_lib.grouped_stats(*stats[1], num_exp_masks)
+    del stats, exp_parts, bkgd_parts
+
+    # Test every mask against its local background at once.
+    (significant, medians) = _significant_objects(exp_stats, bkgd_stats)
+
+    # If it is significant, make res_mask = exp_mask for that mask.
+    out = _label_out(out, matrix_size, num_exp_masks)
+    for (tile, padded, inner) in iter_tiles(matrix_size, tile_size):
+        exp_labels = _as_labels(exp_mask[tile])
+        out[tile] = numpy.where(significant[exp_labels], exp_labels, 0)
+
+    return out, medians
+
+
+@profile_lib.instrument
+def find_overlap_tiled(ch1_mask, ch2_mask, overlap_threshold=0.9,
+                       tile_size=1024, out=None, return_table=False):
+    """
+    To find objects that occur in two channels as find_overlap does, one
+    tile at a time. The overlap tables of all tiles are added up before the
+    threshold is applied, so objects that cross tile edges are handled.
+
+    Parameters
+    ----------
+    ch1_mask = NumPy array (or memory map) where int = object in channel 1
+
+    ch2_mask = NumPy array (or memory map) where int = object in channel 2
+
+    overlap_threshold = float for desired amount of overlap between ch1_mask
+    and ch2_mask by pixel area, 1 = 100% overlap
+    Default overlap is 0.9 or 90%.
+
+    tile_size = int for the side length of each tile in pixels
+    The default value is 1024 pixels.
+
+    out = optional integer array (e.g. a memory map) to write overlap_mask
+    into. If not given, one is made as in find_overlap.
+
+    return_table = bool, if True also return the overlap table
+    The default value is False.
+
+    Returns
+    -------
+    overlap_mask = NumPy array where int = object in both channels,
+    0 = background
+
+    table = NumPy array as from overlap_table, only if return_table is True
+    """
 
-    # Get matrix size of channel 1 mask.
     matrix_size = numpy.shape(ch1_mask)
 
-    # Make a dummy overlap mask.
-    overlap_mask = numpy.zeros(matrix_size)
-
-    # For each mask in channel 1, see if a mask in channel 2 exists.
-    for mask in range(1, (ch1_num_masks + 1)):
-        # Find index/position of masked pixels in channel 1.
-        mask1_index = numpy.where(ch1_mask == mask)
-        mask1_xy = list(zip(mask1_index[0], mask1_index[1]))
-        # Makes a list of tuples with each tuple being an xy position.
-
-        # For each xy position in ch1_mask, see if ch2_mask is true.
-        for xy in mask1_xy:
-            # If ch2_mask is false, make overlap_mask = 0.
-            if ch2_log[xy[0], xy[1]] == False:
-                overlap_mask[xy[0], xy[1]] = 0
-
-            # If ch2_mask is true, make overlap_mask = int.
-            # This retains the indexing in the original object mask.
-            # This also works if ch1_mask = 0 (for the rest of the img).
-            if ch2_log[xy[0], xy[1]] == True:
-                overlap_mask[xy[0], xy[1]] = ch1_mask[xy[0], xy[1]]
-
-        # Find area of mask in channel 1.
-        mask1_area = len(mask1_xy)
-
-        # Find area of overlap mask.
-        overlap_index = numpy.where(overlap_mask == mask)
-        overlap_xy = list(zip(overlap_index[0], overlap_index[1]))
-        # Makes a list of tuples with each tuple being an xy position.
-        overlap_mask_area = len(overlap_xy)
-
-        # Find percent of area overlap.
-        overlap_percent = overlap_mask_area / mask1_area
-
-        # If percent overlap is less than threshold, remove the mask.
-        if overlap_percent < overlap_threshold:
-            for xy in overlap_xy:
-                overlap_mask[xy[0], xy[1]] = 0
+    # Count shared pixels tile by tile.
+    tables = list()
+    areas = list()
+    for (tile, padded, inner) in iter_tiles(matrix_size, tile_size):
+        (table, ch1_area) = overlap_table(numpy.asarray(ch1_mask[tile]),
+                                          numpy.asarray(ch2_mask[tile]))
+        tables.append(table)
+        areas.append(ch1_area)
+
+    # Add up areas, and shared pixels of pairs found in more than one tile.
+    ch1_area = numpy.zeros(max(len(area) for area in areas),
+                           dtype=numpy.int64)
+    for area in areas:
+        ch1_area[:len(area)] += area
+    table = numpy.concatenate(tables)
+    ch2_num_masks = int(table[:, 1].max()) if len(table) > 0 else 0
+    pair = table[:, 0] * (ch2_num_masks + 1) + table[:, 1]
+    (pair, index) = numpy.unique(pair, return_inverse=True)
+    counts = numpy.bincount(index, weights=table[:, 2],
+                            minlength=len(pair)).astype(numpy.int64)
+    (pair_ch1, pair_ch2) = numpy.divmod(pair, (ch2_num_masks + 1))
+    table = numpy.column_stack((pair_ch1, pair_ch2, counts))
+
+    keep = _overlap_keep(table, ch1_area, overlap_threshold)
+
+    out = _label_out(out, matrix_size, (len(ch1_area) - 1))
+    for (tile, padded, inner) in iter_tiles(matrix_size, tile_size):
+        ch1_labels = _as_labels(ch1_mask[tile])
+        ch2_tile = numpy.asarray(ch2_mask[tile])
+        out[tile] = numpy.where(keep[ch1_labels] & (ch2_tile > 0),
+                                ch1_labels, 0)
+
+    if return_table:
+        return out, table
+
+    return out
+
+
+def _assign_to_cells(object_mask, cell_mask):
+    """
+    To find the cell each object is in, as the cell mask that covers the
+    most pixels of the object, in one pass over the two masks.
 
-    return overlap_mask
+    Parameters
+    ----------
+    object_mask = NumPy array where int = object, 0 = background
 
+    cell_mask = NumPy array where int = cell, 0 = background
 
-def count_objects(object_mask, lower_size_limit, upper_size_limit):
+    Returns
+    -------
+    object_cell = NumPy array of the cell of each object, indexed by object
+    mask (index 0 is unused), where 0 = not in any cell
+    """
+
+    (table, object_area) = overlap_table(object_mask, cell_mask)
+    object_cell = numpy.zeros(len(object_area), dtype=numpy.int64)
+
+    # Sort pairs by object, then by shared pixels, so the last pair of each
+    # object is the cell that covers it most.
+    order = numpy.lexsort((table[:, 2], table[:, 0]))
+    table = table[order]
+    last = numpy.ones(len(table), dtype=bool)
+    last[:-1] = table[1:, 0] != table[:-1, 0]
+    object_cell[table[last, 0]] = table[last, 1]
+
+    return object_cell
+
+
+@profile_lib.instrument
+def count_objects(object_mask, lower_size_limit, upper_size_limit,
+                  cell_mask=None):
     """
     To count objects in an image given a lower and an upper size limit.
+
+    Several size windows can be counted at once by giving lists of limits,
+    and objects can be counted for each cell by giving a cell mask. The
+    areas of all objects are found in one pass with bincount, however many
+    windows or cells there are.
     
     Parameters
     ----------
-    object_mask = logical NumPy array where 1 = object, 0 = background
+    object_mask = NumPy array where int = object, 0 = background
+    A logical NumPy array (1 = object) is split into objects first.
     
-    lower_size_limit = integer for lower limit on pixel area in an object
+    lower_size_limit = integer (or list of integers) for lower limit on pixel
+    area in an object
     
-    upper_size_limit = integer for upper limit on pixel area in an object
+    upper_size_limit = integer (or list of integers) for upper limit on pixel
+    area in an object
+    Limits are inclusive, and the nth lower limit goes with the nth upper.
+
+    cell_mask = optional NumPy array where int = cell, 0 = background
+    Each object is counted in the cell that covers most of its pixels.
     
     Returns
     -------
     count = integer of number of objects of a given size
+
+    If lists of limits are given, count is a NumPy array with one count for
+    each window. If cell_mask is given, count is a NumPy array with one row
+    for each cell, indexed by cell mask (row 0 = objects not in any cell),
+    and one column for each window (or one count per cell for single
+    limits).
     """
-    
+
+    # Split a logical mask into separate objects.
+    if numpy.asarray(object_mask).dtype == bool:
+        object_mask = label(object_mask)[0]
+
+    # Find the pixel area of every object at once.
+    labels = numpy.ravel(object_mask).astype(numpy.intp)
+    areas = numpy.bincount(labels[labels > 0], minlength=1)
+
+    # See which objects are within each window of size limits.
+    lower = numpy.atleast_1d(lower_size_limit)
+    upper = numpy.atleast_1d(upper_size_limit)
+    in_window = ((areas[:, None] >= lower[None, :]) &
+                 (areas[:, None] <= upper[None, :]))
+    in_window[0] = False  # Index 0 is the background.
+
+    if cell_mask is None:
+        count = numpy.count_nonzero(in_window, axis=0)
+    else:
+        # Add up objects in each window for the cell they are in.
+        object_cell = _assign_to_cells(object_mask, cell_mask)
+        num_cells = int(numpy.amax(cell_mask))
+        count = numpy.zeros((num_cells + 1, in_window.shape[1]),
+                            dtype=numpy.int64)
+        numpy.add.at(count, object_cell[:len(in_window)],
+                     in_window.astype(numpy.int64))
+
+    # Give back the same shape of answer as the limits that were given.
+    if numpy.ndim(lower_size_limit) == 0 and numpy.ndim(upper_size_limit) == 0:
+        count = count[..., 0]
+        if cell_mask is None:
+            count = int(count)
+
     return count
 
 
+@profile_lib.instrument
+def find_enrichment(images, granule_mask, cell_mask, loc_bkgd_mask=None,
+                    radius=5):
+    """
+    To find how enriched each channel is in each granule, and in all the
+    granules of each cell, compared with the local background.
+
+    Every granule is put in the cell that covers most of it, in one pass
+    over the two masks. The enrichment is the median of a channel under the
+    granule divided by the median under its local background. For a cell,
+    the medians are of all pixels of its granules and of all pixels of their
+    local backgrounds. All granules and cells are done at once, with no
+    loops over them.
+
+    Parameters
+    ----------
+    images = dict of channel name (e.g. 'C2') to NumPy array of the image of
+    that channel
+
+    granule_mask = NumPy array where int = granule, 0 = background
+
+    cell_mask = NumPy array where int = cell, 0 = background
+
+    loc_bkgd_mask = optional NumPy array of the local background of each
+    granule from mask_loc_bkgd(granule_mask)
+
+    radius = int for pixel radius of the local background, if loc_bkgd_mask
+    is not given. The default value is 5 pixels.
+
+    Returns
+    -------
+    granule_table = dict of column name to NumPy array, with one row for
+    each granule: 'granule', 'cell' (0 = not in any cell), 'area', and for
+    each channel '<channel>_object_median', '<channel>_bkgd_median' and
+    '<channel>_enrichment'
+
+    cell_table = dict of column name to NumPy array, with one row for each
+    cell: 'cell', 'area', 'granule_count', and the same three columns for
+    each channel as granule_table (NaN for a cell without granules)
+    """
+
+    granule_mask = _as_labels(granule_mask)
+    cell_mask = _as_labels(cell_mask)
+    if loc_bkgd_mask is None:
+        loc_bkgd_mask = mask_loc_bkgd(granule_mask, radius=radius)
+    loc_bkgd_mask = _as_labels(loc_bkgd_mask)
+
+    num_granules = int(numpy.amax(granule_mask, initial=0))
+    num_cells = int(numpy.amax(cell_mask, initial=0))
+
+    # Find the cell of every granule, and label the pixels of each granule
+    # and of its background with the cell of the granule.
+    granule_cell = numpy.zeros((num_granules + 1), dtype=numpy.int64)
+    assigned = _assign_to_cells(granule_mask, cell_mask)
+    granule_cell[:len(assigned)] = assigned[:(num_granules + 1)]
+    cell_granules = granule_cell[granule_mask]
+    cell_bkgd = granule_cell[loc_bkgd_mask]
+
+    granule_area = numpy.bincount(numpy.ravel(granule_mask),
+                                  minlength=(num_granules + 1))
+    cell_area = numpy.bincount(numpy.ravel(cell_mask),
+                               minlength=(num_cells + 1))
+    granules = numpy.flatnonzero(granule_area)
+    granules = granules[granules > 0]
+    cells = numpy.flatnonzero(cell_area)
+    cells = cells[cells > 0]
+
+    granule_table = {
+        'granule': granules,
+        'cell': granule_cell[granules],
+        'area': granule_area[granules]
+    }
+    cell_table = {
+        'cell': cells,
+        'area': cell_area[cells],
+        'granule_count': numpy.bincount(
+            granule_cell[granules], minlength=(num_cells + 1))[cells]
+    }
+
+    for (channel, img) in images.items():
+        for (table, rows, object_mask, bkgd_mask, num_labels) in [
+                (granule_table, granules, granule_mask, loc_bkgd_mask,
+                 num_granules),
+                (cell_table, cells, cell_granules, cell_bkgd, num_cells)]:
+            object_median = _label_stats(img, object_mask,
+                                         num_labels)['median'][rows]
+            bkgd_median = _label_stats(img, bkgd_mask,
+                                       num_labels)['median'][rows]
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                enrichment = object_median / bkgd_median
+            table[f"{channel}_object_median"] = object_median
+            table[f"{channel}_bkgd_median"] = bkgd_median
+            table[f"{channel}_enrichment"] = enrichment
+
+    return granule_table, cell_table
+
+
 def main():
     #filename_img_C1_one = '/Users/Erin/PycharmProjects/SG_enrichment/demo/C1-onecell.tif'
     #filename_img_C2_one = '/Users/Erin/PycharmProjects/SG_enrichment/demo/C2-onecell.tif'
@@ -0,0 +1,363 @@
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+import sys
+from datetime import datetime
+import numpy
+import tifffile
+from skimage.morphology import disk
+import im_lib
+
+"""
+This script times the main im_lib functions on synthetic masks and images
+of different sizes, so changes in speed can be compared between versions.
+
+Import times of the main modules are measured too, against an import time
+budget (IMPORT_BUDGET_S).
+
+Run from the command line, e.g.:
+python im_lib_benchmark.py --sizes 512 2048 --labels 100 1000 -o bench.json
+python im_lib_benchmark.py --compare old.json new.json
+"""
+
+
+def make_disc_mask(shape=(120, 150), num_labels=25, radius=4, seed=0):
+    """
+    To make a labelled mask of discs at random positions.
+    Later labels are drawn over earlier ones, so some discs touch.
+
+    Parameters
+    ----------
+    shape = tuple of (rows, columns) of the mask
+
+    num_labels = int for number of discs
+
+    radius = int for pixel radius of each disc
+
+    seed = int for the random number generator
+
+    Returns
+    -------
+    mask = NumPy array where int = disc, 0 = background
+    """
+
+    rng = numpy.random.default_rng(seed)
+    mask = numpy.zeros(shape, dtype=numpy.int32)
+
+    # Offsets of the pixels of one disc.
+    (rows, cols) = numpy.nonzero(disk(radius))
+    rows = rows - radius
+    cols = cols - radius
+
+    for label in range(1, (num_labels + 1)):
+        row = rows + rng.integers(0, shape[0])
+        col = cols + rng.integers(0, shape[1])
+        inside = (row >= 0) & (row < shape[0]) & (col >= 0) & (col < shape[1])
+        mask[row[inside], col[inside]] = label
+
+    return mask
+
+
+def make_noisy_image(mask, seed=0):
+    """
+    To make a 16-bit image where masked objects are brighter on average than
+    the background.
+
+    Parameters
+    ----------
+    mask = NumPy array where int = object, 0 = background
+
+    seed = int for the random number generator
+
+    Returns
+    -------
+    img = NumPy array of the image (uint16)
+    """
+
+    rng = numpy.random.default_rng(seed)
+    img = rng.integers(100, 200, size=mask.shape)
+    img = img + (mask > 0) * rng.integers(0, 60, size=mask.shape)
+
+    return img.astype(numpy.uint16)
+
+
+def measure(function, *args, repeat=3, **kwargs):
+    """
+    To time a function and find its peak memory use.
+
+    Parameters
+    ----------
+    function = function to call with args and kwargs
+
+    repeat = int for number of timed calls; the fastest one is kept
+
+    Returns
+    -------
+    seconds = float of the fastest wall time of one call
+
+    peak_bytes = int of the peak memory allocated during one call
+    """
+
+    times = list()
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        times.append(time.perf_counter() - start)
+
+    # Measure memory in a separate call, so tracing does not slow the timing.
+    tracemalloc.start()
+    function(*args, **kwargs)
+    (current, peak_bytes) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(times), peak_bytes
+
+
+# Local background radii of a sweep, e.g. to choose a radius.
+SWEEP_RADII = (3, 5, 8, 12)
+
+
+def find_object_each_radius(img, mask, radii=SWEEP_RADII):
+    """
+    To run mask_loc_bkgd and find_object once for each radius, the way a
+    sweep was done before find_object_sweep, to time against it.
+    """
+
+    for radius in radii:
+        bkgd = im_lib.mask_loc_bkgd(mask, radius=radius)
+        im_lib.find_object(img, mask, bkgd)
+
+
+def run_benchmarks(sizes, labels, radii, bkgd_radius=5, repeat=3):
+    """
+    To time mask_loc_bkgd (by dilation and by distance transform),
+    find_object, find_overlap and read_image over every combination of
+    image size, label count and object radius. A
+    sweep of the local background radius (SWEEP_RADII) is timed both with
+    find_object_sweep and with find_object for each radius.
+
+    Parameters
+    ----------
+    sizes = list of int for the side length of the square images
+
+    labels = list of int for number of objects in each mask
+
+    radii = list of int for pixel radius of each object
+
+    bkgd_radius = int for pixel radius of the local background
+    The default value is 5 pixels.
+
+    repeat = int for number of timed calls of each function
+
+    Returns
+    -------
+    records = list of dicts, one for each function and combination, with
+    the time, pixels/s, labels/s and peak memory
+    """
+
+    records = list()
+
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            for num_labels in labels:
+                for radius in radii:
+                    shape = (size, size)
+                    mask = make_disc_mask(shape, num_labels, radius, seed=1)
+                    ch2_mask = make_disc_mask(shape, num_labels, radius + 2,
+                                              seed=2)
+                    img = make_noisy_image(mask, seed=3)
+                    bkgd = im_lib.mask_loc_bkgd(mask, radius=bkgd_radius)
+
+                    img_file = os.path.join(folder, f"img_{size}.tif")
+                    tifffile.imwrite(img_file, img)
+
+                    calls = {
+                        'read_image': (im_lib.read_image, (img_file,), {}),
+                        'mask_loc_bkgd': (im_lib.mask_loc_bkgd, (mask,),
+                                          {'radius': bkgd_radius}),
+                        'mask_loc_bkgd_edt': (im_lib.mask_loc_bkgd, (mask,),
+                                              {'radius': bkgd_radius,
+                                               'method': 'edt'}),
+                        'find_object': (im_lib.find_object,
+                                        (img, mask, bkgd), {}),
+                        'find_object_radii': (find_object_each_radius,
+                                              (img, mask), {}),
+                        'find_object_sweep': (im_lib.find_object_sweep,
+                                              (img, mask),
+                                              {'radii': SWEEP_RADII}),
+                        'find_overlap': (im_lib.find_overlap,
+                                         (mask, ch2_mask), {})
+                    }
+
+                    for (name, (function, args, kwargs)) in calls.items():
+                        (seconds, peak_bytes) = measure(
+                            function, *args, repeat=repeat, **kwargs)
+                        records.append({
+                            'function': name,
+                            'size': size,
+                            'num_labels': num_labels,
+                            'radius': radius,
+                            'seconds': seconds,
+                            'pixels_per_s': size * size / seconds,
+                            'labels_per_s': num_labels / seconds,
+                            'peak_bytes': peak_bytes
+                        })
+                        print(f"{name:>14} size={size:<5} "
+                              f"labels={num_labels:<5} radius={radius:<3} "
+                              f"{seconds * 1000:9.2f} ms "
+                              f"{peak_bytes / 1e6:9.1f} MB")
+
+    return records
+
+
+# Longest import time in seconds of the modules of the core analysis path.
+IMPORT_BUDGET_S = 0.5
+
+
+def measure_imports(modules=('FileFunctions', 'im_lib', 'batch_lib'),
+                    repeat=3):
+    """
+    To time importing each module in a new Python process, as a worker
+    process or a short script would. Times come from python -X importtime,
+    so the start up of Python itself is not included.
+
+    Parameters
+    ----------
+    modules = list of str of the module names to import
+
+    repeat = int for number of new processes for each module
+
+    Returns
+    -------
+    records = list of dicts, one for each module, with the fastest import
+    time in the same form as the records of run_benchmarks
+    """
+
+    records = list()
+    folder = os.path.dirname(os.path.abspath(__file__))
+
+    for module in modules:
+        times = list()
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                capture_output=True, text=True, check=True, cwd=folder).stderr
+            # The last line is the module itself, with the total time in us.
+            last = output.strip().splitlines()[-1]
+            times.append(int(last.split('|')[1]) / 1e6)
+        seconds = min(times)
+
+        records.append({
+            'function': f"import {module}",
+            'size': 0,
+            'num_labels': 0,
+            'radius': 0,
+            'seconds': seconds,
+            'pixels_per_s': None,
+            'labels_per_s': None,
+            'peak_bytes': 0
+        })
+        status = 'ok' if seconds <= IMPORT_BUDGET_S else 'OVER BUDGET'
+        print(f"{'import ' + module:>20} {seconds * 1000:9.2f} ms "
+              f"(budget {IMPORT_BUDGET_S * 1000:.0f} ms, {status})")
+
+    return records
+
+
+def _commit():
+    """
+    To find the git commit of this folder, or None outside of git.
+    """
+
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(records, filename):
+    """
+    To save benchmark records to a JSON file, with details of the version
+    and machine they were run on.
+    """
+
+    results = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'numpy': numpy.__version__,
+        'machine': platform.platform(),
+        'records': records
+    }
+
+    with open(filename, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def compare_results(old_filename, new_filename):
+    """
+    To compare two benchmark JSON files and print how much faster (or
+    slower) each function got.
+
+    Returns
+    -------
+    ratios = dict of (function, size, num_labels, radius) to old time / new
+    time, where > 1 means the new version is faster
+    """
+
+    runs = list()
+    for filename in [old_filename, new_filename]:
+        with open(filename) as file:
+            records = json.load(file)['records']
+        runs.append({(r['function'], r['size'], r['num_labels'],
+                      r['radius']): r for r in records})
+
+    ratios = dict()
+    for (key, new) in runs[1].items():
+        if key in runs[0]:
+            old = runs[0][key]
+            ratios[key] = old['seconds'] / new['seconds']
+            print(f"{key[0]:>14} size={key[1]:<5} labels={key[2]:<5} "
+                  f"radius={key[3]:<3} {ratios[key]:8.2f}x  "
+                  f"memory {old['peak_bytes'] / 1e6:.1f} -> "
+                  f"{new['peak_bytes'] / 1e6:.1f} MB")
+
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[512, 1024, 2048])
+    parser.add_argument('--labels', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--radii', type=int, nargs='+', default=[5])
+    parser.add_argument('--bkgd-radius', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', type=str,
+                        default='bench_output.json')
+    parser.add_argument('--compare', type=str, nargs=2,
+                        metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare is not None:
+        compare_results(*args.compare)
+        return
+
+    records = measure_imports(repeat=args.repeat)
+    records += run_benchmarks(args.sizes, args.labels, args.radii,
+                              bkgd_radius=args.bkgd_radius,
+                              repeat=args.repeat)
+    save_results(records, args.output)
+    print(f"Saved {len(records)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,17 @@
+import os
+import sys
+import subprocess
+import tempfile
 import unittest
+from unittest import mock
 import im_lib
 import numpy
+import tifffile
+from matplotlib import pyplot
+from statistics import median
+from scipy.stats import ttest_ind
+from skimage.morphology import dilation, disk
+from im_lib_benchmark import make_disc_mask, make_noisy_image
 
 
 class MaskObjectTest(unittest.TestCase):
@@ -47,6 +58,16 @@ class MaskObjectTest(unittest.TestCase):
         exp = 2
         self.assertEqual(res, exp)
 
+    def test_mo_memoryMap(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'C2-field_seg.npy')
+            exp = make_disc_mask()
+            numpy.save(filename, {'masks': exp, 'flows': [exp, exp]})
+            res = im_lib.mask_object(filename, mmap=True)
+            self.assertIsInstance(res, numpy.memmap)
+            numpy.testing.assert_array_equal(res, exp)
+            del res
+
 
 class ReadImageTest(unittest.TestCase):
 
@@ -78,6 +99,152 @@ class ReadImageTest(unittest.TestCase):
         exp = "<class 'numpy.ndarray'>"
         self.assertEqual(res, exp)
 
+    def test_ri_keepsBitDepth(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'C2-field.tif')
+            exp = numpy.arange(20, dtype=numpy.uint16).reshape(4, 5) * 3000
+            tifffile.imwrite(filename, exp)
+            res = im_lib.read_image(filename)
+            self.assertEqual(res.dtype, numpy.uint16)
+            numpy.testing.assert_array_equal(res, exp)
+
+    def test_ri_channelAndZ(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'stack.tif')
+            stack = numpy.arange(120, dtype=numpy.uint16).reshape(2, 3, 4, 5)
+            tifffile.imwrite(filename, stack, imagej=True,
+                             metadata={'axes': 'ZCYX'})
+            res = im_lib.read_image(filename, channel=2, z=1)
+            numpy.testing.assert_array_equal(res, stack[1, 2])
+            res = im_lib.read_image(filename, page=4)
+            numpy.testing.assert_array_equal(res, stack[1, 1])
+            res = im_lib.read_image(filename, channel=1, cache_dir=folder)
+            numpy.testing.assert_array_equal(res, stack[0, 1])
+            with self.assertRaises(ValueError):
+                im_lib.read_image(filename, channel=3)
+
+    def test_ri_cacheKeyHasReaderVersion(self):
+        # An array decoded by older reader code is not served from the cache.
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'C2-field.tif')
+            exp = numpy.arange(20, dtype=numpy.uint16).reshape(4, 5)
+            tifffile.imwrite(filename, exp)
+            cache_dir = os.path.join(folder, 'cache')
+            im_lib.read_image(filename, cache_dir=cache_dir)
+            (cached,) = [os.path.join(cache_dir, name)
+                         for name in os.listdir(cache_dir)]
+            numpy.save(cached, exp.astype(numpy.float32))
+            res = im_lib.read_image(filename, cache_dir=cache_dir)
+            self.assertEqual(res.dtype, numpy.float32)
+            with mock.patch.object(im_lib, 'IMAGE_READ_FUNCTIONS',
+                                   im_lib.IMAGE_READ_FUNCTIONS[1:]):
+                res = im_lib.read_image(filename, cache_dir=cache_dir)
+            self.assertEqual(res.dtype, numpy.uint16)
+            numpy.testing.assert_array_equal(res, exp)
+
+    def test_ri_channelOfRGB(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'rgb.tif')
+            rgb = numpy.arange(60, dtype=numpy.uint8).reshape(4, 5, 3)
+            tifffile.imwrite(filename, rgb, photometric='rgb')
+            res = im_lib.read_image(filename, channel=1)
+            numpy.testing.assert_array_equal(res, rgb[:, :, 1])
+            with self.assertRaises(ValueError):
+                im_lib.read_image(filename, z=1)
+
+    def test_ri_otherFormats(self):
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'image.png')
+            exp = numpy.zeros((4, 5, 3), dtype=numpy.uint8)
+            exp[1, 2] = 255
+            pyplot.imsave(filename, exp)
+            res = im_lib.read_image(filename)
+            self.assertEqual(res.shape[:2], (4, 5))
+            self.assertEqual(res[1, 2, 0], 1.0)
+
+
+class ObjectSlicesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning ObjectSlices class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning ObjectSlices class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_os_boxHoldsMask(self):
+        mask = make_disc_mask(seed=1)
+        slices = im_lib.object_slices(mask)
+        for label, box in enumerate(slices, start=1):
+            res = numpy.count_nonzero(mask[box] == label)
+            exp = numpy.count_nonzero(mask == label)
+            self.assertEqual(res, exp)
+
+    def test_os_missingMask(self):
+        mask = numpy.zeros((10, 10), dtype=int)
+        mask[2:4, 2:4] = 2
+        slices = im_lib.object_slices(mask)
+        self.assertIsNone(slices[0])
+
+    def test_os_padIsClipped(self):
+        mask = numpy.zeros((10, 10))
+        mask[0:2, 7:9] = 1
+        res = im_lib.object_slices(mask, pad=3)[0]
+        exp = (slice(0, 5), slice(4, 10))
+        self.assertEqual(res, exp)
+
+
+class LabelDtypeTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning LabelDtype class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning LabelDtype class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_ld_smallestType(self):
+        res = [im_lib.label_dtype(n) for n in [0, 255, 256, 65536, 2 ** 32]]
+        exp = [numpy.uint8, numpy.uint8, numpy.uint16, numpy.uint32,
+               numpy.uint64]
+        self.assertEqual(res, exp)
+
+    def test_ld_outputsAreCompact(self):
+        mask = make_disc_mask(num_labels=300, seed=11)
+        img = make_noisy_image(mask, seed=11)
+        bkgd = im_lib.mask_loc_bkgd(mask)
+        res_mask, medians = im_lib.find_object(img, mask, bkgd)
+        overlap = im_lib.find_overlap(mask, mask)
+        for res in [bkgd, res_mask, overlap]:
+            self.assertEqual(res.dtype, numpy.uint16)
+
+    def test_ld_reusesOut(self):
+        out = numpy.full((120, 150), 7, dtype=numpy.uint32)
+        mask = make_disc_mask(seed=12)
+        res = im_lib.mask_loc_bkgd(mask, out=out)
+        self.assertIs(res, out)
+        numpy.testing.assert_array_equal(res, im_lib.mask_loc_bkgd(mask))
+
+    def test_ld_outTooSmall(self):
+        mask = make_disc_mask(num_labels=300, seed=13)
+        out = numpy.zeros((120, 150), dtype=numpy.uint8)
+        with self.assertRaises(ValueError):
+            im_lib.find_overlap(mask, mask, out=out)
+
 
 class MaskLocalBackground(unittest.TestCase):
 
@@ -119,6 +286,47 @@ class MaskLocalBackground(unittest.TestCase):
         res = numpy.amax(loc_mask)
         self.assertEqual(res, exp)
 
+    def test_mlb_matchesDilation(self):
+        for radius in [0, 1, 3, 5, 8]:
+            mask = make_disc_mask(seed=radius)
+            dilated = dilation(mask, disk(radius))
+            exp = numpy.where(mask == 0, dilated, 0)
+            res = im_lib.mask_loc_bkgd(mask, radius=radius)
+            numpy.testing.assert_array_equal(res, exp)
+
+    def test_mlb_edtSamePixels(self):
+        for radius in [0, 1, 3, 5, 8]:
+            mask = make_disc_mask(seed=radius)
+            exp = im_lib.mask_loc_bkgd(mask, radius=radius)
+            res = im_lib.mask_loc_bkgd(mask, radius=radius, method='edt')
+            numpy.testing.assert_array_equal(res > 0, exp > 0)
+            self.assertEqual(res.dtype, exp.dtype)
+
+    def test_mlb_edtNearestObject(self):
+        mask = make_disc_mask(num_labels=40, seed=4)
+        res = im_lib.mask_loc_bkgd(mask, radius=6, method='edt')
+        (obj_rows, obj_cols) = numpy.nonzero(mask)
+        for (row, col) in zip(*numpy.nonzero(res)):
+            sq_distance = (obj_rows - row) ** 2 + (obj_cols - col) ** 2
+            nearest = sq_distance == numpy.amin(sq_distance)
+            self.assertIn(res[row, col],
+                          mask[obj_rows[nearest], obj_cols[nearest]])
+
+    def test_mlb_edtTwoObjectsShare(self):
+        mask = numpy.zeros((9, 21), dtype=int)
+        mask[4, 5] = 2
+        mask[4, 15] = 1
+        res = im_lib.mask_loc_bkgd(mask, radius=8, method='edt')
+        self.assertEqual(res[4, 9], 2)
+        self.assertEqual(res[4, 11], 1)
+        res = im_lib.mask_loc_bkgd(mask, radius=8)
+        self.assertEqual(res[4, 11], 2)
+
+    def test_mlb_badMethod(self):
+        mask = make_disc_mask()
+        with self.assertRaises(ValueError):
+            im_lib.mask_loc_bkgd(mask, method='erosion')
+
     def test_mlb_twoCells(self):
         filename = '/Users/Erin/PycharmProjects/SG_enrichment/demo/C1-twocells_seg.npy'
         mask = im_lib.mask_object(filename)
@@ -167,6 +375,28 @@ class FindObject(unittest.TestCase):
         self.assertFalse(res > max)
 
 
+    def test_fob_matchesPerMaskTest(self):
+        mask = make_disc_mask(num_labels=40, seed=3)
+        img = make_noisy_image(mask, seed=3)
+        mask_bkgd = im_lib.mask_loc_bkgd(mask, radius=3)
+        exp_mask = numpy.zeros(mask.shape)
+        exp_medians = list()
+        for label in range(1, (int(numpy.amax(mask)) + 1)):
+            exp_vals = img[mask == label].astype(int)
+            bkgd_vals = img[mask_bkgd == label].astype(int)
+            if len(exp_vals) < 2 or len(bkgd_vals) < 2:
+                continue
+            (t, p) = ttest_ind(exp_vals, bkgd_vals,
+                               alternative='greater')
+            if p < 0.05:
+                exp_mask[mask == label] = label
+                exp_medians.append((label, median(exp_vals),
+                                    median(bkgd_vals)))
+        res_mask, res_medians = im_lib.find_object(img, mask, mask_bkgd)
+        numpy.testing.assert_array_equal(res_mask, exp_mask)
+        self.assertEqual(res_medians, exp_medians)
+
+
 class FindOverlapTest(unittest.TestCase):
 
     @classmethod
@@ -213,23 +443,282 @@ class FindOverlapTest(unittest.TestCase):
         res = numpy.amax(overlap)
         self.assertEqual(res, exp)
 
-#class CountObjectsTest(unittest.TestCase):
+    def test_fov_matchesPerMaskArea(self):
+        maskA = make_disc_mask(num_labels=30, radius=5, seed=4)
+        maskB = make_disc_mask(num_labels=30, radius=7, seed=5)
+        for threshold in [0.1, 0.5, 0.9]:
+            exp = numpy.zeros(maskA.shape)
+            for label in numpy.unique(maskA[maskA > 0]):
+                mask1 = maskA == label
+                overlap = mask1 & (maskB > 0)
+                if overlap.sum() / mask1.sum() >= threshold:
+                    exp[overlap] = label
+            res = im_lib.find_overlap(maskA, maskB,
+                                      overlap_threshold=threshold)
+            numpy.testing.assert_array_equal(res, exp)
+
+    def test_fov_returnsTable(self):
+        maskA = make_disc_mask(num_labels=30, radius=5, seed=6)
+        maskB = make_disc_mask(num_labels=30, radius=7, seed=7)
+        overlap, res = im_lib.find_overlap(maskA, maskB, return_table=True)
+        exp = list()
+        for label1 in numpy.unique(maskA[maskA > 0]):
+            shared = maskB[(maskA == label1) & (maskB > 0)]
+            for label2 in numpy.unique(shared):
+                exp.append([label1, label2, numpy.sum(shared == label2)])
+        numpy.testing.assert_array_equal(res, numpy.array(exp))
+
+class TiledTest(unittest.TestCase):
 
-    #@classmethod
-    #def setUpClass(clc):
-        #print("\nRunning CountObjects class setUp...")
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning Tiled class setUp...")
 
-    #@classmethod
-    #def tearDownClass(clc):
-        #print("\nRunning CountObjects class tearDown...")
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning Tiled class tearDown...")
 
-    #def setUp(self):
-        #print("\nRunning setUp...")
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.mask = make_disc_mask(num_labels=40, radius=6, seed=9)
+        self.img = make_noisy_image(self.mask, seed=9)
 
-    #def tearDown(self):
-        #print("\nRunning tearDown...")
-        
-    #def test_co(self):
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_ti_tilesCoverImage(self):
+        res = numpy.zeros((50, 70), dtype=int)
+        for (tile, padded, inner) in im_lib.iter_tiles((50, 70), 16, 3):
+            res[tile] += 1
+            self.assertEqual(res[padded][inner].shape, res[tile].shape)
+        numpy.testing.assert_array_equal(res, 1)
+
+    def test_ti_bkgdMatches(self):
+        exp = im_lib.mask_loc_bkgd(self.mask, radius=5)
+        res = im_lib.mask_loc_bkgd_tiled(self.mask, radius=5, tile_size=17)
+        numpy.testing.assert_array_equal(res, exp)
+
+    def test_ti_edtBkgdMatches(self):
+        exp = im_lib.mask_loc_bkgd(self.mask, radius=5, method='edt')
+        res = im_lib.mask_loc_bkgd_tiled(self.mask, radius=5, tile_size=17,
+                                         method='edt')
+        numpy.testing.assert_array_equal(res, exp)
+
+    def test_ti_findObjectMatches(self):
+        bkgd = im_lib.mask_loc_bkgd(self.mask, radius=4)
+        exp_mask, exp_medians = im_lib.find_object(self.img, self.mask, bkgd)
+        res_mask, res_medians = im_lib.find_object_tiled(
+            self.img, self.mask, radius=4, tile_size=23)
+        numpy.testing.assert_array_equal(res_mask, exp_mask)
+        self.assertEqual(res_medians, exp_medians)
+
+    def test_ti_findOverlapMatches(self):
+        maskB = make_disc_mask(num_labels=40, radius=8, seed=10)
+        exp_mask, exp_table = im_lib.find_overlap(
+            self.mask, maskB, overlap_threshold=0.5, return_table=True)
+        res_mask, res_table = im_lib.find_overlap_tiled(
+            self.mask, maskB, overlap_threshold=0.5, tile_size=19,
+            return_table=True)
+        numpy.testing.assert_array_equal(res_mask, exp_mask)
+        numpy.testing.assert_array_equal(res_table, exp_table)
+
+
+class SweepTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning Sweep class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning Sweep class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.mask = make_disc_mask(num_labels=60, radius=4, seed=11)
+        self.img = make_noisy_image(self.mask, seed=11)
+        self.radii = [12, 1, 3, 5, 8]
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_sw_bkgdMatches(self):
+        res = im_lib.mask_loc_bkgd_sweep(self.mask, self.radii)
+        self.assertEqual(sorted(res), sorted(self.radii))
+        for radius in self.radii:
+            exp = im_lib.mask_loc_bkgd(self.mask, radius=radius)
+            numpy.testing.assert_array_equal(res[radius], exp)
+            self.assertEqual(res[radius].dtype, exp.dtype)
+
+    def test_sw_findObjectMatches(self):
+        (exp_stats, sweep) = im_lib.find_object_sweep(self.img, self.mask,
+                                                      self.radii)
+        for radius in self.radii:
+            bkgd = im_lib.mask_loc_bkgd(self.mask, radius=radius)
+            exp_mask, exp_medians = im_lib.find_object(self.img, self.mask,
+                                                       bkgd)
+            significant = sweep[radius]['significant']
+            res_mask = numpy.where(significant[self.mask], self.mask, 0)
+            numpy.testing.assert_array_equal(res_mask, exp_mask)
+            self.assertEqual(sweep[radius]['medians'], exp_medians)
+            exp_count = numpy.bincount(numpy.ravel(bkgd), minlength=61)
+            exp_count[0] = 0
+            numpy.testing.assert_array_equal(
+                sweep[radius]['bkgd_stats']['count'], exp_count)
+
+    def test_sw_edtBkgdMatches(self):
+        res = im_lib.mask_loc_bkgd_sweep(self.mask, self.radii, method='edt')
+        for radius in self.radii:
+            exp = im_lib.mask_loc_bkgd(self.mask, radius=radius, method='edt')
+            numpy.testing.assert_array_equal(res[radius], exp)
+
+    def test_sw_noObjects(self):
+        mask = numpy.zeros((20, 20), dtype=int)
+        res = im_lib.mask_loc_bkgd_sweep(mask, [2, 4])
+        self.assertEqual(numpy.amax(res[4]), 0)
+        (exp_stats, sweep) = im_lib.find_object_sweep(mask, mask, [2, 4])
+        self.assertEqual(sweep[2]['medians'], [])
+
+
+class CountObjectsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning CountObjects class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning CountObjects class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.mask = numpy.zeros((20, 20), dtype=int)
+        self.mask[0:2, 0:2] = 1  # area 4, cell 1
+        self.mask[5:8, 0:3] = 2  # area 9, cell 1
+        self.mask[0:4, 10:14] = 3  # area 16, cell 2
+        self.mask[15:16, 15:16] = 4  # area 1, no cell
+        self.cells = numpy.zeros((20, 20), dtype=int)
+        self.cells[0:10, 0:9] = 1
+        self.cells[0:10, 9:20] = 2
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_co_oneWindow(self):
+        res = im_lib.count_objects(self.mask, 2, 10)
+        exp = 2
+        self.assertEqual(res, exp)
+
+    def test_co_logicalMask(self):
+        res = im_lib.count_objects(self.mask > 0, 1, 16)
+        exp = 4
+        self.assertEqual(res, exp)
+
+    def test_co_manyWindows(self):
+        res = im_lib.count_objects(self.mask, [1, 5, 1], [4, 20, 100])
+        exp = [2, 2, 4]
+        numpy.testing.assert_array_equal(res, exp)
+
+    def test_co_perCell(self):
+        res = im_lib.count_objects(self.mask, [1, 5], [4, 20],
+                                   cell_mask=self.cells)
+        exp = [[1, 0], [1, 1], [0, 1]]
+        numpy.testing.assert_array_equal(res, exp)
+
+    def test_co_emptyMask(self):
+        res = im_lib.count_objects(numpy.zeros((5, 5), dtype=int), 1, 10)
+        exp = 0
+        self.assertEqual(res, exp)
+
+
+class FindEnrichmentTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning FindEnrichment class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning FindEnrichment class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.granules = make_disc_mask(num_labels=40, radius=3, seed=4)
+        self.cells = numpy.zeros_like(self.granules)
+        self.cells[:, :70] = 1
+        self.cells[:100, 80:] = 2
+        self.cells[100:, 80:] = 5
+        self.images = {'C2': make_noisy_image(self.granules, seed=5),
+                       'C3': make_noisy_image(self.granules > 0, seed=6)}
+        self.bkgd = im_lib.mask_loc_bkgd(self.granules, radius=4)
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_fe_matchesPerGranule(self):
+        (res, cells) = im_lib.find_enrichment(self.images, self.granules,
+                                              self.cells, self.bkgd)
+        exp_cells = im_lib._assign_to_cells(self.granules, self.cells)
+        for (row, granule) in enumerate(res['granule']):
+            self.assertEqual(res['cell'][row], exp_cells[granule])
+            self.assertEqual(res['area'][row],
+                             numpy.count_nonzero(self.granules == granule))
+            for (channel, img) in self.images.items():
+                obj = numpy.median(img[self.granules == granule])
+                bkgd = numpy.median(img[self.bkgd == granule])
+                self.assertEqual(res[f"{channel}_object_median"][row], obj)
+                self.assertEqual(res[f"{channel}_bkgd_median"][row], bkgd)
+                self.assertAlmostEqual(res[f"{channel}_enrichment"][row],
+                                       obj / bkgd)
+
+    def test_fe_matchesPerCell(self):
+        (granules, res) = im_lib.find_enrichment(
+            self.images, self.granules, self.cells, radius=4)
+        self.assertEqual(res['cell'].tolist(), [1, 2, 5])
+        img = self.images['C2']
+        for (row, cell) in enumerate(res['cell']):
+            in_cell = granules['granule'][granules['cell'] == cell]
+            self.assertEqual(res['granule_count'][row], len(in_cell))
+            obj = numpy.median(img[numpy.isin(self.granules, in_cell)])
+            bkgd = numpy.median(img[numpy.isin(self.bkgd, in_cell)])
+            self.assertEqual(res['C2_object_median'][row], obj)
+            self.assertEqual(res['C2_bkgd_median'][row], bkgd)
+
+    def test_fe_cellWithoutGranules(self):
+        self.cells[0:5, 0:5] = 9
+        self.cells[self.granules > 0] = numpy.where(
+            self.cells[self.granules > 0] == 9, 1,
+            self.cells[self.granules > 0])
+        (granules, res) = im_lib.find_enrichment(
+            self.images, self.granules, self.cells, self.bkgd)
+        row = res['cell'].tolist().index(9)
+        self.assertEqual(res['granule_count'][row], 0)
+        self.assertTrue(numpy.isnan(res['C2_enrichment'][row]))
+
+
+class ImportTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning Import class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning Import class tearDown...")
+
+    def test_im_heavyModulesNotLoaded(self):
+        heavy = ['matplotlib', 'skimage', 'scipy.stats', 'tifffile']
+        code = (f"import sys, im_lib, batch_lib; "
+                f"print([m for m in {heavy} if m in sys.modules])")
+        folder = os.path.dirname(os.path.abspath(__file__))
+        res = subprocess.run([sys.executable, '-c', code], cwd=folder,
+                             capture_output=True, text=True, check=True)
+        self.assertEqual(res.stdout.strip(), '[]')
+
+    def test_im_diskMatchesSkimage(self):
+        for radius in range(0, 20):
+            numpy.testing.assert_array_equal(im_lib._disk(radius),
+                                             disk(radius))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+import os
+import json
+import hashlib
+import inspect
+import tempfile
+
+"""
+This library keeps a run manifest: for every field, what each stage of the
+analysis was run on. A stage is described by the fingerprints of its input
+files, its parameter values, a hash of the source code of the functions it
+calls, and the keys of the stages it uses the results of. The key of a stage
+is a hash of all of these, so it changes whenever anything the stage depends
+on changes, and it can be used as a cache key for the stage results (see
+cache_lib.load_keyed).
+"""
+
+
+def fingerprint(filename):
+    """
+    To describe the version of an input file.
+
+    Parameters
+    ----------
+    filename = full path of the file
+
+    Returns
+    -------
+    file_info = dict of the full path, size in bytes and modification time
+    in nanoseconds of the file
+    """
+
+    info = os.stat(filename)
+    file_info = {
+        'path': os.path.abspath(filename),
+        'size': info.st_size,
+        'mtime_ns': info.st_mtime_ns
+    }
+
+    return file_info
+
+
+_code_versions = dict()
+
+
+def code_version(functions):
+    """
+    To find the version of the code used by a stage.
+
+    Parameters
+    ----------
+    functions = list of the functions the stage calls
+
+    Returns
+    -------
+    version = str of a hash of the source code of the functions
+    """
+
+    functions = tuple(functions)
+    if functions not in _code_versions:
+        source = ''.join(inspect.getsource(function)
+                         for function in functions)
+        _code_versions[functions] = hashlib.sha1(source.encode()).hexdigest()
+
+    return _code_versions[functions]
+
+
+def stage_record(files, parameters, functions, upstream=()):
+    """
+    To describe one run of a stage of the analysis.
+
+    Parameters
+    ----------
+    files = list of full paths of the input files of the stage
+
+    parameters = dict of the parameter values of the stage
+
+    functions = list of the functions the stage calls
+
+    upstream = list of records of the stages whose results this stage uses
+    The default value is () (no stages).
+
+    Returns
+    -------
+    record = dict with the 'inputs' (fingerprints of files), 'parameters',
+    'code' (from code_version), 'upstream' (keys of the upstream stages) and
+    'key', a hash of all of these
+    """
+
+    record = {
+        'inputs': [fingerprint(filename) for filename in files],
+        'parameters': dict(parameters),
+        'code': code_version(functions),
+        'upstream': [stage['key'] for stage in upstream]
+    }
+    text = json.dumps(record, sort_keys=True)
+    record['key'] = hashlib.sha1(text.encode()).hexdigest()
+
+    return record
+
+
+def changed_stages(old_stages, new_stages):
+    """
+    To find the stages that have to be run again.
+
+    Parameters
+    ----------
+    old_stages = dict of stage name to record from an earlier run, e.g. from
+    the manifest (None if the field was not run before)
+
+    new_stages = dict of stage name to record for this run
+
+    Returns
+    -------
+    changed = list of the names of the stages in new_stages whose key is not
+    the same as in old_stages
+    """
+
+    old_stages = old_stages or dict()
+    changed = [name for (name, record) in new_stages.items()
+               if old_stages.get(name, {}).get('key') != record['key']]
+
+    return changed
+
+
+def load_manifest(filename):
+    """
+    To read a run manifest. The manifest has one line of JSON for each field
+    that was run, and a later line for the same field replaces an earlier
+    one. A last line that was only partly written is skipped.
+
+    Parameters
+    ----------
+    filename = full path of the manifest file
+
+    Returns
+    -------
+    manifest = dict of field ID to the dict of stage records of that field,
+    empty if the file does not exist
+    """
+
+    manifest = dict()
+    try:
+        with open(filename) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                manifest[entry['field_id']] = entry['stages']
+    except FileNotFoundError:
+        pass
+
+    return manifest
+
+
+def add_field(filename, field_id, stages):
+    """
+    To add the stage records of one field to the end of a run manifest, so
+    that a crash only loses the field being written.
+
+    Parameters
+    ----------
+    filename = full path of the manifest file, made if it does not exist
+
+    field_id = str of the ID of the field
+
+    stages = dict of stage name to record of the field
+    """
+
+    line = json.dumps({'field_id': field_id, 'stages': stages},
+                      sort_keys=True)
+    with open(filename, 'a') as file:
+        file.write(line + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def write_manifest(manifest, filename):
+    """
+    To write a whole run manifest, with one line for each field. It is
+    written to a temporary file first and then renamed, so a crash never
+    leaves a partial manifest.
+
+    Parameters
+    ----------
+    manifest = dict of field ID to the dict of stage records of that field
+
+    filename = full path of the manifest file
+    """
+
+    folder = os.path.dirname(os.path.abspath(filename))
+    (handle, tmp_file) = tempfile.mkstemp(suffix='.tmp', dir=folder)
+    try:
+        with os.fdopen(handle, 'w') as file:
+            for (field_id, stages) in sorted(manifest.items()):
+                line = json.dumps({'field_id': field_id, 'stages': stages},
+                                  sort_keys=True)
+                file.write(line + '\n')
+        os.replace(tmp_file, filename)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+import manifest_lib
+
+
+class ManifestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning Manifest class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning Manifest class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, 'source.txt')
+        with open(self.source, 'w') as file:
+            file.write('a')
+        self.filename = os.path.join(self.tmp.name, 'manifest.jsonl')
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def record(self, **parameters):
+        return manifest_lib.stage_record([self.source], parameters,
+                                         [manifest_lib.fingerprint])
+
+    def test_mf_keyFollowsInputs(self):
+        first = self.record(radius=5)
+        self.assertEqual(first['key'], self.record(radius=5)['key'])
+        self.assertNotEqual(first['key'], self.record(radius=3)['key'])
+        with open(self.source, 'w') as file:
+            file.write('ab')
+        self.assertNotEqual(first['key'], self.record(radius=5)['key'])
+
+    def test_mf_keyFollowsUpstream(self):
+        first = manifest_lib.stage_record([], {}, [manifest_lib.fingerprint],
+                                          upstream=[self.record(radius=5)])
+        second = manifest_lib.stage_record([], {}, [manifest_lib.fingerprint],
+                                           upstream=[self.record(radius=3)])
+        self.assertNotEqual(first['key'], second['key'])
+
+    def test_mf_changedStages(self):
+        old = {'a': self.record(radius=5), 'b': self.record(radius=1)}
+        new = {'a': self.record(radius=5), 'b': self.record(radius=2)}
+        self.assertEqual(manifest_lib.changed_stages(old, new), ['b'])
+        self.assertEqual(manifest_lib.changed_stages(None, new), ['a', 'b'])
+
+    def test_mf_laterLinesReplace(self):
+        manifest_lib.add_field(self.filename, 'f1', {'a': 1})
+        manifest_lib.add_field(self.filename, 'f2', {'a': 2})
+        manifest_lib.add_field(self.filename, 'f1', {'a': 3})
+        # a line that was only partly written
+        with open(self.filename, 'a') as file:
+            file.write('{"field_id": "f3", "sta')
+        res = manifest_lib.load_manifest(self.filename)
+        self.assertEqual(res, {'f1': {'a': 3}, 'f2': {'a': 2}})
+        manifest_lib.write_manifest(res, self.filename)
+        self.assertEqual(manifest_lib.load_manifest(self.filename), res)
+
+    def test_mf_missingFile(self):
+        self.assertEqual(manifest_lib.load_manifest(self.filename), dict())
+
+
+if __name__ == "__main__":
+    unittest.main()
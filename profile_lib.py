@@ -0,0 +1,206 @@
+import csv
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager
+import numpy
+
+"""
+This library records how long each stage of the analysis takes, so slow
+stages and slow fields can be found. Recording is off until it is turned on
+with recording(), and then every call of an instrumented function adds one
+record with its wall time, CPU time, peak memory allocated and array sizes,
+tagged with the field being analysed.
+"""
+
+_enabled = False
+_field_id = None
+_records = list()
+# [start, peak] of each instrumented call running, outermost first, in
+# bytes of tracemalloc traced memory.
+_calls = list()
+
+
+def instrument(function):
+    """
+    To make a function add a record for each call while recording is on.
+    Used as a decorator on the im_lib functions.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return function(*args, **kwargs)
+
+        _start_peak()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            peak = _end_peak()
+
+        arrays = [value for value in list(args) + list(kwargs.values())
+                  if isinstance(value, numpy.ndarray)]
+        _records.append({
+            'field_id': _field_id,
+            'stage': function.__name__,
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'peak_alloc_bytes': peak,
+            'input_shape': arrays[0].shape if len(arrays) > 0 else None,
+            'input_bytes': sum(array.nbytes for array in arrays),
+            'output_bytes': _nbytes(result)
+        })
+
+        return result
+
+    return wrapper
+
+
+def _start_peak():
+    """
+    To start measuring the peak memory allocated by a call.
+
+    tracemalloc keeps one peak for the whole process, so the peak is reset
+    for each call. Before the reset, the peak so far of each call still
+    running is kept in _calls, so an instrumented function called by
+    another does not hide the peak of the outer call.
+    """
+
+    (current, peak) = tracemalloc.get_traced_memory()
+    for call in _calls:
+        call[1] = max(call[1], peak - call[0])
+
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        # Python 3.8 has no reset_peak. This resets the peak too, but also
+        # forgets the memory already allocated, so the starts are moved.
+        tracemalloc.clear_traces()
+        for call in _calls:
+            call[0] = call[0] - current
+
+    _calls.append([tracemalloc.get_traced_memory()[0], 0])
+
+
+def _end_peak():
+    """
+    To find the peak memory allocated by the call started last with
+    _start_peak(), in bytes above the memory allocated when it started.
+    """
+
+    (start, peak_before) = _calls.pop()
+    peak = tracemalloc.get_traced_memory()[1]
+
+    return max(peak_before, peak - start)
+
+
+def _nbytes(result):
+    """
+    To add up the size of the NumPy arrays in a function result.
+    """
+
+    if isinstance(result, numpy.ndarray):
+        return result.nbytes
+    if isinstance(result, tuple):
+        return sum(_nbytes(value) for value in result)
+    return 0
+
+
+@contextmanager
+def recording(field_id=None):
+    """
+    To turn recording on inside a with block, tagging records with a field.
+    Memory is traced with tracemalloc while recording is on, which counts
+    the arrays made by NumPy but not memory used inside other C libraries,
+    and makes Python itself a little slower.
+
+    Parameters
+    ----------
+    field_id = str of the field being analysed, or None
+
+    Returns
+    -------
+    records = list that the records made inside the block are added to
+    """
+
+    global _enabled, _field_id
+
+    (was_enabled, old_field_id) = (_enabled, _field_id)
+    start = len(_records)
+    records = list()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _enabled = True
+    _field_id = field_id
+    try:
+        yield records
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        records.extend(_records[start:])
+        del _records[start:]
+        (_enabled, _field_id) = (was_enabled, old_field_id)
+        # Records made in an outer block keep these too.
+        if was_enabled:
+            _records.extend(records)
+
+
+def profile_table(records):
+    """
+    To sum up records by stage, so the stage taking the most time stands
+    out.
+
+    Parameters
+    ----------
+    records = list of record dicts from recording()
+
+    Returns
+    -------
+    table = list of dicts, one for each stage, sorted by total wall time
+    (largest first), with the number of calls, total and mean wall time,
+    total CPU time, largest peak memory allocated by one call, and the
+    slowest field
+    """
+
+    stages = dict()
+    for record in records:
+        stages.setdefault(record['stage'], list()).append(record)
+
+    table = list()
+    for (stage, stage_records) in stages.items():
+        slowest = max(stage_records, key=lambda record: record['wall_s'])
+        wall = sum(record['wall_s'] for record in stage_records)
+        peaks = [record['peak_alloc_bytes'] for record in stage_records]
+        table.append({
+            'stage': stage,
+            'calls': len(stage_records),
+            'total_wall_s': wall,
+            'mean_wall_s': wall / len(stage_records),
+            'total_cpu_s': sum(record['cpu_s'] for record in stage_records),
+            'max_peak_alloc_bytes': max(peaks),
+            'slowest_field_id': slowest['field_id'],
+            'slowest_wall_s': slowest['wall_s']
+        })
+
+    table.sort(key=lambda row: row['total_wall_s'], reverse=True)
+
+    return table
+
+
+def write_profile(rows, filename):
+    """
+    To write records from recording(), or rows from profile_table(), to a
+    csv file with one column for each key.
+    """
+
+    header = list(rows[0].keys()) if len(rows) > 0 else list()
+    with open(filename, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=header)
+        writer.writeheader()
+        writer.writerows(rows)
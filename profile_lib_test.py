@@ -0,0 +1,89 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+import numpy
+import im_lib
+import profile_lib
+from im_lib_benchmark import make_disc_mask, make_noisy_image
+
+
+class RecordingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning Recording class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning Recording class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.mask = make_disc_mask(seed=8)
+        self.img = make_noisy_image(self.mask, seed=8)
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def run_stages(self):
+        bkgd = im_lib.mask_loc_bkgd(self.mask)
+        im_lib.find_object(self.img, self.mask, bkgd)
+
+    def test_rec_offByDefault(self):
+        self.run_stages()
+        self.assertEqual(profile_lib._records, [])
+
+    def test_rec_recordsStages(self):
+        with profile_lib.recording('field_1') as records:
+            self.run_stages()
+        res = [(r['field_id'], r['stage']) for r in records]
+        exp = [('field_1', 'mask_loc_bkgd'), ('field_1', 'find_object')]
+        self.assertEqual(res, exp)
+        self.assertEqual(records[0]['input_shape'], self.mask.shape)
+        self.assertEqual(records[0]['input_bytes'], self.mask.nbytes)
+        self.assertGreater(records[1]['output_bytes'], 0)
+
+    def test_rec_peakOfEachCall(self):
+        # The second call is smaller than the first but still has a peak,
+        # and the outer call keeps the peak of the call inside it.
+        @profile_lib.instrument
+        def allocate(num_bytes):
+            return numpy.ones(num_bytes, dtype=numpy.uint8).sum()
+
+        @profile_lib.instrument
+        def outer():
+            allocate(4_000_000)
+            return numpy.ones(10, dtype=numpy.uint8)
+
+        with profile_lib.recording('field_1') as records:
+            allocate(8_000_000)
+            allocate(2_000_000)
+            outer()
+        peaks = [r['peak_alloc_bytes'] for r in records]
+        self.assertGreaterEqual(peaks[0], 8_000_000)
+        self.assertGreaterEqual(peaks[1], 2_000_000)
+        self.assertLess(peaks[1], 8_000_000)
+        self.assertEqual([r['stage'] for r in records[2:]],
+                         ['allocate', 'outer'])
+        self.assertGreaterEqual(peaks[3], 4_000_000)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def test_rec_profileTable(self):
+        with profile_lib.recording('a') as records:
+            self.run_stages()
+        with profile_lib.recording('b') as more:
+            self.run_stages()
+        table = profile_lib.profile_table(records + more)
+        res = sorted((row['stage'], row['calls']) for row in table)
+        exp = [('find_object', 2), ('mask_loc_bkgd', 2)]
+        self.assertEqual(res, exp)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'profile.csv')
+            profile_lib.write_profile(table, filename)
+            with open(filename) as file:
+                self.assertEqual(len(file.readlines()), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import os
+import math
+import csv
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy
+import im_lib
+from batch_lib import field_id, seg_filename
+
+"""
+This library saves quality control (QC) images of many fields without a
+display: an overlay of the granule masks on the image of each field, and a
+contact sheet of small copies of all overlays of a plate. Fields are drawn
+in parallel processes.
+"""
+
+
+def render_field(files, directories, out_dir, downsample=1, thumb_size=128,
+                 channel=None):
+    """
+    To save the QC overlay of one field: the C2 image in pink/purple and the
+    C1 granule masks in green.
+
+    Parameters
+    ----------
+    files = list of the C1, C2 and C3 image filenames of the field
+
+    directories = list of the C1, C2 and C3 folders the files are in
+
+    out_dir = full path of the folder to save the overlay in
+
+    downsample = int for the factor to shrink the overlay by
+    The default value is 1 (none).
+
+    thumb_size = int for the largest side in pixels of the thumbnail
+    The default value is 128 pixels.
+
+    channel = optional str of the prefix of the C1 channel, to find the field
+    ID with (see batch_lib.field_id)
+
+    Returns
+    -------
+    result = dict with the field ID, the full path of the PNG file, the
+    thumbnail (NumPy array of uint8) and the error (None if none)
+    """
+
+    paths = [os.path.join(folder, file)
+             for (folder, file) in zip(directories, files)]
+    result = {
+        'field_id': field_id(files[0], channel),
+        'filename': None,
+        'thumbnail': None,
+        'error': None
+    }
+
+    try:
+        img = im_lib.read_image(paths[1])
+        granules = im_lib.mask_object(seg_filename(paths[0]))
+
+        # Stretch the image so the brightest pixels are white, finding them
+        # from every 4th row and column.
+        top = numpy.percentile(img[::4, ::4], 99.5)
+        img = img * (1 / top if top > 0 else 1)
+
+        filename = os.path.join(out_dir, f"{result['field_id']}_qc.png")
+        overlay = im_lib.save_moi(filename, img, (granules > 0) * 0.5, img,
+                                  downsample=downsample)
+
+        factor = math.ceil(max(overlay.shape[:2]) / thumb_size)
+        thumbnail = im_lib._downsample(overlay, factor)
+        result['filename'] = filename
+        result['thumbnail'] = numpy.round(thumbnail).astype(numpy.uint8)
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    return result
+
+
+def contact_sheet(thumbnails, columns=None):
+    """
+    To put thumbnails side by side in a grid, in rows from the top left.
+
+    Parameters
+    ----------
+    thumbnails = list of RGB NumPy arrays of uint8, or None for an empty
+    tile (e.g. a field that could not be drawn)
+
+    columns = optional int for the number of tiles in a row
+    The default is about the square root of the number of thumbnails.
+
+    Returns
+    -------
+    sheet = RGB NumPy array of uint8 of the grid
+
+    positions = list of (row, column) of the tile of each thumbnail
+    """
+
+    count = max(len(thumbnails), 1)
+    if columns is None:
+        columns = math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+
+    shapes = [thumb.shape for thumb in thumbnails if thumb is not None]
+    tile_rows = max([shape[0] for shape in shapes], default=1)
+    tile_columns = max([shape[1] for shape in shapes], default=1)
+
+    sheet = numpy.zeros((rows * tile_rows, columns * tile_columns, 3),
+                        dtype=numpy.uint8)
+    positions = list()
+    for (index, thumb) in enumerate(thumbnails):
+        (row, column) = divmod(index, columns)
+        positions.append((row, column))
+        if thumb is not None:
+            top = row * tile_rows
+            left = column * tile_columns
+            sheet[top:(top + thumb.shape[0]),
+                  left:(left + thumb.shape[1])] = thumb
+
+    return sheet, positions
+
+
+def render_plate(matched_images, directories, out_dir, name='plate',
+                 downsample=1, thumb_size=128, num_workers=1, channel=None):
+    """
+    To save the QC overlay of every field of a plate, and a contact sheet of
+    all of them with an index of which field is where.
+
+    Parameters
+    ----------
+    matched_images = list of [C1, C2, C3] filenames from
+    FileFunctions.matching_channels
+
+    directories = list of the C1, C2 and C3 folders the files are in
+
+    out_dir = full path of the folder to save the images in, made if it does
+    not exist
+
+    name = str to start the names of the contact sheet files with
+    The default value is 'plate'.
+
+    downsample = int for the factor to shrink each overlay by
+    The default value is 1 (none).
+
+    thumb_size = int for the largest side in pixels of each thumbnail
+    The default value is 128 pixels.
+
+    num_workers = int for number of processes to use, 1 = no extra processes
+    The default value is 1.
+
+    channel = optional str of the prefix of the C1 channel (see
+    batch_lib.field_id)
+
+    Returns
+    -------
+    results = list of result dicts from render_field (without thumbnails),
+    in the same order as matched_images
+
+    Saves '<name>_contact_sheet.png' and '<name>_contact_sheet.csv' in
+    out_dir. The csv has one row for each field with the tile row and
+    column on the sheet, the overlay file and any error.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    render = partial(render_field, directories=directories, out_dir=out_dir,
+                     downsample=downsample, thumb_size=thumb_size,
+                     channel=channel)
+
+    if num_workers <= 1:
+        results = [render(files) for files in matched_images]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunksize = max(1, len(matched_images) // (4 * num_workers))
+            results = list(executor.map(render, matched_images,
+                                        chunksize=chunksize))
+
+    (sheet, positions) = contact_sheet(
+        [result.pop('thumbnail') for result in results])
+    im_lib.write_png(os.path.join(out_dir, f"{name}_contact_sheet.png"),
+                     sheet)
+
+    with open(os.path.join(out_dir, f"{name}_contact_sheet.csv"), 'w',
+              newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['field_id', 'row', 'column', 'filename', 'error'])
+        for (result, (row, column)) in zip(results, positions):
+            error = result['error']
+            writer.writerow([result['field_id'], row, column,
+                             result['filename'],
+                             None if error is None
+                             else error.strip().splitlines()[-1]])
+
+    return results
@@ -0,0 +1,111 @@
+import os
+import csv
+import tempfile
+import unittest
+import numpy
+from matplotlib import pyplot
+import im_lib
+import qc_lib
+from batch_lib_test import write_field
+
+
+class WritePngTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning WritePng class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning WritePng class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'image.png')
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def test_wp_rgb(self):
+        exp = numpy.random.default_rng(0).integers(0, 256, (7, 9, 3),
+                                                   dtype=numpy.uint8)
+        im_lib.write_png(self.filename, exp)
+        res = numpy.round(pyplot.imread(self.filename) * 255)
+        numpy.testing.assert_array_equal(res, exp)
+
+    def test_wp_gray(self):
+        exp = numpy.arange(60, dtype=numpy.uint8).reshape(6, 10)
+        im_lib.write_png(self.filename, exp)
+        res = numpy.round(pyplot.imread(self.filename) * 255)
+        numpy.testing.assert_array_equal(res, exp)
+
+    def test_wp_saveMoiDownsample(self):
+        img = numpy.zeros((10, 12))
+        img[:2, :2] = 1
+        res = im_lib.save_moi(self.filename, img, img * 0.5, img * 2,
+                              downsample=2)
+        self.assertEqual(res.shape, (5, 6, 3))
+        numpy.testing.assert_array_equal(res[0, 0], [255, 128, 255])
+        numpy.testing.assert_array_equal(res[1, 1], [0, 0, 0])
+
+
+class RenderPlateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning RenderPlate class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning RenderPlate class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.tmp = tempfile.TemporaryDirectory()
+        self.directories = list()
+        for channel in ['C1', 'C2', 'C3']:
+            folder = os.path.join(self.tmp.name, channel)
+            os.mkdir(folder)
+            self.directories.append(folder)
+        self.matched = [write_field(self.directories, f"field_{i:03d}", i)
+                        for i in range(5)]
+        self.out_dir = os.path.join(self.tmp.name, 'qc')
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+        self.tmp.cleanup()
+
+    def test_rp_contactSheet(self):
+        os.remove(os.path.join(self.directories[1], self.matched[3][1]))
+        res = qc_lib.render_plate(self.matched, self.directories,
+                                  self.out_dir, downsample=2, thumb_size=32,
+                                  num_workers=2)
+        self.assertEqual([r['field_id'] for r in res],
+                         [f"field_{i:03d}" for i in range(5)])
+        self.assertIsNotNone(res[3]['error'])
+        overlay = pyplot.imread(res[0]['filename'])
+        self.assertEqual(overlay.shape, (60, 75, 3))
+        sheet = pyplot.imread(os.path.join(self.out_dir,
+                                           'plate_contact_sheet.png'))
+        # 2 x 3 tiles of 20 x 25 thumbnails
+        self.assertEqual(sheet.shape, (40, 75, 3))
+        with open(os.path.join(self.out_dir, 'plate_contact_sheet.csv'),
+                  newline='') as file:
+            rows = list(csv.reader(file))
+        self.assertEqual(rows[4][:3], ['field_003', '1', '0'])
+        self.assertIn('FileNotFoundError', rows[4][4])
+
+    def test_rp_contactSheetPositions(self):
+        thumbs = [numpy.full((2, 3, 3), i, dtype=numpy.uint8)
+                  for i in range(1, 4)] + [None]
+        (sheet, positions) = qc_lib.contact_sheet(thumbs)
+        self.assertEqual(sheet.shape, (4, 6, 3))
+        self.assertEqual(positions, [(0, 0), (0, 1), (1, 0), (1, 1)])
+        self.assertEqual(sheet[2, 0, 0], 3)
+        self.assertEqual(sheet[3, 5, 0], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import unittest
+import numpy
+import stats_lib
+from scipy.stats import ttest_ind_from_stats
+
+
+class GroupedStatsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning GroupedStats class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning GroupedStats class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        self.rng = numpy.random.default_rng(0)
+        self.labels = self.rng.integers(1, 40, 5000)
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def check(self, values, num_labels=42):
+        stats = stats_lib.grouped_stats(self.labels, values, num_labels)
+        for label in range(num_labels + 1):
+            vals = values[self.labels == label].astype(float)
+            if len(vals) == 0:
+                self.assertEqual(stats['count'][label], 0)
+                self.assertTrue(numpy.isnan(stats['median'][label]))
+                continue
+            self.assertEqual(stats['count'][label], len(vals))
+            self.assertEqual(stats['median'][label], numpy.median(vals))
+            numpy.testing.assert_allclose(stats['mean'][label],
+                                          numpy.mean(vals))
+            numpy.testing.assert_allclose(stats['var'][label],
+                                          numpy.var(vals, ddof=1))
+
+    def test_gs_uint16(self):
+        self.check(self.rng.integers(0, 65536, 5000).astype(numpy.uint16))
+
+    def test_gs_signed(self):
+        self.check(self.rng.integers(-30000, 30000, 5000).astype(numpy.int16))
+
+    def test_gs_wideIntegers(self):
+        # Too wide to pack into a key, so sorted by label and value. The
+        # values are multiples of 2 ** 20 so they are exact as floats.
+        self.check(self.rng.integers(-2 ** 42, 2 ** 42, 5000) * 2 ** 20)
+
+    def test_gs_float(self):
+        self.check(self.rng.normal(100, 20, 5000))
+
+    def test_gs_labelsAboveNumLabels(self):
+        values = self.rng.integers(0, 100, 5000).astype(numpy.uint8)
+        stats = stats_lib.grouped_stats(self.labels, values, 20)
+        self.assertEqual(len(stats['median']), 21)
+        self.assertEqual(stats['median'][20],
+                         numpy.median(values[self.labels == 20]))
+
+    def test_gs_noPixels(self):
+        stats = stats_lib.grouped_stats(numpy.zeros(0, dtype=int),
+                                        numpy.zeros(0, dtype=numpy.uint16), 3)
+        self.assertTrue(numpy.isnan(stats['median']).all())
+
+
+class PooledTTestTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(clc):
+        print("\nRunning PooledTTest class setUp...")
+
+    @classmethod
+    def tearDownClass(clc):
+        print("\nRunning PooledTTest class tearDown...")
+
+    def setUp(self):
+        print("\nRunning setUp...")
+        rng = numpy.random.default_rng(1)
+        self.stats = [rng.normal(size=50), rng.random(50),
+                      rng.integers(2, 30, 50),
+                      rng.normal(size=50), rng.random(50),
+                      rng.integers(2, 30, 50)]
+
+    def tearDown(self):
+        print("\nRunning tearDown...")
+
+    def test_tt_matchesScipy(self):
+        (mean1, var1, count1, mean2, var2, count2) = self.stats
+        for alternative in ['greater', 'less', 'two-sided']:
+            (t, p) = stats_lib.pooled_t_test(*self.stats,
+                                             alternative=alternative)
+            (exp_t, exp_p) = ttest_ind_from_stats(
+                mean1, numpy.sqrt(var1), count1,
+                mean2, numpy.sqrt(var2), count2,
+                equal_var=True, alternative=alternative)
+            numpy.testing.assert_allclose(t, exp_t)
+            numpy.testing.assert_allclose(p, exp_p)
+
+    def test_tt_oneTailedIsHalf(self):
+        (t, one) = stats_lib.pooled_t_test(*self.stats)
+        (t, two) = stats_lib.pooled_t_test(*self.stats,
+                                           alternative='two-sided')
+        higher = t > 0
+        numpy.testing.assert_allclose(one[higher], two[higher] / 2)
+
+    def test_tt_tooFewValues(self):
+        (t, p) = stats_lib.pooled_t_test(numpy.array([5.0]), numpy.array([0]),
+                                         numpy.array([1]), numpy.array([1.0]),
+                                         numpy.array([0]), numpy.array([1]))
+        self.assertTrue(numpy.isnan(p[0]))
+
+    def test_tt_badAlternative(self):
+        with self.assertRaises(ValueError):
+            stats_lib.pooled_t_test(*self.stats, alternative='bigger')
+
+
+if __name__ == "__main__":
+    unittest.main()